@@ -238,6 +238,11 @@ parser.add_argument(
     action="store_true",
     help="Images will be saved as JPEG format",
 )
+parser.add_argument(
+    "--usewebp",
+    action="store_true",
+    help="Images will be saved as WebP format",
+)
 parser.add_argument(
     "--noimagesave",
     action="store_true",
@@ -258,12 +263,49 @@ parser.add_argument(
     help="LoRA adapter weight [0 to 1.0]",
     default=0.5,
 )
+parser.add_argument(
+    "--openvino_cache",
+    type=str,
+    choices=["list", "prune", "clear"],
+    help="List, prune or clear the OpenVINO compiled models cache",
+    default=None,
+)
+parser.add_argument(
+    "--image_index",
+    type=str,
+    choices=["search", "backfill", "stats"],
+    help="Search the generated images (by --prompt and --seed), index the saved images or show the index stats",
+    default=None,
+)
+parser.add_argument(
+    "--limit",
+    type=int,
+    help="Maximum number of images listed by --image_index search",
+    default=20,
+)
 parser.add_argument(
     "--port",
     type=int,
     help="Web server port",
     default=8000,
 )
+parser.add_argument(
+    "--workers",
+    type=int,
+    help="Number of API worker processes, 0 to generate in the API server process",
+    default=constants.API_WORKERS,
+)
+parser.add_argument(
+    "--prefork",
+    action="store_true",
+    help="Load the model once and fork the API workers, which share its memory (Linux)",
+)
+parser.add_argument(
+    "--worker_threads",
+    type=int,
+    help="Threads per API worker process, 0 to share the CPU cores between workers",
+    default=constants.API_WORKER_THREADS,
+)
 
 args = parser.parse_args()
 
@@ -271,6 +313,58 @@ if args.version:
     print(APP_VERSION)
     exit()
 
+if args.openvino_cache:
+    from datetime import datetime
+
+    from backend.openvino import compiled_model_cache
+
+    if args.openvino_cache == "prune":
+        compiled_model_cache.prune()
+    elif args.openvino_cache == "clear":
+        compiled_model_cache.clear()
+    print(
+        f"OpenVINO compiled models cache : {FastStableDiffusionPaths.get_openvino_cache_path()}"
+    )
+    cache_entries = compiled_model_cache.list_cache()
+    for entry in cache_entries:
+        last_used = datetime.fromtimestamp(entry["last_used"])
+        print(
+            f"{entry['cache_dir']:60} {entry['blobs']:4} blobs"
+            f" {entry['size_mb']:10.1f} MB  {last_used:%Y-%m-%d %H:%M}"
+        )
+    total_size = sum(entry["size_mb"] for entry in cache_entries)
+    print(f"Total size : {total_size:.1f} MB")
+    exit()
+
+if args.image_index:
+    from datetime import datetime
+
+    from backend.image_index import ImageIndex
+
+    index = ImageIndex()
+    if args.image_index == "backfill":
+        print(f"Indexing the images saved in {FastStableDiffusionPaths.get_results_path()}")
+        added = index.backfill()
+        print(f"Added {added} generations")
+    elif args.image_index == "search":
+        images = index.search(
+            prompt=args.prompt,
+            seed=args.seed if args.seed > -1 else None,
+            limit=args.limit,
+        )
+        for image in images:
+            created_at = datetime.fromtimestamp(image["created_at"])
+            print(
+                f"{created_at:%Y-%m-%d %H:%M}  seed {str(image['seed']):12}"
+                f" {image['path']}\n    {image['prompt']}"
+            )
+    stats = index.get_stats()
+    print(
+        f"Image index : {stats['db_path']} ({stats['generations']} generations,"
+        f" {stats['images']} images, {stats['size_mb']} MB)"
+    )
+    exit()
+
 # parser.print_help()
 print("FastSD CPU - ", APP_VERSION)
 show_system_info()
@@ -331,14 +425,22 @@ elif args.realtime:
 elif args.api:
     from backend.api.web import start_web_server
 
-    start_web_server(args.port)
+    app_settings.disable_save()
+    start_web_server(
+        args.port,
+        args.workers,
+        args.worker_threads,
+        args.prefork,
+    )
 elif args.mcp:
     from backend.api.mcp_server import start_mcp_server
 
+    app_settings.disable_save()
     start_mcp_server(args.port)
 elif args.hfdemo:
     from frontend.webui.hf_demo import start_demo
 
+    app_settings.disable_save()
     start_demo()
 else:
     context = get_context(InterfaceType.CLI)
@@ -367,11 +469,12 @@ else:
     config.lcm_diffusion_setting.lora.enabled = False
     config.lcm_diffusion_setting.lora.path = args.lora
     config.lcm_diffusion_setting.lora.weight = args.lora_weight
-    config.lcm_diffusion_setting.lora.fuse = False
     if config.lcm_diffusion_setting.lora.path:
         config.lcm_diffusion_setting.lora.enabled = True
     if args.usejpeg:
         config.generated_images.format = ImageFormat.JPEG.value.upper()
+    elif args.usewebp:
+        config.generated_images.format = ImageFormat.WEBP.value.upper()
     if args.seed > -1:
         config.lcm_diffusion_setting.use_seed = True
     else:
@@ -398,7 +501,6 @@ else:
     # Interactive mode
     if args.interactive:
         # wrapper(interactive_mode, config, context)
-        config.lcm_diffusion_setting.lora.fuse = False
         interactive_mode(config, context)
 
     # Start of non-interactive CLI image generation
@@ -483,11 +585,11 @@ else:
 
             print("Starting benchmark please wait...")
             for _ in range(3):
-                context.generate_text_to_image(
+                result = context.generate(
                     settings=config,
                     device=DEVICE,
                 )
-                latencies.append(context.latency)
+                latencies.append(result.latency)
 
             avg_latency = sum(latencies) / 3
 
@@ -499,11 +601,11 @@ else:
             )
             latencies = []
             for _ in range(3):
-                context.generate_text_to_image(
+                result = context.generate(
                     settings=config,
                     device=DEVICE,
                 )
-                latencies.append(context.latency)
+                latencies.append(result.latency)
 
             avg_latency_taesd = sum(latencies) / 3
 
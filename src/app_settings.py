@@ -1,7 +1,7 @@
-from copy import deepcopy
 from os import makedirs, path
 
 import yaml
+from backend.settings_persister import SettingsPersister
 from constants import (
     LCM_LORA_MODELS_FILE,
     LCM_MODELS_FILE,
@@ -39,6 +39,10 @@ class AppSettings:
             join_paths(FastStableDiffusionPaths().get_gguf_models_path(), "llm")
         )
         self._config = None
+        self._persister = SettingsPersister(
+            self.config_path,
+            self._get_configurations,
+        )
 
     @property
     def settings(self):
@@ -104,17 +108,21 @@ class AppSettings:
                 print(f"Error in loading settings : {ex}")
 
     def save(self):
-        try:
-            with open(self.config_path, "w") as file:
-                tmp_cfg = deepcopy(self._config)
-                tmp_cfg.lcm_diffusion_setting.init_image = None
-                configurations = tmp_cfg.model_dump(
-                    exclude=["init_image"],
-                )
-                if configurations:
-                    yaml.dump(configurations, file)
-        except Exception as ex:
-            print(f"Error in saving settings : {ex}")
+        """Saves the settings in the background, see _SettingsPersister_."""
+        self._persister.schedule()
+
+    def flush(self):
+        """Writes the pending settings changes now."""
+        self._persister.flush()
+
+    def disable_save(self):
+        """Disables saving, servers use per request settings."""
+        self._persister.enabled = False
+
+    def _get_configurations(self) -> dict:
+        return self._config.model_dump(
+            exclude={"lcm_diffusion_setting": {"init_image"}},
+        )
 
     def _load_default(self) -> dict:
         default_config = Settings()
@@ -0,0 +1,169 @@
+import gc
+from collections import OrderedDict
+from threading import Lock, Thread
+from time import sleep, time
+from typing import Any, Callable, Optional
+
+from constants import ANNOTATOR_CACHE_SIZE_MB, ANNOTATOR_IDLE_TIMEOUT
+
+
+def get_annotator_memory_size(annotator: Any) -> int:
+    """
+    Returns the memory used by the PyTorch weights of _annotator_ in bytes,
+    looking for modules in its attributes (annotators wrap their models).
+    """
+    import torch
+
+    size = 0
+    seen = set()
+    pending = [(annotator, 0)]
+    while pending:
+        value, depth = pending.pop()
+        if id(value) in seen:
+            continue
+        seen.add(id(value))
+        if isinstance(value, torch.nn.Module):
+            for tensor in list(value.parameters()) + list(value.buffers()):
+                size += tensor.numel() * tensor.element_size()
+        elif depth < 3 and hasattr(value, "__dict__"):
+            pending.extend((attribute, depth + 1) for attribute in vars(value).values())
+    return size
+
+
+class AnnotatorEntry:
+    def __init__(
+        self,
+        annotator: Any,
+        size: int,
+    ):
+        self.annotator = annotator
+        self.size = size
+        self.last_used = time()
+
+
+class AnnotatorRegistry:
+    """
+    Annotator models of the ControlNet preprocessors, loaded on first use and
+    kept for the next control images. Annotators unused for _idle_timeout_
+    seconds are unloaded (0 keeps them), and the least recently used ones are
+    unloaded when their total memory exceeds _max_memory_mb_; the most
+    recently used annotator is always kept.
+    """
+
+    def __init__(
+        self,
+        max_memory_mb: int = ANNOTATOR_CACHE_SIZE_MB,
+        idle_timeout: int = ANNOTATOR_IDLE_TIMEOUT,
+    ):
+        self.max_memory = max(max_memory_mb, 0) * 1024 * 1024
+        self.idle_timeout = max(idle_timeout, 0)
+        self._entries: OrderedDict[str, AnnotatorEntry] = OrderedDict()
+        self._lock = Lock()
+        self._reaper: Optional[Thread] = None
+        self.hits = 0
+        self.loads = 0
+        self.unloads = 0
+        self.total_load_time = 0.0
+
+    @property
+    def memory_used(self) -> int:
+        return sum(entry.size for entry in self._entries.values())
+
+    def get(
+        self,
+        name: str,
+        load: Callable[[], Any],
+    ) -> Any:
+        """Returns the annotator _name_, calls _load_ to load it if needed."""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None:
+                self.hits += 1
+                entry.last_used = time()
+                self._entries.move_to_end(name)
+                return entry.annotator
+
+            print(f"Loading annotator : {name}")
+            tick = time()
+            annotator = load()
+            load_time = time() - tick
+            try:
+                size = get_annotator_memory_size(annotator)
+            except ImportError:
+                size = 0
+            self.loads += 1
+            self.total_load_time += load_time
+            print(
+                f"Annotator loaded : {name}, size {size / (1024 * 1024):.0f} MB,"
+                f" load time {load_time:.2f} seconds"
+            )
+            self._entries[name] = AnnotatorEntry(annotator, size)
+            self._evict()
+            self._start_reaper()
+            return annotator
+
+    def unload_idle(self) -> None:
+        """Unloads the annotators unused for the idle timeout."""
+        if self.idle_timeout == 0:
+            return
+        with self._lock:
+            now = time()
+            idle_names = [
+                name
+                for name, entry in self._entries.items()
+                if now - entry.last_used > self.idle_timeout
+            ]
+            for name in idle_names:
+                self._unload(name)
+        if idle_names:
+            gc.collect()
+
+    def clear(self) -> None:
+        with self._lock:
+            for name in list(self._entries):
+                self._unload(name)
+        gc.collect()
+
+    def get_stats(self) -> dict:
+        return {
+            "annotators": list(self._entries),
+            "memory_used_mb": round(self.memory_used / (1024 * 1024), 2),
+            "max_memory_mb": round(self.max_memory / (1024 * 1024), 2),
+            "hits": self.hits,
+            "loads": self.loads,
+            "unloads": self.unloads,
+            "total_load_time": round(self.total_load_time, 2),
+        }
+
+    def _unload(self, name: str) -> None:
+        del self._entries[name]
+        self.unloads += 1
+        print(f"Annotator unloaded : {name}")
+
+    def _evict(self) -> None:
+        evicted = False
+        while len(self._entries) > 1 and self.memory_used > self.max_memory:
+            name = next(iter(self._entries))
+            self._unload(name)
+            evicted = True
+        if evicted:
+            gc.collect()
+
+    def _start_reaper(self) -> None:
+        if self.idle_timeout == 0 or self._reaper is not None:
+            return
+        self._reaper = Thread(
+            target=self._run_reaper,
+            name="annotator-reaper",
+            daemon=True,
+        )
+        self._reaper.start()
+
+    def _run_reaper(self) -> None:
+        interval = min(max(self.idle_timeout / 4, 1), 60)
+        while True:
+            sleep(interval)
+            self.unload_idle()
+
+
+annotator_registry = AnnotatorRegistry()
@@ -0,0 +1,143 @@
+import json
+from collections import OrderedDict
+from hashlib import sha256
+from io import BytesIO
+from threading import Lock
+from typing import Optional
+
+from PIL import Image
+
+from backend.result_cache import ResultCache, hash_image
+from constants import (
+    CONTROL_IMAGE_CACHE_DIR,
+    CONTROL_IMAGE_CACHE_DISK_SIZE_MB,
+    CONTROL_IMAGE_CACHE_SIZE,
+)
+
+# Preprocessors giving a different control image on every call
+NON_DETERMINISTIC_PREPROCESSORS = ("Shuffle",)
+
+
+class ControlImageCache:
+    """
+    LRU cache of the control images computed by the ControlNet
+    preprocessors, keyed by the hash of the input image, the preprocessor
+    and its parameters, so reusing a reference image skips the annotator.
+    Randomized preprocessors (Shuffle) are never cached.
+    Up to _max_entries_ control images are kept in memory; with a
+    _disk_cache_ they are also stored as PNG files and survive restarts.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = CONTROL_IMAGE_CACHE_SIZE,
+        disk_cache: Optional[ResultCache] = None,
+    ):
+        self.max_entries = max(max_entries, 0)
+        self.disk_cache = disk_cache
+        self._entries: OrderedDict[str, Image.Image] = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get_control_image(
+        self,
+        image: Image.Image,
+        preprocessor: str,
+        parameters: Optional[dict] = None,
+    ) -> Image.Image:
+        """Returns the control image of _image_ computed by _preprocessor_."""
+        if preprocessor in NON_DETERMINISTIC_PREPROCESSORS:
+            self.misses += 1
+            return self._compute_control_image(image, preprocessor)
+        key_data = json.dumps(
+            [hash_image(image), preprocessor, parameters or {}],
+            sort_keys=True,
+        )
+        key = sha256(key_data.encode()).hexdigest()
+        with self._lock:
+            control_image = self._entries.get(key)
+            if control_image is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return control_image
+
+        control_image = self._get_disk_image(key)
+        if control_image is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            control_image = self._compute_control_image(image, preprocessor)
+            self._put_disk_image(key, control_image)
+
+        with self._lock:
+            if self.max_entries > 0:
+                self._entries[key] = control_image
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return control_image
+
+    def _compute_control_image(
+        self,
+        image: Image.Image,
+        preprocessor: str,
+    ) -> Image.Image:
+        # Imports the annotators and their dependencies on first use
+        from backend.annotators.image_control_factory import ImageControlFactory
+
+        control = ImageControlFactory().create_control(preprocessor)
+        return control.get_control_image(image)
+
+    def _get_disk_image(self, key: str) -> Optional[Image.Image]:
+        if not self.disk_cache:
+            return None
+        data = self.disk_cache.get(key)
+        if data is None:
+            return None
+        control_image = Image.open(BytesIO(data))
+        control_image.load()
+        return control_image
+
+    def _put_disk_image(
+        self,
+        key: str,
+        control_image: Image.Image,
+    ) -> None:
+        if not self.disk_cache or not self.disk_cache.is_enabled:
+            return
+        buffer = BytesIO()
+        control_image.save(buffer, format="PNG")
+        self.disk_cache.put(key, buffer.getvalue())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (
+                round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0
+            ),
+            "disk": self.disk_cache.get_stats() if self.disk_cache else None,
+        }
+
+
+control_image_cache = ControlImageCache(
+    disk_cache=(
+        ResultCache(
+            CONTROL_IMAGE_CACHE_DIR,
+            CONTROL_IMAGE_CACHE_DISK_SIZE_MB,
+            file_extension=".png",
+        )
+        if CONTROL_IMAGE_CACHE_DIR
+        else None
+    ),
+)
@@ -1,12 +1,17 @@
 import numpy as np
+from backend.annotators.annotator_registry import annotator_registry
 from backend.annotators.control_interface import ControlInterface
 from PIL import Image
 from transformers import pipeline
 
 
+def _load_depth_estimator():
+    return pipeline("depth-estimation")
+
+
 class DepthControl(ControlInterface):
     def get_control_image(self, image: Image) -> Image:
-        depth_estimator = pipeline("depth-estimation")
+        depth_estimator = annotator_registry.get("Depth", _load_depth_estimator)
         image = depth_estimator(image)["depth"]
         image = np.array(image)
         image = image[:, :, None]
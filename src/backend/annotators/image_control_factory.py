@@ -9,7 +9,18 @@ from backend.annotators.softedge_control import SoftEdgeControl
 
 
 class ImageControlFactory:
+    # Controls are stateless, their annotator models are kept by the
+    # annotator registry
+    _controls = {}
+
     def create_control(self, controlnet_type: str):
+        control = ImageControlFactory._controls.get(controlnet_type)
+        if control is None:
+            control = self._create_control(controlnet_type)
+            ImageControlFactory._controls[controlnet_type] = control
+        return control
+
+    def _create_control(self, controlnet_type: str):
         if controlnet_type == "Canny":
             return CannyControl()
         elif controlnet_type == "Pose":
@@ -1,11 +1,16 @@
 import numpy as np
+from backend.annotators.annotator_registry import annotator_registry
 from backend.annotators.control_interface import ControlInterface
 from controlnet_aux import LineartDetector
 from PIL import Image
 
 
+def _load_detector():
+    return LineartDetector.from_pretrained("lllyasviel/Annotators")
+
+
 class LineArtControl(ControlInterface):
     def get_control_image(self, image: Image) -> Image:
-        processor = LineartDetector.from_pretrained("lllyasviel/Annotators")
+        processor = annotator_registry.get("LineArt", _load_detector)
         control_image = processor(image)
         return control_image
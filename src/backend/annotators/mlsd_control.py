@@ -1,10 +1,15 @@
+from backend.annotators.annotator_registry import annotator_registry
 from backend.annotators.control_interface import ControlInterface
 from controlnet_aux import MLSDdetector
 from PIL import Image
 
 
+def _load_detector():
+    return MLSDdetector.from_pretrained("lllyasviel/ControlNet")
+
+
 class MlsdControl(ControlInterface):
     def get_control_image(self, image: Image) -> Image:
-        mlsd = MLSDdetector.from_pretrained("lllyasviel/ControlNet")
+        mlsd = annotator_registry.get("MLSD", _load_detector)
         image = mlsd(image)
         return image
@@ -1,10 +1,15 @@
+from backend.annotators.annotator_registry import annotator_registry
 from backend.annotators.control_interface import ControlInterface
 from controlnet_aux import NormalBaeDetector
 from PIL import Image
 
 
+def _load_detector():
+    return NormalBaeDetector.from_pretrained("lllyasviel/Annotators")
+
+
 class NormalControl(ControlInterface):
     def get_control_image(self, image: Image) -> Image:
-        processor = NormalBaeDetector.from_pretrained("lllyasviel/Annotators")
+        processor = annotator_registry.get("NormalBAE", _load_detector)
         control_image = processor(image)
         return control_image
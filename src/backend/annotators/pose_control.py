@@ -1,10 +1,15 @@
+from backend.annotators.annotator_registry import annotator_registry
 from backend.annotators.control_interface import ControlInterface
 from controlnet_aux import OpenposeDetector
 from PIL import Image
 
 
+def _load_detector():
+    return OpenposeDetector.from_pretrained("lllyasviel/ControlNet")
+
+
 class PoseControl(ControlInterface):
     def get_control_image(self, image: Image) -> Image:
-        openpose = OpenposeDetector.from_pretrained("lllyasviel/ControlNet")
+        openpose = annotator_registry.get("Pose", _load_detector)
         image = openpose(image)
         return image
@@ -1,3 +1,4 @@
+from backend.annotators.annotator_registry import annotator_registry
 from backend.annotators.control_interface import ControlInterface
 from controlnet_aux import ContentShuffleDetector
 from PIL import Image
@@ -5,6 +6,6 @@ from PIL import Image
 
 class ShuffleControl(ControlInterface):
     def get_control_image(self, image: Image) -> Image:
-        shuffle_processor = ContentShuffleDetector()
+        shuffle_processor = annotator_registry.get("Shuffle", ContentShuffleDetector)
         image = shuffle_processor(image)
         return image
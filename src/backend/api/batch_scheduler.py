@@ -0,0 +1,141 @@
+from concurrent.futures import Future
+from threading import Lock
+from time import sleep
+from typing import Any, Callable, Hashable, List, Optional
+
+from backend.api.generation_queue import GenerationQueue
+from constants import API_BATCH_WINDOW, API_MAX_BATCH_SIZE
+
+
+class _BatchItem:
+    def __init__(
+        self,
+        key: Optional[Hashable],
+        payload: Any,
+        size: int,
+    ):
+        self.key = key
+        self.payload = payload
+        self.size = size
+        self.future = Future()
+        self.claimed = False
+
+
+class BatchScheduler:
+    """
+    Groups the pending generations having the same batch key into one call
+    of _run_batch_, which gets the payloads of a batch and returns their
+    results in the same order. Generations are queued on the generation queue
+    one by one, the worker running a generation also runs the compatible
+    generations waiting behind it, up to _max_batch_size_ images. When no
+    other generation is pending, it waits _window_ seconds for more requests.
+    """
+
+    def __init__(
+        self,
+        queue: GenerationQueue,
+        run_batch: Callable[[List[Any]], List[Any]],
+        window: float = API_BATCH_WINDOW,
+        max_batch_size: int = API_MAX_BATCH_SIZE,
+    ):
+        self.queue = queue
+        self.run_batch = run_batch
+        self.window = max(window, 0.0)
+        self.max_batch_size = max(max_batch_size, 1)
+        self._pending: List[_BatchItem] = []
+        self._lock = Lock()
+        self.batches = 0
+        self.batched_generations = 0
+
+    def submit(
+        self,
+        key: Optional[Hashable],
+        payload: Any,
+        size: int = 1,
+    ) -> Future:
+        """
+        Queues a generation, returns the future of its result. Generations
+        with a _None_ key are never batched, _size_ is its number of images.
+        """
+        item = _BatchItem(key, payload, size)
+        with self._lock:
+            self._pending.append(item)
+        try:
+            queue_future = self.queue.submit(self._run, item)
+        except Exception:
+            self._remove(item)
+            raise
+
+        def on_done(future: Future) -> None:
+            if future.cancelled():
+                queue_future.cancel()
+                self._remove(item)
+
+        item.future.add_done_callback(on_done)
+        return item.future
+
+    def _remove(self, item: _BatchItem) -> None:
+        with self._lock:
+            if item in self._pending:
+                self._pending.remove(item)
+
+    def _claim(self, batch: List[_BatchItem]) -> None:
+        # Adds the compatible pending generations to the batch
+        with self._lock:
+            key = batch[0].key
+            if key is None:
+                return
+            size = sum(item.size for item in batch)
+            for item in list(self._pending):
+                if item.key != key or size + item.size > self.max_batch_size:
+                    continue
+                self._pending.remove(item)
+                if not item.future.set_running_or_notify_cancel():
+                    continue
+                item.claimed = True
+                batch.append(item)
+                size += item.size
+
+    def _run(self, item: _BatchItem) -> None:
+        with self._lock:
+            if item.claimed or item not in self._pending:
+                # Already generated in an earlier batch or cancelled
+                return
+            self._pending.remove(item)
+            item.claimed = True
+        if not item.future.set_running_or_notify_cancel():
+            return
+
+        batch = [item]
+        self._claim(batch)
+        if (
+            self.window > 0
+            and item.key is not None
+            and len(batch) == 1
+            and item.size < self.max_batch_size
+            and not self._pending
+        ):
+            sleep(self.window)
+            self._claim(batch)
+
+        if len(batch) > 1:
+            print(f"Running a batch of {len(batch)} generations")
+            self.batches += 1
+            self.batched_generations += len(batch)
+        try:
+            results = self.run_batch([batch_item.payload for batch_item in batch])
+        except Exception as exception:
+            for batch_item in batch:
+                batch_item.future.set_exception(exception)
+            return
+        for batch_item, result in zip(batch, results):
+            batch_item.future.set_result(result)
+
+    def get_stats(self) -> dict:
+        return {
+            "window": self.window,
+            "max_batch_size": self.max_batch_size,
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "batched_generations": self.batched_generations,
+        }
@@ -0,0 +1,66 @@
+from typing import Any, List, Optional
+
+from backend.base64_image import base64_image_to_pil
+from backend.cancellation import CancellationToken
+from backend.generation_result import GenerationResult
+from backend.models.lcmdiffusion_setting import DiffusionTask, LCMDiffusionSetting
+from context import Context
+from state import get_request_settings
+
+
+def _get_result(result: GenerationResult) -> GenerationResult:
+    result.latency = round(result.latency, 2)
+    return result
+
+
+def generate(
+    context: Context,
+    diffusion_config: LCMDiffusionSetting,
+    progress: Any = None,
+    cancel_token: Optional[CancellationToken] = None,
+) -> GenerationResult:
+    # Settings of the request, the application settings are not modified so
+    # concurrent requests don't interfere
+    updates = {}
+    if (
+        diffusion_config.diffusion_task == DiffusionTask.image_to_image
+        or diffusion_config.diffusion_task == DiffusionTask.edit_image
+    ):
+        updates["init_image"] = base64_image_to_pil(diffusion_config.init_image)
+    settings = get_request_settings(diffusion_config, **updates)
+
+    result = context.generate(
+        settings,
+        save_config=False,
+        progress=progress,
+        cancel_token=cancel_token,
+    )
+    return _get_result(result)
+
+
+def generate_results(
+    context: Context,
+    diffusion_configs: List[LCMDiffusionSetting],
+    progress: Any = None,
+    cancel_token: Optional[CancellationToken] = None,
+) -> List[GenerationResult]:
+    """
+    Generates the images of one request, or of a batch of compatible text to
+    image requests, with _context_; returns the result of each request.
+    """
+    if len(diffusion_configs) == 1:
+        return [
+            generate(
+                context,
+                diffusion_configs[0],
+                progress,
+                cancel_token,
+            )
+        ]
+
+    results = context.generate_batch(
+        diffusion_configs,
+        progress=progress,
+        cancel_token=cancel_token,
+    )
+    return [_get_result(result) for result in results]
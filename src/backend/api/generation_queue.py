@@ -0,0 +1,131 @@
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from math import ceil
+from threading import Lock
+from time import perf_counter
+from typing import Any, Callable
+
+from constants import API_QUEUE_SIZE
+
+
+class GenerationQueueFull(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Generation queue is full, retry after {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class GenerationQueueClosed(Exception):
+    pass
+
+
+class GenerationQueue:
+    """
+    Runs the generations on _workers_ dedicated threads (one at a time by
+    default), so the server event loop stays responsive; at most _max_size_
+    generations can be queued or running, further requests are rejected with
+    a retry hint.
+    """
+
+    def __init__(
+        self,
+        max_size: int = API_QUEUE_SIZE,
+        workers: int = 1,
+    ):
+        self.max_size = max(max_size, 1)
+        self.workers = max(workers, 1)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers,
+            thread_name_prefix="generation",
+        )
+        self._lock = Lock()
+        self._depth = 0
+        self._closed = False
+        self.average_latency = 0.0
+        self.completed = 0
+        self.rejected = 0
+
+    @property
+    def depth(self) -> int:
+        """Number of queued and running generations."""
+        return self._depth
+
+    def get_retry_after(self) -> int:
+        """Estimated time in seconds until the queue has room again."""
+        return max(
+            ceil(self.average_latency * max(self._depth, 1) / self.workers),
+            1,
+        )
+
+    def set_workers(self, workers: int) -> None:
+        """Sets the number of generations run at the same time."""
+        with self._lock:
+            self.workers = max(workers, 1)
+            self._executor.shutdown(wait=True)
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="generation",
+            )
+
+    async def run(
+        self,
+        function: Callable,
+        *args: Any,
+    ) -> Any:
+        """Runs _function_ on the generation worker and waits for its result."""
+        return await asyncio.wrap_future(self.submit(function, *args))
+
+    def submit(
+        self,
+        function: Callable,
+        *args: Any,
+    ) -> Future:
+        """Queues _function_ on the generation worker, returns its future."""
+        with self._lock:
+            if self._closed:
+                raise GenerationQueueClosed("Generation queue is shut down")
+            if self._depth >= self.max_size:
+                self.rejected += 1
+                raise GenerationQueueFull(self.get_retry_after())
+            self._depth += 1
+            future = self._executor.submit(self._run_timed, function, *args)
+        # The generation keeps its slot until it's done (or cancelled before
+        # starting), even if the client has gone away
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, _) -> None:
+        with self._lock:
+            self._depth -= 1
+
+    def _run_timed(
+        self,
+        function: Callable,
+        *args: Any,
+    ) -> Any:
+        tick = perf_counter()
+        try:
+            return function(*args)
+        finally:
+            latency = perf_counter() - tick
+            with self._lock:
+                self.completed += 1
+                if self.completed == 1:
+                    self.average_latency = latency
+                else:
+                    self.average_latency = 0.8 * self.average_latency + 0.2 * latency
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_stats(self) -> dict:
+        return {
+            "depth": self._depth,
+            "max_size": self.max_size,
+            "workers": self.workers,
+            "average_latency": round(self.average_latency, 2),
+            "retry_after": self.get_retry_after(),
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,67 @@
+"""
+Encoding of the images of API responses.
+
+Generations return PIL images, the API server encodes them in the format
+requested by the client on a pool of threads (PIL releases the GIL while
+encoding), so the queue workers go on with the next generation meanwhile.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from typing import Any, List, Optional
+
+from backend.base64_image import encode_image
+from constants import API_ENCODER_THREADS
+
+
+class ImageFormat(str, Enum):
+    """Image formats of API responses"""
+
+    jpeg = "jpeg"
+    png = "png"
+    webp = "webp"
+
+
+class ResponseFormat(str, Enum):
+    """json : base64 encoded images, binary : raw image (multipart if several)"""
+
+    json = "json"
+    binary = "binary"
+
+
+IMAGE_MEDIA_TYPES = {
+    ImageFormat.jpeg: "image/jpeg",
+    ImageFormat.png: "image/png",
+    ImageFormat.webp: "image/webp",
+}
+
+_executor = ThreadPoolExecutor(
+    max_workers=max(API_ENCODER_THREADS, 1),
+    thread_name_prefix="image-encoder",
+)
+
+
+async def encode_images(
+    images: List[Any],
+    image_format: ImageFormat = ImageFormat.jpeg,
+    quality: Optional[int] = None,
+) -> List[bytes]:
+    """Encodes _images_ in parallel on the encoder threads."""
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(
+        *(
+            loop.run_in_executor(
+                _executor,
+                encode_image,
+                image,
+                image_format.value.upper(),
+                quality,
+            )
+            for image in images
+        )
+    )
+
+
+def shutdown() -> None:
+    _executor.shutdown(wait=False, cancel_futures=True)
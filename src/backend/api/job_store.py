@@ -0,0 +1,131 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+from enum import Enum
+from threading import Lock
+from time import time
+from typing import Any, Optional
+from uuid import uuid4
+
+from backend.cancellation import CancellationToken
+from backend.generation_progress import GenerationProgress
+from constants import API_JOB_TTL, API_MAX_JOBS
+
+
+class JobStatus(str, Enum):
+    """Generation job states"""
+
+    queued = "queued"
+    running = "running"
+    completed = "completed"
+    failed = "failed"
+    cancelled = "cancelled"
+
+
+FINISHED_JOB_STATUSES = (
+    JobStatus.completed,
+    JobStatus.failed,
+    JobStatus.cancelled,
+)
+
+
+class JobStoreFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, preview: bool = False):
+        self.id = uuid4().hex
+        self.status = JobStatus.queued
+        self.created_at = time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Any = None
+        self.error = ""
+        self.future: Optional[Future] = None
+        self.progress = GenerationProgress(preview)
+        self.cancel_token = CancellationToken()
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in FINISHED_JOB_STATUSES
+
+    def start(self) -> bool:
+        """Marks the job as running, returns _False_ if it has been cancelled."""
+        if self.status != JobStatus.queued:
+            return False
+        self.status = JobStatus.running
+        self.started_at = time()
+        return True
+
+    def finish(
+        self,
+        result: Any = None,
+        error: str = "",
+    ) -> None:
+        if self.status == JobStatus.cancelled:
+            return
+        self.result = result
+        self.error = error
+        self.status = JobStatus.failed if error else JobStatus.completed
+        self.finished_at = time()
+
+    def cancel(self) -> None:
+        if self.is_finished:
+            return
+        if self.future:
+            self.future.cancel()
+        # A running generation stops after its current step
+        self.cancel_token.cancel()
+        self.status = JobStatus.cancelled
+        self.result = None
+        self.finished_at = time()
+
+
+class JobStore:
+    """
+    Bounded store of generation jobs; finished jobs and their results are kept
+    for _ttl_ seconds, the oldest finished jobs are dropped when the store is
+    full. Queued and running jobs are never dropped.
+    """
+
+    def __init__(
+        self,
+        max_jobs: int = API_MAX_JOBS,
+        ttl: int = API_JOB_TTL,
+    ):
+        self.max_jobs = max(max_jobs, 1)
+        self.ttl = ttl
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def create(self, preview: bool = False) -> Job:
+        with self._lock:
+            self._remove_expired()
+            if len(self._jobs) >= self.max_jobs:
+                for job_id, job in list(self._jobs.items()):
+                    if job.is_finished:
+                        del self._jobs[job_id]
+                        break
+            if len(self._jobs) >= self.max_jobs:
+                raise JobStoreFull("Too many unfinished jobs")
+            job = Job(preview)
+            self._jobs[job.id] = job
+            return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            self._remove_expired()
+            return self._jobs.get(job_id)
+
+    def remove(self, job_id: str) -> None:
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def _remove_expired(self) -> None:
+        expiry_time = time() - self.ttl
+        for job_id, job in list(self._jobs.items()):
+            if job.is_finished and job.finished_at < expiry_time:
+                del self._jobs[job_id]
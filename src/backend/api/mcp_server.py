@@ -1,3 +1,4 @@
+import asyncio
 import platform
 
 import uvicorn
@@ -7,7 +8,7 @@ from constants import APP_VERSION, DEVICE
 from context import Context
 from fastapi import FastAPI, Request
 from fastapi_mcp import FastApiMCP
-from state import get_settings
+from state import get_request_settings, get_settings
 from fastapi.middleware.cors import CORSMiddleware
 from models.interface_types import InterfaceType
 from fastapi.staticfiles import StaticFiles
@@ -70,11 +71,21 @@ async def generate(
     """
     Returns URL of the generated image for text prompt
     """
-    app_settings.settings.lcm_diffusion_setting.prompt = prompt
-    images = context.generate_text_to_image(app_settings.settings)
-    image_names = context.save_images(
-        images,
-        app_settings.settings,
+    settings = get_request_settings(prompt=prompt)
+    # Generating and saving the images block, the event loop keeps serving
+    # other requests meanwhile
+    result = await asyncio.to_thread(
+        context.generate,
+        settings,
+        save_config=False,
+    )
+    # The client fetches the image from its URL right away
+    image_names = await asyncio.to_thread(
+        context.save_images,
+        result.images,
+        settings,
+        wait_saved=True,
+        latency=result.latency,
     )
     # url = request.url_for("results", path=image_names[0]) - Claude Desktop returns api_server
     url = f"http://localhost:{SERVER_PORT}/results/{image_names[0]}"
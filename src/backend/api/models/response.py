@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 
 from pydantic import BaseModel
 
@@ -8,7 +8,7 @@ class StableDiffusionResponse(BaseModel):
     Stable diffusion response model
 
     Attributes:
-        images (List[str]): List of JPEG image as base64 encoded
+        images (List[str]): List of images (JPEG by default) as base64 encoded
         latency (float): Latency in seconds
         error (str): Error message if any
     """
@@ -16,3 +16,24 @@ class StableDiffusionResponse(BaseModel):
     images: List[str]
     latency: float
     error: str = ""
+
+
+class JobResponse(BaseModel):
+    """
+    Generation job status
+
+    Attributes:
+        id (str): Job id
+        status (str): queued, running, completed, failed or cancelled
+        created_at (float): Creation time (UNIX timestamp)
+        started_at (float): Start time (UNIX timestamp) if started
+        finished_at (float): Finish time (UNIX timestamp) if finished
+        error (str): Error message if any
+    """
+
+    id: str
+    status: str
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: str = ""
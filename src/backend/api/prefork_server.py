@@ -0,0 +1,188 @@
+"""
+Pre-fork server of the API worker pool (Linux).
+
+The pre-fork server is a process forked from the API server before it starts
+serving; it loads the configured model once and forks the API workers, which
+share the memory pages of the model weights as long as they don't modify
+them (copy-on-write). Workers that crash are forked again from the same
+process, so they start with the model already loaded.
+
+No inference runs in the pre-fork server: thread pools of the inference
+runtimes don't survive a fork, they are created by each worker.
+"""
+
+import gc
+import os
+import signal
+from multiprocessing import Pipe
+from multiprocessing.connection import Client
+from threading import Lock
+from time import sleep
+from typing import Any, Optional
+
+from backend.api.worker_pool import get_model_affinity_key, serve_generations
+from backend.models.lcmdiffusion_setting import LCMDiffusionSetting
+from backend.process_memory import get_process_memory
+from constants import DEVICE
+
+
+def is_prefork_supported(lcm_diffusion_setting: LCMDiffusionSetting) -> bool:
+    """
+    PyTorch models only; OpenVINO compiled models and GGUF models (loaded by
+    a separate process) are not shared with forked workers.
+    """
+    return (
+        hasattr(os, "fork")
+        and not lcm_diffusion_setting.use_openvino
+        and not lcm_diffusion_setting.use_gguf_model
+    )
+
+
+class ForkedProcess:
+    """Handle of a process forked by the pre-fork server, like _Popen_."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.returncode: Optional[int] = None
+
+    def poll(self) -> Optional[int]:
+        if self.returncode is not None:
+            return self.returncode
+        try:
+            pid, status = os.waitpid(self.pid, os.WNOHANG)
+            if pid:
+                self.returncode = os.waitstatus_to_exitcode(status)
+        except ChildProcessError:
+            # Workers are children of the pre-fork server, their exit code
+            # is not available
+            try:
+                os.kill(self.pid, 0)
+            except ProcessLookupError:
+                self.returncode = -1
+        return self.returncode
+
+    def kill(self) -> None:
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def wait(self, timeout: float = 5.0) -> Optional[int]:
+        while self.poll() is None and timeout > 0:
+            sleep(0.05)
+            timeout -= 0.05
+        return self.returncode
+
+
+class PreforkServer:
+    def __init__(
+        self,
+        lcm_diffusion_setting: LCMDiffusionSetting,
+        device: str = DEVICE,
+    ):
+        self.model_key = get_model_affinity_key(lcm_diffusion_setting)
+        self._lock = Lock()
+        self._connection, server_connection = Pipe()
+        pid = os.fork()
+        if pid == 0:
+            self._connection.close()
+            try:
+                _run_prefork_server(
+                    server_connection,
+                    lcm_diffusion_setting,
+                    device,
+                )
+            finally:
+                os._exit(0)
+
+        server_connection.close()
+        self._process = ForkedProcess(pid)
+        message = self._connection.recv()
+        if message[0] == "error":
+            self.shutdown()
+            raise RuntimeError(
+                f"Pre-fork server failed to load the model : {message[1]}"
+            )
+
+    def fork_worker(
+        self,
+        port: int,
+        authkey: bytes,
+        threads: int,
+    ) -> ForkedProcess:
+        """Forks a worker connecting to the API server on _port_."""
+        with self._lock:
+            self._connection.send(("fork", port, authkey, threads))
+            _, pid = self._connection.recv()
+        return ForkedProcess(pid)
+
+    def shutdown(self) -> None:
+        try:
+            self._connection.send(("exit",))
+        except OSError:
+            pass
+        self._process.wait()
+        self._process.kill()
+
+    def get_stats(self) -> dict:
+        return {
+            "pid": self._process.pid,
+            "model": list(self.model_key),
+            "memory": get_process_memory(self._process.pid),
+        }
+
+
+def _run_prefork_server(
+    connection: Any,
+    lcm_diffusion_setting: LCMDiffusionSetting,
+    device: str,
+) -> None:
+    # Exited workers are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    from context import Context
+    from models.interface_types import InterfaceType
+
+    print(f"Pre-fork server loading the model (pid {os.getpid()})")
+    context = Context(InterfaceType.API_SERVER)
+    try:
+        context.lcm_text_to_image.init(device, lcm_diffusion_setting)
+    except Exception as exception:
+        connection.send(("error", str(exception)))
+        return
+    # Loaded objects won't be visited by the garbage collector of the
+    # workers, which would copy their memory pages
+    gc.collect()
+    gc.freeze()
+    connection.send(("ready",))
+
+    while True:
+        try:
+            command = connection.recv()
+        except EOFError:
+            break
+        if command[0] == "exit":
+            break
+        _, port, authkey, threads = command
+        pid = os.fork()
+        if pid == 0:
+            connection.close()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            try:
+                _run_forked_worker(port, authkey, threads, context)
+            finally:
+                os._exit(0)
+        connection.send(("forked", pid))
+
+
+def _run_forked_worker(
+    port: int,
+    authkey: bytes,
+    threads: int,
+    context: Any,
+) -> None:
+    import torch
+
+    torch.set_num_threads(threads)
+    worker_connection = Client(("127.0.0.1", port), authkey=authkey)
+    serve_generations(worker_connection, context)
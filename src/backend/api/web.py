@@ -1,15 +1,47 @@
+import asyncio
+import json
 import platform
+import secrets
+from base64 import b64encode
+from concurrent.futures import Future
+from contextlib import ExitStack
+from typing import List, Optional, Tuple
 
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-from backend.api.models.response import StableDiffusionResponse
+from backend.annotators.control_image_cache import control_image_cache
+from backend.api.batch_scheduler import BatchScheduler
+from backend.api.generation import generate_results
+from backend.api.generation_queue import (
+    GenerationQueue,
+    GenerationQueueClosed,
+    GenerationQueueFull,
+)
+from backend.api import image_encoder
+from backend.api.image_encoder import (
+    IMAGE_MEDIA_TYPES,
+    ImageFormat,
+    ResponseFormat,
+    encode_images,
+)
+from backend.api.job_store import Job, JobStatus, JobStore, JobStoreFull
+from backend.api.prefork_server import PreforkServer, is_prefork_supported
+from backend.api.worker_pool import WorkerPool
+from backend.api.models.response import JobResponse, StableDiffusionResponse
 from backend.base64_image import base64_image_to_pil, pil_image_to_base64_str
+from backend.cancellation import BatchCancellationToken
 from backend.device import get_device_name
+from backend.generation_progress import GenerationProgressGroup
+from backend.generation_result import GenerationResult
+from backend.lora import lora_manager
 from backend.models.device import DeviceInfo
 from backend.models.lcmdiffusion_setting import DiffusionTask, LCMDiffusionSetting
-from constants import APP_VERSION, DEVICE
+from backend.prompt_embedding_cache import prompt_embedding_cache
+from backend.result_cache import get_result_cache_key, result_cache
+from constants import API_WORKER_THREADS, API_WORKERS, APP_VERSION, DEVICE
 from context import Context
 from models.interface_types import InterfaceType
 from state import get_settings
@@ -37,6 +69,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 context = Context(InterfaceType.API_SERVER)
+generation_queue = GenerationQueue()
+job_store = JobStore()
+worker_pool: Optional[WorkerPool] = None
+
+# Content types of binary responses, documented beside the JSON response
+_IMAGE_RESPONSES = {
+    200: {
+        "content": {
+            **{media_type: {} for media_type in IMAGE_MEDIA_TYPES.values()},
+            "multipart/mixed": {},
+        }
+    }
+}
 
 
 @app.get("/api/")
@@ -83,35 +128,422 @@ async def models():
     }
 
 
+@app.get(
+    "/api/stats",
+    description="Get pipeline and prompt embedding cache statistics",
+    summary="Get cache statistics",
+)
+async def stats():
+    return {
+        "pipeline_cache": context.lcm_text_to_image.pipeline_cache.get_stats(),
+        "prompt_embedding_cache": prompt_embedding_cache.get_stats(),
+        "result_cache": result_cache.get_stats(),
+        "control_image_cache": control_image_cache.get_stats(),
+        "lora": lora_manager.get_stats(),
+        "queue": generation_queue.get_stats(),
+        "batching": batch_scheduler.get_stats(),
+        "workers": worker_pool.get_stats() if worker_pool else None,
+    }
+
+
+@app.get(
+    "/api/queue",
+    description="Get the number of queued and running generations",
+    summary="Get generation queue status",
+)
+async def queue():
+    return generation_queue.get_stats()
+
+
 @app.post(
     "/api/generate",
     description="Generate image(Text to image,Image to Image)",
     summary="Generate image(Text to image,Image to Image)",
+    responses=_IMAGE_RESPONSES,
+)
+async def generate(
+    diffusion_config: LCMDiffusionSetting,
+    request: Request,
+    response_format: ResponseFormat = ResponseFormat.json,
+    image_format: ImageFormat = ImageFormat.jpeg,
+    quality: Optional[int] = Query(default=None, ge=1, le=100),
+) -> StableDiffusionResponse:
+    # Generation runs on the queue worker thread, the event loop stays free
+    # to serve the other requests
+    job = Job()
+    try:
+        future = asyncio.wrap_future(await _submit(job, diffusion_config))
+    except GenerationQueueFull as exception:
+        raise HTTPException(
+            status_code=429,
+            detail=str(exception),
+            headers={"Retry-After": str(exception.retry_after)},
+        )
+    except GenerationQueueClosed as exception:
+        raise HTTPException(
+            status_code=503,
+            detail=str(exception),
+            headers={"Retry-After": str(generation_queue.get_retry_after())},
+        )
+
+    # Stop the generation if the client goes away before it's done
+    while True:
+        done, _ = await asyncio.wait({future}, timeout=0.5)
+        if done:
+            return await _get_image_response(
+                future.result(),
+                response_format,
+                image_format,
+                quality,
+            )
+        if await request.is_disconnected():
+            print("Client disconnected, cancelling the generation")
+            job.cancel()
+            raise HTTPException(
+                status_code=499,
+                detail="Client disconnected",
+            )
+
+
+@app.post(
+    "/api/jobs",
+    description="Queue an image generation job, returns the job id",
+    summary="Submit generation job",
+    status_code=202,
+)
+async def submit_job(
+    diffusion_config: LCMDiffusionSetting,
+    preview: bool = False,
+) -> JobResponse:
+    try:
+        job = job_store.create(preview)
+    except JobStoreFull as exception:
+        raise HTTPException(
+            status_code=429,
+            detail=str(exception),
+            headers={"Retry-After": str(generation_queue.get_retry_after())},
+        )
+    try:
+        job.future = await _submit(job, diffusion_config)
+    except GenerationQueueFull as exception:
+        job_store.remove(job.id)
+        raise HTTPException(
+            status_code=429,
+            detail=str(exception),
+            headers={"Retry-After": str(exception.retry_after)},
+        )
+    except GenerationQueueClosed as exception:
+        job_store.remove(job.id)
+        raise HTTPException(status_code=503, detail=str(exception))
+    return _get_job_response(job)
+
+
+@app.get(
+    "/api/jobs/{job_id}",
+    description="Get the status of a generation job",
+    summary="Get job status",
+)
+async def get_job(job_id: str) -> JobResponse:
+    return _get_job_response(_get_job(job_id))
+
+
+@app.get(
+    "/api/jobs/{job_id}/events",
+    description="Stream the step progress of a job as server-sent events",
+    summary="Stream job progress",
+)
+async def get_job_events(job_id: str) -> StreamingResponse:
+    job = _get_job(job_id)
+    return StreamingResponse(
+        _get_job_events(job),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+async def _get_job_events(job: Job):
+    version = -1
+    while True:
+        if job.progress.version != version:
+            version = job.progress.version
+            progress = job.progress.to_dict()
+            yield f"event: progress\ndata: {json.dumps(progress)}\n\n"
+        if job.is_finished:
+            response = _get_job_response(job)
+            yield f"event: {job.status.value}\ndata: {response.model_dump_json()}\n\n"
+            break
+        await asyncio.sleep(0.1)
+
+
+@app.get(
+    "/api/jobs/{job_id}/result",
+    description="Get the generated images of a finished job",
+    summary="Get job result",
+    responses=_IMAGE_RESPONSES,
+)
+async def get_job_result(
+    job_id: str,
+    response_format: ResponseFormat = ResponseFormat.json,
+    image_format: ImageFormat = ImageFormat.jpeg,
+    quality: Optional[int] = Query(default=None, ge=1, le=100),
+) -> StableDiffusionResponse:
+    job = _get_job(job_id)
+    if job.status not in (JobStatus.completed, JobStatus.failed):
+        raise HTTPException(
+            status_code=409,
+            detail=f"Job is {job.status.value}",
+        )
+    return await _get_image_response(
+        job.result,
+        response_format,
+        image_format,
+        quality,
+    )
+
+
+@app.delete(
+    "/api/jobs/{job_id}",
+    description="Cancel a queued or running generation job",
+    summary="Cancel job",
 )
-async def generate(diffusion_config: LCMDiffusionSetting) -> StableDiffusionResponse:
-    app_settings.settings.lcm_diffusion_setting = diffusion_config
+async def cancel_job(job_id: str) -> JobResponse:
+    job = _get_job(job_id)
+    job.cancel()
+    return _get_job_response(job)
+
+
+async def _get_image_response(
+    result: GenerationResult,
+    response_format: ResponseFormat,
+    image_format: ImageFormat,
+    quality: Optional[int],
+):
+    encoded_images = await encode_images(result.images, image_format, quality)
+    if response_format == ResponseFormat.json:
+        return StableDiffusionResponse(
+            images=[b64encode(image).decode("utf-8") for image in encoded_images],
+            latency=result.latency,
+            error=result.error,
+        )
+    if result.error or not encoded_images:
+        raise HTTPException(
+            status_code=500,
+            detail=result.error or "No image generated",
+        )
+    media_type = IMAGE_MEDIA_TYPES[image_format]
+    headers = {"X-Latency": str(result.latency)}
+    if len(encoded_images) == 1:
+        return Response(
+            content=encoded_images[0],
+            media_type=media_type,
+            headers=headers,
+        )
+    # One part per image
+    boundary = secrets.token_hex(16)
+    body = bytearray()
+    for index, image in enumerate(encoded_images):
+        body += (
+            f"--{boundary}\r\n"
+            f"Content-Type: {media_type}\r\n"
+            f'Content-Disposition: attachment; filename="image_{index}.'
+            f'{image_format.value}"\r\n\r\n'
+        ).encode()
+        body += image + b"\r\n"
+    body += f"--{boundary}--\r\n".encode()
+    return Response(
+        content=bytes(body),
+        media_type=f"multipart/mixed; boundary={boundary}",
+        headers=headers,
+    )
+
+
+def _get_job(job_id: str) -> Job:
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Job not found or expired",
+        )
+    return job
+
+
+def _get_job_response(job: Job) -> JobResponse:
+    return JobResponse(
+        id=job.id,
+        status=job.status.value,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+        error=job.error,
+    )
+
+
+async def _submit(
+    job: Job,
+    diffusion_config: LCMDiffusionSetting,
+) -> Future:
+    result = None
+    if result_cache.is_enabled:
+        # Hashing the settings and images doesn't block the event loop
+        result = await asyncio.to_thread(_get_request_cached_result, diffusion_config)
+    if result:
+        # Served from the result cache without queueing
+        job.start()
+        job.finish(result)
+        job.future = Future()
+        job.future.set_result(result)
+        return job.future
+    job.future = batch_scheduler.submit(
+        _get_batch_key(diffusion_config),
+        (job, diffusion_config),
+        diffusion_config.number_of_images,
+    )
+    return job.future
+
+
+def _get_batch_key(diffusion_config: LCMDiffusionSetting) -> Optional[str]:
+    # Text to image requests differing only by their prompts, seeds and
+    # number of images can be generated in one batch; OpenVINO pipelines
+    # draw the latents of a batch from a single seed, so seeded OpenVINO
+    # requests are generated alone to give the images of their seeds
     if (
-        diffusion_config.diffusion_task == DiffusionTask.image_to_image
-        or diffusion_config.diffusion_task == DiffusionTask.edit_image
+        diffusion_config.diffusion_task != DiffusionTask.text_to_image
+        or diffusion_config.use_gguf_model
+        or diffusion_config.get_enabled_controlnets()
+        or (diffusion_config.use_openvino and diffusion_config.use_seed)
     ):
-        app_settings.settings.lcm_diffusion_setting.init_image = base64_image_to_pil(
-            diffusion_config.init_image
-        )
+        return None
+    return diffusion_config.model_dump_json(
+        exclude={
+            "prompt",
+            "negative_prompt",
+            "seed",
+            "use_seed",
+            "number_of_images",
+            "init_image",
+        }
+    )
 
-    images = context.generate_text_to_image(app_settings.settings)
 
-    if images:
-        images_base64 = [pil_image_to_base64_str(img) for img in images]
-    else:
-        images_base64 = []
-    return StableDiffusionResponse(
-        latency=round(context.latency, 2),
-        images=images_base64,
-        error=context.error,
+def _get_request_cached_result(
+    diffusion_config: LCMDiffusionSetting,
+) -> Optional[GenerationResult]:
+    return _get_cached_result(get_result_cache_key(diffusion_config))
+
+
+def _get_cached_result(key: Optional[str]) -> Optional[GenerationResult]:
+    data = result_cache.get(key)
+    if data is None:
+        return None
+    response = StableDiffusionResponse.model_validate_json(data)
+    return GenerationResult(
+        images=[base64_image_to_pil(image) for image in response.images],
+        latency=response.latency,
     )
 
 
-def start_web_server(port: int = 8000):
+def _cache_result(
+    key: Optional[str],
+    result: GenerationResult,
+) -> None:
+    if not key or not result_cache.is_enabled:
+        return
+    # Lossless, the images are encoded again in the requested format
+    response = StableDiffusionResponse(
+        images=[pil_image_to_base64_str(image, "PNG") for image in result.images],
+        latency=result.latency,
+    )
+    result_cache.put(key, response.model_dump_json().encode())
+
+
+def _run_jobs(requests: List[Tuple[Job, LCMDiffusionSetting]]) -> list:
+    """Runs a batch of generation jobs, returns their results."""
+    started = [(job, config) for job, config in requests if job.start()]
+    if not started:
+        return [job.result for job, _ in requests]
+    cache_keys = {job.id: get_result_cache_key(config) for job, config in started}
+    with ExitStack() as stack:
+        # Identical generations in flight are run once, the others wait for
+        # the result in the cache (keys are sorted to avoid deadlocks)
+        for key in sorted(set(filter(None, cache_keys.values()))):
+            stack.enter_context(result_cache.lock(key))
+        pending = []
+        for job, config in started:
+            result = _get_cached_result(cache_keys[job.id])
+            if result:
+                job.finish(result)
+            else:
+                pending.append((job, config))
+        if pending:
+            _generate_jobs(pending, cache_keys)
+    return [job.result for job, _ in requests]
+
+
+def _generate_jobs(
+    requests: List[Tuple[Job, LCMDiffusionSetting]],
+    cache_keys: dict,
+) -> None:
+    diffusion_configs = [diffusion_config for _, diffusion_config in requests]
+    if len(requests) == 1:
+        progress = requests[0][0].progress
+        cancel_token = requests[0][0].cancel_token
+    else:
+        progress = GenerationProgressGroup([job.progress for job, _ in requests])
+        cancel_token = BatchCancellationToken(
+            [job.cancel_token for job, _ in requests]
+        )
+    try:
+        if worker_pool:
+            results = worker_pool.generate(
+                diffusion_configs,
+                progress,
+                cancel_token,
+            )
+        else:
+            results = generate_results(
+                context,
+                diffusion_configs,
+                progress,
+                cancel_token,
+            )
+    except Exception as exception:
+        results = [GenerationResult(images=[], error=str(exception)) for _ in requests]
+    for (job, _), result in zip(requests, results):
+        if not result.error and result.images:
+            _cache_result(cache_keys[job.id], result)
+        job.finish(result, result.error)
+
+
+batch_scheduler = BatchScheduler(generation_queue, _run_jobs)
+
+
+@app.on_event("shutdown")
+def shutdown():
+    generation_queue.shutdown()
+    image_encoder.shutdown()
+    if worker_pool:
+        worker_pool.shutdown()
+
+
+def start_web_server(
+    port: int = 8000,
+    workers: int = API_WORKERS,
+    worker_threads: int = API_WORKER_THREADS,
+    prefork: bool = False,
+):
+    global worker_pool
+    if workers > 0:
+        prefork_server = None
+        if prefork:
+            lcm_diffusion_setting = app_settings.settings.lcm_diffusion_setting
+            if is_prefork_supported(lcm_diffusion_setting):
+                # Forked before the server starts any thread
+                prefork_server = PreforkServer(lcm_diffusion_setting)
+            else:
+                print("Pre-fork is only supported for PyTorch models on Linux")
+        # Generations run in worker processes, one per worker at a time
+        worker_pool = WorkerPool(workers, worker_threads, prefork_server)
+        generation_queue.set_workers(worker_pool.size)
     uvicorn.run(
         app,
         host="0.0.0.0",
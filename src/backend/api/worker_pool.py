@@ -0,0 +1,389 @@
+"""
+Pool of API worker processes.
+
+Each worker process has its own _Context_ (and so its own loaded model), the
+API server sends every generation to an idle worker, preferably one that has
+already loaded the requested model. A worker that crashes is started again.
+"""
+
+import secrets
+import subprocess
+import sys
+from multiprocessing.connection import Client, Listener
+from os import environ, path, pathsep
+from queue import Queue
+from threading import Condition, Thread
+from time import time
+from typing import Any, List, Optional
+
+from backend.generation_result import GenerationResult
+from backend.cancellation import CancellationToken
+from backend.generation_progress import GenerationProgress
+from backend.models.lcmdiffusion_setting import LCMDiffusionSetting
+from backend.process_connection import accept_connection
+from backend.process_memory import get_process_memory
+from constants import API_WORKER_THREADS, API_WORKERS, cpus
+
+_SRC_PATH = path.dirname(path.dirname(path.dirname(path.abspath(__file__))))
+_POLL_INTERVAL = 0.1
+
+
+def get_model_affinity_key(diffusion_config: LCMDiffusionSetting) -> tuple:
+    """Returns the model a worker has to load to run _diffusion_config_."""
+    if diffusion_config.use_gguf_model:
+        return (
+            "gguf",
+            diffusion_config.gguf_model.diffusion_path,
+            diffusion_config.gguf_model.t5xxl_path,
+            diffusion_config.gguf_model.vae_path,
+        )
+    if diffusion_config.use_openvino:
+        return ("openvino", diffusion_config.openvino_lcm_model_id)
+    if diffusion_config.use_lcm_lora:
+        return (
+            "lcm_lora",
+            diffusion_config.lcm_lora.base_model_id,
+            diffusion_config.lcm_lora.lcm_lora_id,
+        )
+    return ("lcm", diffusion_config.lcm_model_id)
+
+
+class _Worker:
+    def __init__(
+        self,
+        index: int,
+        threads: int,
+        prefork_server: Any = None,
+    ):
+        self.index = index
+        self.threads = threads
+        self.prefork_server = prefork_server
+        self.model_key: Optional[tuple] = None
+        self.busy = False
+        self.last_used = 0.0
+        self.generations = 0
+        self.restarts = 0
+        self._process = None
+        self._connection = None
+        self._cancel_sent = False
+
+    @property
+    def is_alive(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def start(self) -> None:
+        authkey = secrets.token_bytes(32)
+        with Listener(("127.0.0.1", 0), authkey=authkey) as listener:
+            if self.prefork_server:
+                # Forked from the process holding the preloaded model
+                self._process = self.prefork_server.fork_worker(
+                    listener.address[1],
+                    authkey,
+                    self.threads,
+                )
+                self._connection = accept_connection(
+                    listener, self._process, f"API worker {self.index}"
+                )
+                self.model_key = self.prefork_server.model_key
+                return
+            env = dict(environ)
+            env["PYTHONPATH"] = pathsep.join(
+                filter(None, [_SRC_PATH, env.get("PYTHONPATH")])
+            )
+            env["API_WORKER_AUTHKEY"] = authkey.hex()
+            threads = str(self.threads)
+            env["OMP_NUM_THREADS"] = threads
+            env["MKL_NUM_THREADS"] = threads
+            env["OPENVINO_NUM_THREADS"] = threads
+            env["GGUF_THREADS"] = threads
+            self._process = subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "backend.api.worker_pool",
+                    str(listener.address[1]),
+                ],
+                cwd=_SRC_PATH,
+                env=env,
+            )
+            self._connection = accept_connection(
+                listener, self._process, f"API worker {self.index}"
+            )
+        self.model_key = None
+
+    def wait_ready(self) -> None:
+        self._receive()
+        print(f"API worker {self.index} ready ({self.threads} threads)")
+
+    def restart(self) -> None:
+        print(f"Restarting API worker {self.index}")
+        self.terminate()
+        self.restarts += 1
+        self.start()
+        self.wait_ready()
+
+    def _receive(
+        self,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> tuple:
+        while not self._connection.poll(_POLL_INTERVAL):
+            if cancel_token and cancel_token.is_cancelled and not self._cancel_sent:
+                # The worker stops the generation after the current step
+                self._connection.send(("cancel",))
+                self._cancel_sent = True
+            if self._process.poll() is not None:
+                raise RuntimeError(
+                    f"API worker {self.index} exited with code "
+                    f"{self._process.returncode}"
+                )
+        try:
+            return self._connection.recv()
+        except EOFError:
+            raise RuntimeError(f"API worker {self.index} exited")
+
+    def generate(
+        self,
+        diffusion_configs: List[LCMDiffusionSetting],
+        progress: Any = None,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> List[GenerationResult]:
+        preview = bool(progress and progress.preview_enabled)
+        self._connection.send(("generate", diffusion_configs, preview))
+        self._cancel_sent = False
+        while True:
+            message = self._receive(cancel_token)
+            if message[0] == "progress":
+                if progress:
+                    _, step, total_steps, preview_image = message
+                    if step == 0:
+                        progress.start(total_steps)
+                    else:
+                        progress.update(step, total_steps, preview_image)
+            elif message[0] == "error":
+                raise RuntimeError(message[1])
+            else:
+                return message[1]
+
+    def terminate(self) -> None:
+        if self._process is None:
+            return
+        try:
+            self._connection.close()
+        except OSError:
+            pass
+        self._process.kill()
+        self._process.wait()
+        self._process = None
+        self._connection = None
+
+    def get_stats(self) -> dict:
+        return {
+            "index": self.index,
+            "alive": self.is_alive,
+            "busy": self.busy,
+            "model": list(self.model_key) if self.model_key else None,
+            "generations": self.generations,
+            "restarts": self.restarts,
+            "memory": (
+                get_process_memory(self._process.pid) if self.is_alive else None
+            ),
+        }
+
+
+class WorkerPool:
+    """
+    Runs the API generations on _workers_ processes using
+    _threads_per_worker_ threads each (by default the CPU cores are shared
+    between the workers). Workers are forked from _prefork_server_ if given,
+    otherwise started as new processes.
+    """
+
+    def __init__(
+        self,
+        workers: int = API_WORKERS,
+        threads_per_worker: int = API_WORKER_THREADS,
+        prefork_server: Any = None,
+    ):
+        workers = max(workers, 1)
+        if threads_per_worker <= 0:
+            threads_per_worker = max(cpus // workers, 1)
+        self.prefork_server = prefork_server
+        self._workers = [
+            _Worker(index, threads_per_worker, prefork_server)
+            for index in range(workers)
+        ]
+        self._condition = Condition()
+        self.affinity_hits = 0
+        self.model_loads = 0
+        print(f"Starting {workers} API workers")
+        for worker in self._workers:
+            worker.start()
+        for worker in self._workers:
+            worker.wait_ready()
+
+    @property
+    def size(self) -> int:
+        return len(self._workers)
+
+    def _acquire(self, model_key: tuple) -> _Worker:
+        with self._condition:
+            while True:
+                idle_workers = [worker for worker in self._workers if not worker.busy]
+                if idle_workers:
+                    break
+                self._condition.wait()
+            # Prefer a worker that has the model loaded, then a worker with
+            # no model, then the least recently used worker
+            candidates = [
+                worker for worker in idle_workers if worker.model_key == model_key
+            ]
+            if candidates:
+                self.affinity_hits += 1
+            else:
+                self.model_loads += 1
+                candidates = [
+                    worker for worker in idle_workers if worker.model_key is None
+                ] or idle_workers
+            worker = min(candidates, key=lambda candidate: candidate.last_used)
+            worker.busy = True
+            return worker
+
+    def _release(self, worker: _Worker) -> None:
+        with self._condition:
+            worker.busy = False
+            worker.last_used = time()
+            self._condition.notify()
+
+    def generate(
+        self,
+        diffusion_configs: List[LCMDiffusionSetting],
+        progress: Any = None,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> List[GenerationResult]:
+        """
+        Generates the images of one request or of a batch of compatible
+        requests on a worker, returns the result of each request.
+        """
+        model_key = get_model_affinity_key(diffusion_configs[0])
+        worker = self._acquire(model_key)
+        try:
+            if not worker.is_alive:
+                worker.restart()
+            try:
+                results = worker.generate(
+                    diffusion_configs,
+                    progress,
+                    cancel_token,
+                )
+            except RuntimeError:
+                worker.model_key = None
+                if not worker.is_alive:
+                    worker.restart()
+                raise
+            worker.model_key = model_key
+            worker.generations += 1
+            return results
+        finally:
+            if progress:
+                progress.finish()
+            self._release(worker)
+
+    def shutdown(self) -> None:
+        for worker in self._workers:
+            worker.terminate()
+        if self.prefork_server:
+            self.prefork_server.shutdown()
+
+    def get_stats(self) -> dict:
+        return {
+            "workers": [worker.get_stats() for worker in self._workers],
+            "prefork_server": (
+                self.prefork_server.get_stats() if self.prefork_server else None
+            ),
+            "affinity_hits": self.affinity_hits,
+            "model_loads": self.model_loads,
+        }
+
+
+class _WorkerProgress(GenerationProgress):
+    """Progress of a worker generation, sent to the API server."""
+
+    def __init__(
+        self,
+        connection: Any,
+        preview: bool,
+    ):
+        super().__init__(preview)
+        self._connection = connection
+
+    def start(self, total_steps: int) -> None:
+        super().start(total_steps)
+        self._connection.send(("progress", 0, total_steps, None))
+
+    def update(
+        self,
+        step: int,
+        total_steps: int = 0,
+        preview: Any = None,
+    ) -> None:
+        super().update(step, total_steps, preview)
+        self._connection.send(("progress", step, self.total_steps, preview))
+
+
+def serve_generations(
+    connection: Any,
+    context: Any,
+) -> None:
+    """Runs the generations requested by the API server with _context_."""
+    from backend.api.generation import generate_results
+
+    commands = Queue()
+    cancel_tokens = []
+
+    def receive_commands():
+        # Runs beside the generation, so a cancel request is seen while
+        # the worker is generating
+        while True:
+            try:
+                command = connection.recv()
+            except (EOFError, OSError):
+                commands.put(None)
+                break
+            if command[0] == "cancel":
+                if cancel_tokens:
+                    cancel_tokens[-1].cancel()
+            else:
+                cancel_tokens[:] = [CancellationToken()]
+                commands.put((command, cancel_tokens[0]))
+
+    Thread(target=receive_commands, daemon=True).start()
+    connection.send(("ready",))
+    while True:
+        item = commands.get()
+        if item is None:
+            break
+        (_, diffusion_configs, preview), cancel_token = item
+        try:
+            results = generate_results(
+                context,
+                diffusion_configs,
+                _WorkerProgress(connection, preview),
+                cancel_token,
+            )
+            connection.send(("results", results))
+        except Exception as exception:
+            connection.send(("error", str(exception)))
+
+
+def _run_worker(port: int) -> None:
+    authkey = bytes.fromhex(environ["API_WORKER_AUTHKEY"])
+    connection = Client(("127.0.0.1", port), authkey=authkey)
+
+    from context import Context
+    from models.interface_types import InterfaceType
+
+    serve_generations(connection, Context(InterfaceType.API_SERVER))
+
+
+if __name__ == "__main__":
+    _run_worker(int(sys.argv[1]))
@@ -1,16 +1,29 @@
 from io import BytesIO
 from base64 import b64encode, b64decode
+from typing import Optional
 from PIL import Image
 
 
+def encode_image(
+    image: Image,
+    format: str = "JPEG",
+    quality: Optional[int] = None,
+) -> bytes:
+    """Encodes _image_, _quality_ applies to the JPEG and WebP formats."""
+    options = {}
+    if quality is not None and format.upper() in ("JPEG", "WEBP"):
+        options["quality"] = quality
+    buffer = BytesIO()
+    image.save(buffer, format=format, **options)
+    return buffer.getvalue()
+
+
 def pil_image_to_base64_str(
     image: Image,
     format: str = "JPEG",
+    quality: Optional[int] = None,
 ) -> str:
-    buffer = BytesIO()
-    image.save(buffer, format=format)
-    buffer.seek(0)
-    img_base64 = b64encode(buffer.getvalue()).decode("utf-8")
+    img_base64 = b64encode(encode_image(image, format, quality)).decode("utf-8")
     return img_base64
 
 
@@ -0,0 +1,45 @@
+from threading import Event
+from typing import List
+
+
+class GenerationCancelled(Exception):
+    def __init__(self, message: str = "Generation cancelled"):
+        super().__init__(message)
+
+
+class CancellationToken:
+    """
+    Cancellation request shared between the caller of a generation and the
+    backends, which check it between the denoising steps.
+    """
+
+    def __init__(self):
+        self._event = Event()
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        self._event.set()
+
+    def raise_if_cancelled(self) -> None:
+        if self.is_cancelled:
+            raise GenerationCancelled()
+
+
+class BatchCancellationToken(CancellationToken):
+    """
+    Cancellation of a batch of generations, cancelled once all the
+    generations of the batch are cancelled.
+    """
+
+    def __init__(self, tokens: List[CancellationToken]):
+        super().__init__()
+        self._tokens = tokens
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self._event.is_set() or all(
+            token.is_cancelled for token in self._tokens
+        )
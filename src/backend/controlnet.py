@@ -1,6 +1,9 @@
 import logging
 from PIL import Image
-from typing import Any
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Optional
+from weakref import WeakValueDictionary
 from diffusers import (
     ControlNetModel,
     AutoPipelineForText2Image,
@@ -17,28 +20,61 @@ from backend.models.lcmdiffusion_setting import (
     DiffusionTask,
     ControlNetSetting,
 )
+from constants import CONTROLNET_ADAPTER_POOL_SIZE
+
+
+# Loaded ControlNet adapters by adapter path; an adapter is shared by all the
+# pipelines using it, the most recently used adapters are also kept loaded
+# while unused so that changing the ControlNet combination only re-wires them
+_controlnet_adapters = WeakValueDictionary()
+_recent_controlnet_adapters = OrderedDict()
+_controlnet_adapters_lock = Lock()
+
+
+def get_controlnet_adapter(adapter_path: str) -> Any:
+    """Returns the ControlNet adapter _adapter_path_, loading it if needed."""
+    with _controlnet_adapters_lock:
+        controlnet_adapter = _controlnet_adapters.get(adapter_path)
+        if controlnet_adapter is None:
+            logging.info("Loading ControlNet adapter")
+            controlnet_adapter = ControlNetModel.from_single_file(
+                adapter_path,
+                # local_files_only=True,
+                use_safetensors=True,
+            )
+            _controlnet_adapters[adapter_path] = controlnet_adapter
+        _recent_controlnet_adapters[adapter_path] = controlnet_adapter
+        _recent_controlnet_adapters.move_to_end(adapter_path)
+        while len(_recent_controlnet_adapters) > max(CONTROLNET_ADAPTER_POOL_SIZE, 0):
+            _recent_controlnet_adapters.popitem(last=False)
+        return controlnet_adapter
+
+
+def get_controlnet_adapter_paths(lcm_diffusion_setting) -> Optional[tuple]:
+    """Returns the adapter paths of the enabled ControlNets, _None_ if none."""
+    controlnets = lcm_diffusion_setting.get_enabled_controlnets()
+    if not controlnets:
+        return None
+    return tuple(controlnet.adapter_path for controlnet in controlnets)
 
 
 # Prepares ControlNet adapters for use with FastSD CPU
 #
 # This function loads the ControlNet adapters defined by the
 # _lcm_diffusion_setting.controlnet_ object and returns a dictionary
-# with the pipeline arguments required to use the loaded adapters
+# with the pipeline arguments required to use the loaded adapters; with
+# several enabled ControlNets, the pipeline gets a list of adapters and
+# combines them in a MultiControlNet
 def load_controlnet_adapters(lcm_diffusion_setting) -> dict:
     controlnet_args = {}
-    if (
-        lcm_diffusion_setting.controlnet is None
-        or not lcm_diffusion_setting.controlnet.enabled
-    ):
+    controlnets = lcm_diffusion_setting.get_enabled_controlnets()
+    if not controlnets:
         return controlnet_args
 
-    logging.info("Loading ControlNet adapter")
-    controlnet_adapter = ControlNetModel.from_single_file(
-        lcm_diffusion_setting.controlnet.adapter_path,
-        # local_files_only=True,
-        use_safetensors=True,
-    )
-    controlnet_args["controlnet"] = controlnet_adapter
+    adapters = [
+        get_controlnet_adapter(controlnet.adapter_path) for controlnet in controlnets
+    ]
+    controlnet_args["controlnet"] = adapters[0] if len(adapters) == 1 else adapters
     return controlnet_args
 
 
@@ -47,24 +83,23 @@ def load_controlnet_adapters(lcm_diffusion_setting) -> dict:
 # This function uses the contents of the _lcm_diffusion_setting.controlnet_
 # object to generate a dictionary with the corresponding pipeline arguments
 # to be used for image generation; in particular, it sets the ControlNet control
-# image and conditioning scale
+# images and conditioning scales, as lists when several ControlNets are enabled
 def update_controlnet_arguments(lcm_diffusion_setting) -> dict:
     controlnet_args = {}
-    if (
-        lcm_diffusion_setting.controlnet is None
-        or not lcm_diffusion_setting.controlnet.enabled
-    ):
+    controlnets = lcm_diffusion_setting.get_enabled_controlnets()
+    if not controlnets:
         return controlnet_args
 
-    controlnet_args["controlnet_conditioning_scale"] = (
-        lcm_diffusion_setting.controlnet.conditioning_scale
-    )
+    conditioning_scales = [controlnet.conditioning_scale for controlnet in controlnets]
+    control_images = [controlnet._control_image for controlnet in controlnets]
+    if len(controlnets) == 1:
+        conditioning_scales = conditioning_scales[0]
+        control_images = control_images[0]
+    controlnet_args["controlnet_conditioning_scale"] = conditioning_scales
     if lcm_diffusion_setting.diffusion_task == DiffusionTask.text_to_image.value:
-        controlnet_args["image"] = lcm_diffusion_setting.controlnet._control_image
+        controlnet_args["image"] = control_images
     elif lcm_diffusion_setting.diffusion_task == DiffusionTask.image_to_image.value:
-        controlnet_args["control_image"] = (
-            lcm_diffusion_setting.controlnet._control_image
-        )
+        controlnet_args["control_image"] = control_images
     return controlnet_args
 
 
@@ -85,31 +120,34 @@ def controlnet_settings_from_dict(
         lcm_diffusion_setting.controlnet = None
         return
 
-    controlnet = ControlNetSetting()
-    controlnet.enabled = dictionary["controlnet"][0]["enabled"]
-    controlnet.conditioning_scale = dictionary["controlnet"][0]["conditioning_scale"]
-    controlnet.adapter_path = dictionary["controlnet"][0]["adapter_path"]
-    controlnet._control_image = None
-    image_path = dictionary["controlnet"][0]["control_image"]
-    if controlnet.enabled:
-        try:
-            controlnet._control_image = Image.open(image_path)
-        except (AttributeError, FileNotFoundError) as err:
-            print(err)
-        if controlnet._control_image is None:
-            logging.error("Wrong ControlNet control image! Disabling ControlNet")
-            controlnet.enabled = False
-    lcm_diffusion_setting.controlnet = controlnet
+    controlnets = []
+    for controlnet_dict in dictionary["controlnet"]:
+        controlnet = ControlNetSetting()
+        controlnet.enabled = controlnet_dict["enabled"]
+        controlnet.conditioning_scale = controlnet_dict["conditioning_scale"]
+        controlnet.adapter_path = controlnet_dict["adapter_path"]
+        controlnet._control_image = None
+        image_path = controlnet_dict["control_image"]
+        if controlnet.enabled:
+            try:
+                controlnet._control_image = Image.open(image_path)
+            except (AttributeError, FileNotFoundError) as err:
+                print(err)
+            if controlnet._control_image is None:
+                logging.error("Wrong ControlNet control image! Disabling ControlNet")
+                controlnet.enabled = False
+        controlnets.append(controlnet)
+    # A single ControlNet is kept as a plain setting for compatibility
+    lcm_diffusion_setting.controlnet = (
+        controlnets[0] if len(controlnets) == 1 else controlnets
+    )
 
 
 def get_controlnet_pipeline(
     pipeline: Any, lcm_diffusion_setting, diffusion_task: DiffusionTask
 ) -> Any:
     """Creates a ControlNet pipeline from the base txt2img _pipeline_"""
-    if (
-        lcm_diffusion_setting.controlnet is None
-        or not lcm_diffusion_setting.controlnet.enabled
-    ):
+    if not lcm_diffusion_setting.get_enabled_controlnets():
         return None
     components = pipeline.components
     pipeline_class = pipeline.__class__.__name__
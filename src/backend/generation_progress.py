@@ -0,0 +1,235 @@
+import inspect
+from threading import Lock
+from time import perf_counter
+from typing import Any, List, Optional
+
+from PIL import Image
+
+from backend.base64_image import pil_image_to_base64_str
+from backend.cancellation import CancellationToken
+
+PREVIEW_SIZE = 256
+
+# Preview decoders by component key; the component store only keeps weak
+# references, so they would otherwise be loaded again on every step
+_preview_decoders = {}
+_preview_decoders_lock = Lock()
+
+
+class GenerationProgress:
+    """
+    Progress of a generation, updated by the step callbacks of the backends
+    and read by the streaming API endpoints. When _preview_ is enabled, the
+    latents of each step are decoded with the tiny autoencoder.
+    """
+
+    def __init__(self, preview: bool = False):
+        self.preview_enabled = preview
+        self.step = 0
+        self.total_steps = 0
+        self.preview: Optional[Image.Image] = None
+        self.finished = False
+        self.version = 0
+        self._started_at: Optional[float] = None
+        self._elapsed = 0.0
+        self._lock = Lock()
+
+    @property
+    def eta(self) -> Optional[float]:
+        """Estimated remaining time in seconds, once a step has completed."""
+        if self.step == 0 or self.total_steps == 0:
+            return None
+        time_per_step = self._elapsed / self.step
+        return max(time_per_step * (self.total_steps - self.step), 0.0)
+
+    def start(self, total_steps: int) -> None:
+        with self._lock:
+            self.step = 0
+            self.total_steps = total_steps
+            self.preview = None
+            self.finished = False
+            self._started_at = perf_counter()
+            self._elapsed = 0.0
+            self.version += 1
+
+    def update(
+        self,
+        step: int,
+        total_steps: int = 0,
+        preview: Optional[Image.Image] = None,
+    ) -> None:
+        with self._lock:
+            if self._started_at is None:
+                self._started_at = perf_counter()
+            self.step = step
+            if total_steps:
+                self.total_steps = total_steps
+            if preview is not None:
+                self.preview = preview
+            self._elapsed = perf_counter() - self._started_at
+            self.version += 1
+
+    def finish(self) -> None:
+        with self._lock:
+            self.finished = True
+            if self.total_steps:
+                self.step = self.total_steps
+            self.version += 1
+
+    def to_dict(self, include_preview: bool = True) -> dict:
+        with self._lock:
+            eta = self.eta
+            progress = {
+                "step": self.step,
+                "total_steps": self.total_steps,
+                "elapsed": round(self._elapsed, 2),
+                "eta": round(eta, 2) if eta is not None else None,
+                "finished": self.finished,
+            }
+            preview = self.preview
+        if include_preview and preview is not None:
+            progress["preview"] = pil_image_to_base64_str(preview)
+        return progress
+
+
+class GenerationProgressGroup:
+    """
+    Progress of a batch of generations, reported to the progress of each
+    generation; the preview is decoded for the first generation only.
+    """
+
+    def __init__(self, progresses: List[GenerationProgress]):
+        self.progresses = progresses
+
+    @property
+    def preview_enabled(self) -> bool:
+        return self.progresses[0].preview_enabled
+
+    @preview_enabled.setter
+    def preview_enabled(self, enabled: bool) -> None:
+        self.progresses[0].preview_enabled = enabled
+
+    def start(self, total_steps: int) -> None:
+        for progress in self.progresses:
+            progress.start(total_steps)
+
+    def update(
+        self,
+        step: int,
+        total_steps: int = 0,
+        preview: Optional[Image.Image] = None,
+    ) -> None:
+        self.progresses[0].update(step, total_steps, preview)
+        for progress in self.progresses[1:]:
+            progress.update(step, total_steps)
+
+    def finish(self) -> None:
+        for progress in self.progresses:
+            progress.finish()
+
+
+def _get_preview_decoder(pipeline: Any) -> Any:
+    import torch
+    from diffusers import AutoencoderTiny
+
+    from backend.pipelines.component_store import get_shared_component, store_component
+    from backend.tiny_autoencoder import get_tiny_autoencoder_repo_id
+
+    pipeline_class = pipeline.__class__.__name__
+    if pipeline_class.startswith("OV"):
+        # OpenVINO pipelines return PyTorch latents too
+        pipeline_class = pipeline_class[2:]
+    tiny_vae = get_tiny_autoencoder_repo_id(pipeline_class)
+    component_key = f"{tiny_vae}:{torch.float32}"
+    with _preview_decoders_lock:
+        vae = _preview_decoders.get(component_key)
+        if vae is None:
+            vae = get_shared_component(component_key)
+            if vae is None:
+                vae = store_component(
+                    component_key,
+                    AutoencoderTiny.from_pretrained(
+                        tiny_vae,
+                        torch_dtype=torch.float32,
+                    ),
+                )
+            _preview_decoders[component_key] = vae
+    return vae
+
+
+def decode_preview(
+    pipeline: Any,
+    latents: Any,
+) -> Optional[Image.Image]:
+    """
+    Decodes the first image of _latents_ at low resolution with the tiny
+    autoencoder, returns _None_ if the latents can't be previewed.
+    """
+    import torch
+
+    try:
+        vae = _get_preview_decoder(pipeline)
+        with torch.no_grad():
+            latents = latents[:1].detach().to(device=vae.device, dtype=vae.dtype)
+            image = vae.decode(latents).sample[0]
+        image = ((image.clamp(-1, 1) + 1) * 127.5).round().to(torch.uint8)
+        preview = Image.fromarray(image.permute(1, 2, 0).cpu().numpy())
+        preview.thumbnail((PREVIEW_SIZE, PREVIEW_SIZE))
+        return preview
+    except Exception as exception:
+        print(f"Preview not available : {exception}")
+        return None
+
+
+def get_step_callback_args(
+    pipeline: Any,
+    total_steps: int,
+    progress: Optional[GenerationProgress] = None,
+    cancel_token: Optional[CancellationToken] = None,
+) -> dict:
+    """
+    Returns the step callback arguments of a diffusers _pipeline_ call that
+    report the progress of each step to _progress_ and stop the generation
+    after the current step when _cancel_token_ is cancelled.
+    """
+    if progress is None and cancel_token is None:
+        return {}
+    call_parameters = inspect.signature(pipeline.__call__).parameters
+    # Wrapping pipelines (e.g. the OpenVINO pipelines of optimum) forward
+    # their keyword arguments to the diffusers pipeline
+    accepts_kwargs = any(
+        parameter.kind == inspect.Parameter.VAR_KEYWORD
+        for parameter in call_parameters.values()
+    )
+    if "callback_on_step_end" not in call_parameters and not accepts_kwargs:
+        return {}
+
+    if progress:
+        progress.start(total_steps)
+
+    def on_step_end(pipe, step, timestep, callback_kwargs):
+        if cancel_token:
+            cancel_token.raise_if_cancelled()
+        if progress is None:
+            return callback_kwargs
+        preview = None
+        if progress.preview_enabled and "latents" in callback_kwargs:
+            # LCM pipelines also provide the denoised latents of the step
+            latents = callback_kwargs.get("denoised", callback_kwargs["latents"])
+            preview = decode_preview(pipe, latents)
+            if preview is None:
+                progress.preview_enabled = False
+        progress.update(
+            step + 1,
+            getattr(pipe, "num_timesteps", 0) or total_steps,
+            preview,
+        )
+        return callback_kwargs
+
+    tensor_inputs = ["latents"]
+    if "denoised" in getattr(pipeline, "_callback_tensor_inputs", []):
+        tensor_inputs.append("denoised")
+    return {
+        "callback_on_step_end": on_step_end,
+        "callback_on_step_end_tensor_inputs": tensor_inputs,
+    }
@@ -0,0 +1,19 @@
+from typing import Any, List
+
+
+class GenerationResult:
+    """
+    Generated images of a generation with its latency in seconds and its
+    error message (empty on success); the API server encodes the images in
+    the format requested by the client.
+    """
+
+    def __init__(
+        self,
+        images: List[Any],
+        latency: float = 0,
+        error: str = "",
+    ):
+        self.images = images
+        self.latency = latency
+        self.error = error
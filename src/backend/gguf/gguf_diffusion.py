@@ -15,7 +15,7 @@ from ctypes import (
 )
 from dataclasses import dataclass, field
 from os import path
-from typing import List, Any
+from typing import Any, Callable, List, Optional
 
 import numpy as np
 from PIL import Image
@@ -186,6 +186,28 @@ class GGUFDiffusion:
         self.c_log_callback = SdLogCallbackType(self.log_callback)
         self.libsdcpp.sd_set_log_callback(self.c_log_callback, None)
 
+    def set_progress_callback(self, callback: Optional[Callable]) -> None:
+        """Sets a _callback(step, steps, time)_ called after each sampling step."""
+        SdProgressCallbackType = ctypes.CFUNCTYPE(
+            None,
+            c_int,
+            c_int,
+            c_float,
+            ctypes.c_void_p,
+        )
+        self.libsdcpp.sd_set_progress_callback.argtypes = [
+            SdProgressCallbackType,
+            ctypes.c_void_p,
+        ]
+        self.libsdcpp.sd_set_progress_callback.restype = None
+        if callback is None:
+            self.c_progress_callback = SdProgressCallbackType()
+        else:
+            self.c_progress_callback = SdProgressCallbackType(
+                lambda step, steps, time, data: callback(step, steps, time)
+            )
+        self.libsdcpp.sd_set_progress_callback(self.c_progress_callback, None)
+
     def _get_sdcpp_shared_lib_path(self, root_path: str) -> str:
         system_name = platform.system()
         print(f"GGUF Diffusion on {system_name}")
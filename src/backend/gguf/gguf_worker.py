@@ -0,0 +1,147 @@
+"""
+Runs the stablediffusion.cpp GGUF diffusion in a worker process.
+
+Image generation is a single blocking call into the shared library, it can't
+be interrupted from Python; running it in a separate process allows to stop
+an abandoned generation by killing the worker. The model is loaded again by a
+new worker on the next generation.
+"""
+
+import secrets
+import subprocess
+import sys
+from multiprocessing.connection import Client, Listener
+from os import environ, path, pathsep
+from typing import Any, Callable, List, Optional
+
+from backend.cancellation import CancellationToken, GenerationCancelled
+from backend.gguf.gguf_diffusion import GGUFDiffusion, ModelConfig, Txt2ImgConfig
+from backend.process_connection import accept_connection
+
+_SRC_PATH = path.dirname(path.dirname(path.dirname(path.abspath(__file__))))
+_POLL_INTERVAL = 0.1
+
+
+class GGUFWorker:
+    """Same interface as _GGUFDiffusion_, generations can be cancelled."""
+
+    def __init__(
+        self,
+        libpath: str,
+        config: ModelConfig,
+        logging_enabled: bool = False,
+    ):
+        self.libpath = libpath
+        self.model_config = config
+        self.logging_enabled = logging_enabled
+        self._process = None
+        self._connection = None
+        self._start()
+
+    def _start(self) -> None:
+        authkey = secrets.token_bytes(32)
+        with Listener(("127.0.0.1", 0), authkey=authkey) as listener:
+            env = dict(environ)
+            env["PYTHONPATH"] = pathsep.join(
+                filter(None, [_SRC_PATH, env.get("PYTHONPATH")])
+            )
+            env["GGUF_WORKER_AUTHKEY"] = authkey.hex()
+            self._process = subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "backend.gguf.gguf_worker",
+                    str(listener.address[1]),
+                ],
+                cwd=_SRC_PATH,
+                env=env,
+            )
+            self._connection = accept_connection(
+                listener, self._process, "GGUF worker"
+            )
+        self._connection.send((self.libpath, self.model_config, self.logging_enabled))
+        message = self._receive()
+        if message[0] == "error":
+            self.terminate()
+            raise ValueError(message[1])
+
+    def _receive(
+        self,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> tuple:
+        while not self._connection.poll(_POLL_INTERVAL):
+            if cancel_token and cancel_token.is_cancelled:
+                print("Stopping GGUF worker")
+                self.terminate()
+                raise GenerationCancelled()
+            if self._process.poll() is not None:
+                raise RuntimeError(
+                    f"GGUF worker exited with code {self._process.returncode}"
+                )
+        try:
+            return self._connection.recv()
+        except EOFError:
+            raise RuntimeError("GGUF worker exited")
+
+    def generate_text2mg(
+        self,
+        txt2img_cfg: Txt2ImgConfig,
+        progress_callback: Optional[Callable] = None,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> List[Any]:
+        if self._process is None:
+            self._start()
+        self._connection.send(("generate", txt2img_cfg))
+        while True:
+            message = self._receive(cancel_token)
+            if message[0] == "progress":
+                if progress_callback:
+                    progress_callback(*message[1:])
+            elif message[0] == "error":
+                raise RuntimeError(message[1])
+            else:
+                return message[1]
+
+    def __del__(self):
+        self.terminate()
+
+    def terminate(self) -> None:
+        if getattr(self, "_process", None) is None:
+            return
+        try:
+            self._connection.close()
+        except OSError:
+            pass
+        self._process.kill()
+        self._process.wait()
+        self._process = None
+        self._connection = None
+
+
+def _run_worker(port: int) -> None:
+    authkey = bytes.fromhex(environ["GGUF_WORKER_AUTHKEY"])
+    connection = Client(("127.0.0.1", port), authkey=authkey)
+    libpath, config, logging_enabled = connection.recv()
+    try:
+        diffusion = GGUFDiffusion(libpath, config, logging_enabled)
+    except Exception as exception:
+        connection.send(("error", str(exception)))
+        return
+    diffusion.set_progress_callback(
+        lambda step, steps, time: connection.send(("progress", step, steps))
+    )
+    connection.send(("ready",))
+    while True:
+        try:
+            command, txt2img_cfg = connection.recv()
+        except EOFError:
+            break
+        try:
+            connection.send(("images", diffusion.generate_text2mg(txt2img_cfg)))
+        except Exception as exception:
+            connection.send(("error", str(exception)))
+    diffusion.terminate()
+
+
+if __name__ == "__main__":
+    _run_worker(int(sys.argv[1]))
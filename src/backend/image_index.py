@@ -0,0 +1,372 @@
+"""
+SQLite catalog of the generated images.
+
+Every saved generation is recorded with its main settings (prompt, model,
+seeds, size) and the paths of its images, so past generations can be
+searched without reading the JSON sidecars. Prompts are indexed for full
+text search when SQLite has the FTS5 extension. Generations saved before
+the catalog existed are added from their sidecars by _backfill_.
+"""
+
+import json
+import sqlite3
+from os import makedirs, path, walk
+from threading import Lock
+from time import time
+from typing import Any, List, Optional
+
+from constants import IMAGE_INDEX_ENABLED
+from paths import FastStableDiffusionPaths
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS generations (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    prompt TEXT,
+    negative_prompt TEXT,
+    model TEXT,
+    diffusion_task TEXT,
+    width INTEGER,
+    height INTEGER,
+    inference_steps INTEGER,
+    guidance_scale REAL,
+    latency REAL,
+    settings TEXT
+);
+CREATE INDEX IF NOT EXISTS generations_created_at ON generations (created_at);
+CREATE INDEX IF NOT EXISTS generations_model ON generations (model, created_at);
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    generation_id TEXT NOT NULL REFERENCES generations (id),
+    image_index INTEGER,
+    seed INTEGER,
+    format TEXT,
+    file_size INTEGER
+);
+CREATE INDEX IF NOT EXISTS images_generation_id ON images (generation_id);
+CREATE INDEX IF NOT EXISTS images_seed ON images (seed);
+"""
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS prompts USING fts5 (
+    generation_id UNINDEXED,
+    prompt
+);
+"""
+_IMAGE_EXTENSIONS = (".png", ".jpg", ".webp")
+_BACKFILL_BATCH_SIZE = 1000
+
+
+def get_model_name(settings: dict) -> str:
+    """Returns the model used by the generation _settings_ (sidecar data)."""
+    if settings.get("use_gguf_model"):
+        return (settings.get("gguf_model") or {}).get("diffusion_path") or ""
+    if settings.get("use_openvino"):
+        return settings.get("openvino_lcm_model_id", "")
+    if settings.get("use_lcm_lora"):
+        return (settings.get("lcm_lora") or {}).get("base_model_id", "")
+    return settings.get("lcm_model_id", "")
+
+
+def _get_fts_query(prompt: str) -> str:
+    # Every word must match, quoted so FTS5 operators are not interpreted
+    words = ['"' + word.replace('"', '""') + '"' for word in prompt.split()]
+    return " ".join(words)
+
+
+class ImageIndex:
+    """
+    Catalog of generated images in the SQLite database _db_path_, opened
+    on first use. Safe to use from several threads.
+    """
+
+    def __init__(self, db_path: str = ""):
+        if not db_path:
+            db_path = FastStableDiffusionPaths.get_image_index_path()
+        self.db_path = db_path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = Lock()
+        self.full_text_search = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is not None:
+            return self._connection
+        makedirs(path.dirname(path.abspath(self.db_path)), exist_ok=True)
+        connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        # Readers (gallery, CLI) don't block the writer
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(_SCHEMA)
+        try:
+            connection.executescript(_FTS_SCHEMA)
+            self.full_text_search = True
+        except sqlite3.OperationalError:
+            print("SQLite FTS5 not available, prompt search will be slower")
+        self._connection = connection
+        return connection
+
+    def _insert_generation(
+        self,
+        connection: sqlite3.Connection,
+        generation_id: str,
+        settings: dict,
+        images: List[dict],
+        created_at: float,
+        latency: Optional[float],
+    ) -> bool:
+        cursor = connection.execute(
+            "INSERT OR IGNORE INTO generations (id, created_at, prompt,"
+            " negative_prompt, model, diffusion_task, width, height,"
+            " inference_steps, guidance_scale, latency, settings)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                generation_id,
+                created_at,
+                settings.get("prompt", ""),
+                settings.get("negative_prompt", ""),
+                get_model_name(settings),
+                settings.get("diffusion_task", ""),
+                settings.get("image_width"),
+                settings.get("image_height"),
+                settings.get("inference_steps"),
+                settings.get("guidance_scale"),
+                latency,
+                json.dumps(settings),
+            ),
+        )
+        if cursor.rowcount == 0:
+            # Already indexed
+            return False
+        if self.full_text_search:
+            connection.execute(
+                "INSERT INTO prompts (generation_id, prompt) VALUES (?, ?)",
+                (generation_id, settings.get("prompt", "")),
+            )
+        image_seeds = settings.get("image_seeds") or []
+        default_seed = settings.get("seed") if settings.get("use_seed") else None
+        connection.executemany(
+            "INSERT OR IGNORE INTO images (path, generation_id, image_index,"
+            " seed, format, file_size) VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    image["path"],
+                    generation_id,
+                    index,
+                    image_seeds[index] if index < len(image_seeds) else default_seed,
+                    path.splitext(image["path"])[1].lstrip(".").upper(),
+                    image.get("file_size"),
+                )
+                for index, image in enumerate(images)
+            ],
+        )
+        return True
+
+    def add_generation(
+        self,
+        generation_id: str,
+        settings: dict,
+        images: List[dict],
+        created_at: Optional[float] = None,
+        latency: Optional[float] = None,
+    ) -> None:
+        """
+        Records a generation; _settings_ is the sidecar data of the
+        generation, _images_ the _path_ and _file_size_ of each image.
+        """
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                self._insert_generation(
+                    connection,
+                    generation_id,
+                    settings,
+                    images,
+                    created_at or time(),
+                    latency,
+                )
+
+    def search(
+        self,
+        prompt: str = "",
+        model: str = "",
+        seed: Optional[int] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: int = 50,
+        offset: int = 0,
+    ) -> List[dict]:
+        """
+        Returns the images matching the filters, most recent first; every
+        word of _prompt_ must be in the prompt of the generation.
+        """
+        conditions = []
+        parameters: List[Any] = []
+        if prompt.strip():
+            # FTS5 availability is known once connected
+            self._ensure_connected()
+            if self.full_text_search:
+                conditions.append(
+                    "g.id IN (SELECT generation_id FROM prompts WHERE prompts MATCH ?)"
+                )
+                parameters.append(_get_fts_query(prompt))
+            else:
+                for word in prompt.split():
+                    conditions.append("g.prompt LIKE ?")
+                    parameters.append(f"%{word}%")
+        if model:
+            conditions.append("g.model = ?")
+            parameters.append(model)
+        if seed is not None:
+            conditions.append("i.seed = ?")
+            parameters.append(seed)
+        if since is not None:
+            conditions.append("g.created_at >= ?")
+            parameters.append(since)
+        if until is not None:
+            conditions.append("g.created_at < ?")
+            parameters.append(until)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        query = (
+            "SELECT i.path, i.generation_id, i.image_index, i.seed, i.format,"
+            " i.file_size, g.created_at, g.prompt, g.negative_prompt, g.model,"
+            " g.diffusion_task, g.width, g.height, g.inference_steps,"
+            " g.guidance_scale, g.latency"
+            " FROM images i JOIN generations g ON g.id = i.generation_id"
+            f" {where} ORDER BY g.created_at DESC, i.image_index"
+            " LIMIT ? OFFSET ?"
+        )
+        parameters.extend([limit, offset])
+        with self._lock:
+            rows = self._connect().execute(query, parameters).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_generation(self, generation_id: str) -> Optional[dict]:
+        """Returns a generation with its settings and image paths."""
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT * FROM generations WHERE id = ?",
+                (generation_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            images = connection.execute(
+                "SELECT path, seed FROM images WHERE generation_id = ?"
+                " ORDER BY image_index",
+                (generation_id,),
+            ).fetchall()
+        generation = dict(row)
+        generation["settings"] = json.loads(generation["settings"] or "{}")
+        generation["images"] = [dict(image) for image in images]
+        return generation
+
+    def _ensure_connected(self) -> None:
+        with self._lock:
+            self._connect()
+
+    def backfill(self, results_path: str = "") -> int:
+        """
+        Indexes the generations saved in _results_path_ (recursively) from
+        their JSON sidecars, returns the number of generations added.
+        """
+        results_path = results_path or FastStableDiffusionPaths.get_results_path()
+        added = 0
+        batch = []
+        for root, _, files in walk(results_path):
+            images = {}
+            for file_name in files:
+                if file_name.lower().endswith(_IMAGE_EXTENSIONS):
+                    generation_id = file_name.rsplit("-", 1)[0]
+                    images.setdefault(generation_id, []).append(file_name)
+            for file_name in files:
+                if not file_name.endswith(".json"):
+                    continue
+                generation_id = file_name[: -len(".json")]
+                if generation_id not in images:
+                    continue
+                json_path = path.join(root, file_name)
+                try:
+                    with open(json_path) as json_file:
+                        settings = json.load(json_file)
+                    created_at = path.getmtime(json_path)
+                except (OSError, ValueError) as exception:
+                    print(f"Skipping {json_path} : {exception}")
+                    continue
+                image_files = sorted(images[generation_id], key=_get_image_number)
+                batch.append(
+                    (
+                        generation_id,
+                        settings,
+                        [
+                            _get_image_record(path.join(root, image_file))
+                            for image_file in image_files
+                        ],
+                        created_at,
+                    )
+                )
+                if len(batch) >= _BACKFILL_BATCH_SIZE:
+                    added += self._add_batch(batch)
+                    batch = []
+        if batch:
+            added += self._add_batch(batch)
+        return added
+
+    def _add_batch(self, batch: list) -> int:
+        added = 0
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                for generation_id, settings, images, created_at in batch:
+                    if self._insert_generation(
+                        connection,
+                        generation_id,
+                        settings,
+                        images,
+                        created_at,
+                        None,
+                    ):
+                        added += 1
+        return added
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            connection = self._connect()
+            generations = connection.execute(
+                "SELECT COUNT(*) FROM generations"
+            ).fetchone()[0]
+            images = connection.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+        return {
+            "db_path": self.db_path,
+            "generations": generations,
+            "images": images,
+            "size_mb": round(path.getsize(self.db_path) / (1024 * 1024), 2),
+            "full_text_search": self.full_text_search,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def _get_image_number(file_name: str) -> int:
+    # Images are saved as {generation id}-{number}.{extension}
+    try:
+        return int(path.splitext(file_name)[0].rsplit("-", 1)[1])
+    except (IndexError, ValueError):
+        return 0
+
+
+def _get_image_record(image_path: str) -> dict:
+    try:
+        file_size = path.getsize(image_path)
+    except OSError:
+        file_size = None
+    return {
+        "path": path.abspath(image_path),
+        "file_size": file_size,
+    }
+
+
+image_index = ImageIndex() if IMAGE_INDEX_ENABLED else None
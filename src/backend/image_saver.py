@@ -1,8 +1,13 @@
+import atexit
 import json
-from os import path, mkdir
-from typing import Any
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from os import makedirs, path
+from threading import BoundedSemaphore, Lock
+from typing import Any, Callable, Set
 from uuid import uuid4
+from backend.image_index import image_index
 from backend.models.lcmdiffusion_setting import LCMDiffusionSetting
+from constants import IMAGE_SAVE_QUEUE_SIZE, IMAGE_SAVE_THREADS
 from utils import get_image_file_extension
 
 
@@ -22,7 +27,83 @@ def get_exclude_keys():
     return exclude_keys
 
 
+def _get_save_options(
+    format: str,
+    jpeg_quality: int,
+    png_compress_level: int,
+    webp_lossless: bool,
+) -> dict:
+    if format == "PNG":
+        return {"compress_level": png_compress_level}
+    if format == "WEBP":
+        return {"quality": jpeg_quality, "lossless": webp_lossless}
+    return {"quality": jpeg_quality}
+
+
+def _save_image(
+    image: Any,
+    file_path: str,
+    format: str,
+    options: dict,
+) -> None:
+    image.save(file_path, format=format, **options)
+
+
+def _index_generation(
+    generation_id: str,
+    data: dict,
+    image_paths: list[str],
+    image_futures: list[Future],
+    latency: float,
+) -> None:
+    # Queued after the images, which are written first
+    wait(image_futures)
+    images = []
+    for image_path, future in zip(image_paths, image_futures):
+        if future.exception() is None:
+            images.append(
+                {
+                    "path": path.abspath(image_path),
+                    "file_size": path.getsize(image_path),
+                }
+            )
+    image_index.add_generation(
+        generation_id,
+        data,
+        images,
+        latency=latency,
+    )
+
+
+def _save_json(
+    data: dict,
+    file_path: str,
+) -> None:
+    with open(file_path, "w") as json_file:
+        json.dump(
+            data,
+            json_file,
+            indent=4,
+        )
+
+
 class ImageSaver:
+    """
+    Saves the generated images on a pool of background threads, the file
+    names are returned before the images are written. At most
+    IMAGE_SAVE_QUEUE_SIZE files are waiting to be written, a caller saving
+    more images waits for the queue; pending files are written before the
+    application exits.
+    """
+
+    _executor = ThreadPoolExecutor(
+        max_workers=max(IMAGE_SAVE_THREADS, 1),
+        thread_name_prefix="image-saver",
+    )
+    _slots = BoundedSemaphore(max(IMAGE_SAVE_QUEUE_SIZE, 1))
+    _pending: Set[Future] = set()
+    _lock = Lock()
+
     @staticmethod
     def save_images(
         output_path: str,
@@ -31,12 +112,33 @@ class ImageSaver:
         format: str = "PNG",
         jpeg_quality: int = 90,
         lcm_diffusion_setting: LCMDiffusionSetting = None,
+        png_compress_level: int = 6,
+        webp_lossless: bool = False,
+        wait_saved: bool = False,
+        latency: float = None,
     ) -> list[str]:
         gen_id = uuid4()
         image_ids = []
 
         if images:
             image_seeds = []
+            if folder_name:
+                out_path = path.join(
+                    output_path,
+                    folder_name,
+                )
+            else:
+                out_path = output_path
+            makedirs(out_path, exist_ok=True)
+            image_extension = get_image_file_extension(format)
+            options = _get_save_options(
+                format,
+                jpeg_quality,
+                png_compress_level,
+                webp_lossless,
+            )
+            futures = []
+            image_paths = []
 
             for index, image in enumerate(images):
 
@@ -44,32 +146,78 @@ class ImageSaver:
                 if image_seed is not None:
                     image_seeds.append(image_seed)
 
-                if not path.exists(output_path):
-                    mkdir(output_path)
-
-                if folder_name:
-                    out_path = path.join(
-                        output_path,
-                        folder_name,
-                    )
-                else:
-                    out_path = output_path
-
-                if not path.exists(out_path):
-                    mkdir(out_path)
-                image_extension = get_image_file_extension(format)
                 image_file_name = f"{gen_id}-{index+1}{image_extension}"
                 image_ids.append(image_file_name)
-                image.save(path.join(out_path, image_file_name), quality = jpeg_quality)
+                image_paths.append(path.join(out_path, image_file_name))
+                futures.append(
+                    ImageSaver._submit(
+                        _save_image,
+                        image,
+                        image_paths[-1],
+                        format,
+                        options,
+                    )
+                )
             if lcm_diffusion_setting:
+                # Settings of the generation, they may change before the
+                # file is written
                 data = lcm_diffusion_setting.model_dump(exclude=get_exclude_keys())
                 if image_seeds:
                     data['image_seeds'] = image_seeds
-                with open(path.join(out_path, f"{gen_id}.json"), "w") as json_file:
-                    json.dump(
+                image_futures = list(futures)
+                futures.append(
+                    ImageSaver._submit(
+                        _save_json,
                         data,
-                        json_file,
-                        indent=4,
+                        path.join(out_path, f"{gen_id}.json"),
+                    )
+                )
+                if image_index:
+                    futures.append(
+                        ImageSaver._submit(
+                            _index_generation,
+                            str(gen_id),
+                            data,
+                            image_paths,
+                            image_futures,
+                            latency,
+                        )
                     )
+            if wait_saved:
+                wait(futures)
         return image_ids
-            
+
+    @staticmethod
+    def _submit(
+        function: Callable,
+        *args: Any,
+    ) -> Future:
+        ImageSaver._slots.acquire()
+        with ImageSaver._lock:
+            try:
+                future = ImageSaver._executor.submit(function, *args)
+            except Exception:
+                ImageSaver._slots.release()
+                raise
+            ImageSaver._pending.add(future)
+        future.add_done_callback(ImageSaver._on_saved)
+        return future
+
+    @staticmethod
+    def _on_saved(future: Future) -> None:
+        ImageSaver._slots.release()
+        with ImageSaver._lock:
+            ImageSaver._pending.discard(future)
+        exception = None if future.cancelled() else future.exception()
+        if exception:
+            print(f"Error in saving image : {exception}")
+
+    @staticmethod
+    def flush() -> None:
+        """Waits until the pending images are written."""
+        with ImageSaver._lock:
+            pending = list(ImageSaver._pending)
+        wait(pending)
+
+
+atexit.register(ImageSaver.flush)
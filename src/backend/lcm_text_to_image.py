@@ -1,14 +1,19 @@
 import gc
 from math import ceil
-from typing import Any, List
+from time import perf_counter
+from typing import Any, List, Optional
 import random
 
 import numpy as np
 import torch
 from backend.device import is_openvino_device
-from backend.lora import reset_active_lora_weights
+from backend.lora import (
+    get_active_lora_weights,
+    lora_manager,
+)
 from backend.controlnet import (
     update_controlnet_arguments,
+    get_controlnet_adapter_paths,
     get_controlnet_pipeline,
 )
 from backend.models.lcmdiffusion_setting import (
@@ -18,6 +23,7 @@ from backend.models.lcmdiffusion_setting import (
 )
 from backend.openvino.pipelines import (
     get_ov_image_to_image_pipeline,
+    get_ov_image_to_image_pipeline_from_pipe,
     get_ov_text_to_image_pipeline,
     ov_load_tiny_autoencoder,
     get_ov_diffusion_pipeline,
@@ -29,12 +35,22 @@ from backend.pipelines.lcm import (
     load_taesd,
 )
 from backend.pipelines.lcm_lora import get_lcm_lora_pipeline
+from backend.pipelines.component_store import LORA_COMPONENTS
+from backend.openvino.shape_buckets import CompiledShapePool
+from backend.cancellation import CancellationToken
+from backend.generation_progress import GenerationProgress, get_step_callback_args
+from backend.prompt_embedding_cache import get_prompt_embeds_args
+from backend.pipeline_cache import (
+    PipelineCache,
+    get_pipeline_memory_size,
+    get_resident_memory,
+)
 from constants import DEVICE, GGUF_THREADS
 from diffusers import LCMScheduler
 from image_ops import resize_pil_image
 from backend.openvino.ov_hc_stablediffusion_pipeline import OvHcLatentConsistency
+from backend.gguf.gguf_worker import GGUFWorker
 from backend.gguf.gguf_diffusion import (
-    GGUFDiffusion,
     ModelConfig,
     Txt2ImgConfig,
     SampleMethod,
@@ -61,14 +77,19 @@ class LCMTextToImage:
         self.img2img_pipeline = None
         self.controlnet_pipeline = None
         self.controlnet_img2img_pipeline = None
+        self.controlnet_adapter_paths = None
+        self.use_tiny_auto_encoder = False
+        self.token_merging = 0.0
+        self.default_vae = None
+        self.shape_pool = None
+        self.ov_pipelines = {}
+        self.pipeline_cache = PipelineCache()
+        self._pipeline_key = None
         self.use_openvino = False
         self.device = ""
         self.previous_model_id = None
-        self.previous_use_tae_sd = False
         self.previous_use_lcm_lora = False
         self.previous_ov_model_id = ""
-        self.previous_token_merging = 0.0
-        self.previous_safety_checker = False
         self.previous_use_openvino = False
         self.img_to_img_pipeline = None
         self.is_openvino_init = False
@@ -135,8 +156,13 @@ class LCMTextToImage:
     def _generate_images_hetero_compute(
         self,
         lcm_diffusion_setting: LCMDiffusionSetting,
+        progress: Optional[GenerationProgress] = None,
+        cancel_token: Optional[CancellationToken] = None,
     ):
         print("Using OpenVINO ")
+        if progress:
+            progress.start(lcm_diffusion_setting.inference_steps)
+
         if lcm_diffusion_setting.diffusion_task == DiffusionTask.text_to_image.value:
             return [
                 self.pipeline.generate(
@@ -145,6 +171,8 @@ class LCMTextToImage:
                     init_image=None,
                     strength=1.0,
                     num_inference_steps=lcm_diffusion_setting.inference_steps,
+                    progress=progress,
+                    cancel_token=cancel_token,
                 )
             ]
         else:
@@ -155,6 +183,8 @@ class LCMTextToImage:
                     init_image=lcm_diffusion_setting.init_image,
                     strength=lcm_diffusion_setting.strength,
                     num_inference_steps=lcm_diffusion_setting.inference_steps,
+                    progress=progress,
+                    cancel_token=cancel_token,
                 )
             ]
 
@@ -177,6 +207,17 @@ class LCMTextToImage:
     def _is_flux_klein_model(self) -> bool:
         return "flux2-klein" in self.ov_model_id.lower()
 
+    def _is_ov_shared_task_model(self) -> bool:
+        """
+        Stable Diffusion and SDXL OpenVINO models serve text to image and
+        image to image with the same submodels.
+        """
+        return not (
+            "flux" in self.ov_model_id.lower()
+            or self._is_sana_model()
+            or self._is_hetero_pipeline()
+        )
+
     def _do_validations(self, lcm_diffusion_setting: LCMDiffusionSetting) -> None:
         modes = [
             lcm_diffusion_setting.use_gguf_model,
@@ -229,11 +270,8 @@ class LCMTextToImage:
         self.device = device
         self.use_openvino = lcm_diffusion_setting.use_openvino
         model_id = lcm_diffusion_setting.lcm_model_id
-        use_local_model = lcm_diffusion_setting.use_offline_model
-        use_tiny_auto_encoder = lcm_diffusion_setting.use_tiny_auto_encoder
         use_lora = lcm_diffusion_setting.use_lcm_lora
         lcm_lora: LCMLora = lcm_diffusion_setting.lcm_lora
-        token_merging = lcm_diffusion_setting.token_merging
 
         if lcm_diffusion_setting.diffusion_task == DiffusionTask.image_to_image.value:
             lcm_diffusion_setting.init_image = resize_pil_image(
@@ -261,225 +299,74 @@ class LCMTextToImage:
             self.pipeline = self.txt2img_pipeline
             self.img_to_img_pipeline = self.img2img_pipeline
             # Regenerate the ControlNet pipelines if the variable
-            # lcm_diffusion_setting.rebuild_controlnet_pipeline is set,
-            # this is done here because rebuilding the ControlNet pipelines
-            # doesn't necessarily implies a full pipeline rebuild.
-            if lcm_diffusion_setting.rebuild_controlnet_pipeline:
-                if self.controlnet_pipeline:
-                    del self.controlnet_pipeline
-                    self.controlnet_pipeline = None
-                if self.controlnet_img2img_pipeline:
-                    del self.controlnet_img2img_pipeline
-                    self.controlnet_img2img_pipeline = None
-                gc.collect()
-                self.controlnet_pipeline = get_controlnet_pipeline(
-                    self.txt2img_pipeline,
-                    lcm_diffusion_setting,
-                    DiffusionTask.text_to_image,
-                )
-                self.controlnet_img2img_pipeline = get_controlnet_pipeline(
-                    self.txt2img_pipeline,
-                    lcm_diffusion_setting,
-                    DiffusionTask.image_to_image,
-                )
+            # lcm_diffusion_setting.rebuild_controlnet_pipeline is set or
+            # the enabled adapters have changed, this is done here because
+            # rebuilding the ControlNet pipelines doesn't necessarily implies
+            # a full pipeline rebuild.
+            if (
+                lcm_diffusion_setting.rebuild_controlnet_pipeline
+                or self.controlnet_adapter_paths
+                != get_controlnet_adapter_paths(lcm_diffusion_setting)
+            ):
+                self._rebuild_controlnet_pipelines(lcm_diffusion_setting)
                 lcm_diffusion_setting.rebuild_controlnet_pipeline = False
 
         if (
             self.pipeline is None
             or self.previous_model_id != model_id
-            or self.previous_use_tae_sd != use_tiny_auto_encoder
             or self.previous_lcm_lora_base_id != lcm_lora.base_model_id
             or self.previous_lcm_lora_id != lcm_lora.lcm_lora_id
             or self.previous_use_lcm_lora != use_lora
             or self.previous_ov_model_id != self.ov_model_id
-            or self.previous_token_merging != token_merging
-            or self.previous_safety_checker != lcm_diffusion_setting.use_safety_checker
             or self.previous_use_openvino != lcm_diffusion_setting.use_openvino
             or self.previous_use_gguf_model != lcm_diffusion_setting.use_gguf_model
             or self.previous_gguf_model != lcm_diffusion_setting.gguf_model
             or (
                 self.use_openvino
                 and (
-                    self.previous_task_type != lcm_diffusion_setting.diffusion_task
+                    (
+                        self.previous_task_type != lcm_diffusion_setting.diffusion_task
+                        and not self.ov_pipelines
+                    )
                     or self.previous_lora != lcm_diffusion_setting.lora
                 )
             )
             or lcm_diffusion_setting.rebuild_pipeline
         ):
-            if self.use_openvino and is_openvino_device():
-                if self.pipeline:
-                    del self.pipeline
-                    self.pipeline = None
-                    gc.collect()
-                self.is_openvino_init = True
-                if (
-                    lcm_diffusion_setting.diffusion_task
-                    == DiffusionTask.text_to_image.value
-                    or lcm_diffusion_setting.diffusion_task
-                    == DiffusionTask.edit_image.value
-                ):
-                    print(
-                        f"***** Init Text to image (OpenVINO) - {self.ov_model_id} *****"
-                    )
-                    if "flux" in self.ov_model_id.lower() or self._is_sana_model():
-                        if self._is_flux_klein_model():
-                            print("Loading OpenVINO Flux Klein pipeline")
-                            self.pipeline = get_flux_klein_pipeline(
-                                self.ov_model_id,
-                                use_local_model,
-                            )
-                        else:
-                            if self._is_sana_model():
-                                print("Loading OpenVINO SANA Sprint pipeline")
-                            else:
-                                print("Loading OpenVINO Flux pipeline")
-                            self.pipeline = get_ov_diffusion_pipeline(self.ov_model_id)
-                    elif self._is_hetero_pipeline():
-                        self._load_ov_hetero_pipeline()
-                    else:
-                        self.pipeline = get_ov_text_to_image_pipeline(
-                            self.ov_model_id,
-                            use_local_model,
-                        )
-                elif (
-                    lcm_diffusion_setting.diffusion_task
-                    == DiffusionTask.image_to_image.value
-                ):
-                    if not self.pipeline and self._is_hetero_pipeline():
-                        self._load_ov_hetero_pipeline()
-                    else:
-                        print(
-                            f"***** Image to image (OpenVINO) - {self.ov_model_id} *****"
-                        )
-                        self.pipeline = get_ov_image_to_image_pipeline(
-                            self.ov_model_id,
-                            use_local_model,
-                        )
-            elif lcm_diffusion_setting.use_gguf_model:
-                model = lcm_diffusion_setting.gguf_model.diffusion_path
-                print(f"***** Init Text to image (GGUF) - {model} *****")
-                # if self.pipeline:
-                #     self.pipeline.terminate()
-                #     del self.pipeline
-                #     self.pipeline = None
-                self._init_gguf_diffusion(lcm_diffusion_setting)
-            else:
-                # Code for pipeline rebuild in LCM or LCM-LoRA modes
-                reset_active_lora_weights()
-                if self.txt2img_pipeline:  # In LCM or LCM-LoRA modes
-                    self.pipeline = self.txt2img_pipeline
-                    if self.txt2img_pipeline:
-                        del self.txt2img_pipeline
-                        self.txt2img_pipeline = None
-                    if self.img2img_pipeline:
-                        del self.img2img_pipeline
-                        self.img2img_pipeline = None
-                    if self.img_to_img_pipeline:
-                        del self.img_to_img_pipeline
-                        self.img_to_img_pipeline = None
-                    if self.controlnet_pipeline:
-                        del self.controlnet_pipeline
-                        self.controlnet_pipeline = None
-                    if self.controlnet_img2img_pipeline:
-                        del self.controlnet_img2img_pipeline
-                        self.controlnet_img2img_pipeline = None
-                    del self.pipeline
-                    self.pipeline = None
-                    gc.collect()
-
-                if use_lora:
-                    print(
-                        f"***** Init LCM-LoRA pipeline - {lcm_lora.base_model_id} *****"
-                    )
-                    self.pipeline = get_lcm_lora_pipeline(
-                        lcm_lora.base_model_id,
-                        lcm_lora.lcm_lora_id,
-                        use_local_model,
-                        torch_data_type=self.torch_data_type,
-                    )
-
-                else:
-                    print(f"***** Init LCM Model pipeline - {model_id} *****")
-                    extra_args = {}
-                    self.pipeline = get_lcm_model_pipeline(
-                        model_id,
-                        use_local_model,
-                        extra_args,
-                    )
+            pipeline_key = self._get_pipeline_key(lcm_diffusion_setting)
+            if lcm_diffusion_setting.rebuild_pipeline:
+                self.pipeline_cache.remove(pipeline_key)
+            self._release_pipelines()
 
-                # Prepare alternative generation pipelines using the newly
-                # created pipeline from which all extra pipelines are derived
-                self.txt2img_pipeline = self.pipeline
-                self.img2img_pipeline = get_image_to_image_pipeline(self.pipeline)
-                self.controlnet_pipeline = get_controlnet_pipeline(
-                    self.pipeline,
+            cached_pipelines = self.pipeline_cache.get(pipeline_key)
+            if cached_pipelines:
+                self._restore_pipelines(
+                    cached_pipelines,
                     lcm_diffusion_setting,
-                    DiffusionTask.text_to_image,
                 )
-                self.controlnet_img2img_pipeline = get_controlnet_pipeline(
-                    self.pipeline,
-                    lcm_diffusion_setting,
-                    DiffusionTask.image_to_image,
+            else:
+                self.pipeline_cache.reserve()
+                tick = perf_counter()
+                memory_before = get_resident_memory()
+                self._build_pipelines(lcm_diffusion_setting)
+                load_time = perf_counter() - tick
+                memory_size = get_pipeline_memory_size(self.pipeline)
+                if not memory_size:
+                    memory_size = max(get_resident_memory() - memory_before, 0)
+                self.pipeline_cache.put(
+                    pipeline_key,
+                    self._get_pipelines(),
+                    memory_size,
+                    load_time,
                 )
-                self.img_to_img_pipeline = self.img2img_pipeline
-
-                if tomesd and token_merging > 0.001:
-                    print(f"***** Token Merging: {token_merging} *****")
-                    tomesd.apply_patch(self.pipeline, ratio=token_merging)
-                    tomesd.apply_patch(self.img_to_img_pipeline, ratio=token_merging)
-
-            if use_tiny_auto_encoder:
-                if self.use_openvino and is_openvino_device():
-                    if not self._is_sana_model():
-                        print("Using Tiny AutoEncoder (OpenVINO)")
-                        ov_load_tiny_autoencoder(
-                            self.pipeline,
-                            use_local_model,
-                        )
-                else:
-                    print("Using Tiny Auto Encoder")
-                    load_taesd(
-                        self.pipeline,
-                        use_local_model,
-                        self.torch_data_type,
-                    )
-                    load_taesd(
-                        self.img_to_img_pipeline,
-                        use_local_model,
-                        self.torch_data_type,
-                    )
-
-            if not self.use_openvino and not is_openvino_device():
-                self._pipeline_to_device()
-
-            if not self._is_hetero_pipeline():
-                if (
-                    lcm_diffusion_setting.diffusion_task
-                    == DiffusionTask.image_to_image.value
-                    and lcm_diffusion_setting.use_openvino
-                ):
-                    self.pipeline.scheduler = LCMScheduler.from_config(
-                        self.pipeline.scheduler.config,
-                    )
-                else:
-                    if (
-                        not lcm_diffusion_setting.use_gguf_model
-                        and lcm_diffusion_setting.diffusion_task
-                        != DiffusionTask.edit_image.value
-                    ):
-                        self._update_lcm_scheduler_params()
-
-            if use_lora:
-                self._add_freeu()
+            self._pipeline_key = pipeline_key
+            print(f"Pipeline cache : {self.pipeline_cache.get_stats()}")
 
             self.previous_model_id = model_id
             self.previous_ov_model_id = self.ov_model_id
-            self.previous_use_tae_sd = use_tiny_auto_encoder
             self.previous_lcm_lora_base_id = lcm_lora.base_model_id
             self.previous_lcm_lora_id = lcm_lora.lcm_lora_id
             self.previous_use_lcm_lora = use_lora
-            self.previous_token_merging = lcm_diffusion_setting.token_merging
-            self.previous_safety_checker = lcm_diffusion_setting.use_safety_checker
             self.previous_use_openvino = lcm_diffusion_setting.use_openvino
             self.previous_task_type = lcm_diffusion_setting.diffusion_task
             self.previous_lora = lcm_diffusion_setting.lora.model_copy(deep=True)
@@ -508,6 +395,393 @@ class LCMTextToImage:
                 adapters = self.pipeline.get_active_adapters()
                 print(f"Active adapters : {adapters}")
 
+        # OpenVINO text to image and image to image pipelines share their
+        # models, switching task doesn't require a pipeline rebuild
+        self._select_ov_pipeline(lcm_diffusion_setting.diffusion_task)
+        # The tiny autoencoder and token merging don't require a pipeline
+        # rebuild, the safety checker is applied outside the pipeline
+        self._reconfigure_pipelines(lcm_diffusion_setting)
+        # LoRAs are switched on the loaded pipeline, no rebuild needed
+        if self.txt2img_pipeline and not self.use_openvino:
+            lora_manager.apply(self.txt2img_pipeline, lcm_diffusion_setting)
+            self._update_text_encoders()
+
+    def _update_text_encoders(self) -> None:
+        """
+        Gives the derived pipelines the text encoders of the text to image
+        pipeline, which are replaced by a private copy when LoRA weights are
+        loaded into text encoders shared with other pipelines.
+        """
+        for name in LORA_COMPONENTS:
+            text_encoder = getattr(self.txt2img_pipeline, name, None)
+            if text_encoder is None:
+                continue
+            for pipeline in [
+                self.img2img_pipeline,
+                self.controlnet_pipeline,
+                self.controlnet_img2img_pipeline,
+            ]:
+                if pipeline and getattr(pipeline, name, None) is not text_encoder:
+                    setattr(pipeline, name, text_encoder)
+
+    def _reconfigure_pipelines(
+        self,
+        lcm_diffusion_setting: LCMDiffusionSetting,
+    ) -> None:
+        """Applies the settings that changed by patching the current pipelines."""
+        reconfigured = False
+        if self.use_tiny_auto_encoder != lcm_diffusion_setting.use_tiny_auto_encoder:
+            self._update_autoencoder(lcm_diffusion_setting)
+            reconfigured = True
+        if self.token_merging != lcm_diffusion_setting.token_merging:
+            self._update_token_merging(lcm_diffusion_setting.token_merging)
+            reconfigured = True
+        if reconfigured and self._pipeline_key:
+            self.pipeline_cache.update(self._pipeline_key, self._get_pipelines())
+
+    def _update_autoencoder(
+        self,
+        lcm_diffusion_setting: LCMDiffusionSetting,
+    ) -> None:
+        use_tiny_auto_encoder = lcm_diffusion_setting.use_tiny_auto_encoder
+        use_local_model = lcm_diffusion_setting.use_offline_model
+        self.use_tiny_auto_encoder = use_tiny_auto_encoder
+        if self.use_openvino and is_openvino_device():
+            if self._is_sana_model() or self._is_hetero_pipeline():
+                return
+            if use_tiny_auto_encoder:
+                print("Using Tiny AutoEncoder (OpenVINO)")
+                self.default_vae = self.pipeline.vae
+                ov_load_tiny_autoencoder(
+                    self.pipeline,
+                    use_local_model,
+                )
+            else:
+                print("Using default AutoEncoder (OpenVINO)")
+                self.pipeline.vae = self.default_vae
+            for pipeline in self.ov_pipelines.values():
+                pipeline.vae = self.pipeline.vae
+        elif not lcm_diffusion_setting.use_gguf_model:
+            if use_tiny_auto_encoder:
+                print("Using Tiny Auto Encoder")
+                self.default_vae = self.pipeline.vae
+                load_taesd(
+                    self.pipeline,
+                    use_local_model,
+                    self.torch_data_type,
+                )
+                vae = self.pipeline.vae
+            else:
+                print("Using default AutoEncoder")
+                vae = self.default_vae
+            for pipeline in [
+                self.pipeline,
+                self.img_to_img_pipeline,
+                self.controlnet_pipeline,
+                self.controlnet_img2img_pipeline,
+            ]:
+                if pipeline:
+                    pipeline.vae = vae
+            if not self.use_openvino and not is_openvino_device():
+                self._pipeline_to_device()
+
+    def _update_token_merging(self, token_merging: float) -> None:
+        self.token_merging = token_merging
+        # Token merging is only supported in LCM and LCM-LoRA modes
+        if not tomesd or not self.txt2img_pipeline:
+            return
+        if token_merging > 0.001:
+            print(f"***** Token Merging: {token_merging} *****")
+            tomesd.apply_patch(self.pipeline, ratio=token_merging)
+            tomesd.apply_patch(self.img_to_img_pipeline, ratio=token_merging)
+        else:
+            print("***** Token Merging disabled *****")
+            tomesd.remove_patch(self.pipeline)
+            tomesd.remove_patch(self.img_to_img_pipeline)
+
+    def _get_pipeline_key(
+        self,
+        lcm_diffusion_setting: LCMDiffusionSetting,
+    ) -> tuple:
+        """Returns the pipeline cache key for the effective build configuration."""
+        if lcm_diffusion_setting.use_openvino and is_openvino_device():
+            task = lcm_diffusion_setting.diffusion_task
+            if self._is_ov_shared_task_model():
+                return (
+                    "openvino",
+                    self.ov_model_id,
+                )
+            if task == DiffusionTask.edit_image.value:
+                # Image editing uses the text to image pipeline
+                task = DiffusionTask.text_to_image.value
+            return (
+                "openvino",
+                self.ov_model_id,
+                task,
+            )
+        elif lcm_diffusion_setting.use_gguf_model:
+            return (
+                "gguf",
+                tuple(lcm_diffusion_setting.gguf_model.model_dump().items()),
+            )
+        elif lcm_diffusion_setting.use_lcm_lora:
+            return (
+                "lcm_lora",
+                lcm_diffusion_setting.lcm_lora.base_model_id,
+                lcm_diffusion_setting.lcm_lora.lcm_lora_id,
+            )
+        return (
+            "lcm",
+            lcm_diffusion_setting.lcm_model_id,
+        )
+
+    def _get_pipelines(self) -> dict:
+        return {
+            "pipeline": self.pipeline,
+            "txt2img_pipeline": self.txt2img_pipeline,
+            "img2img_pipeline": self.img2img_pipeline,
+            "img_to_img_pipeline": self.img_to_img_pipeline,
+            "controlnet_pipeline": self.controlnet_pipeline,
+            "controlnet_img2img_pipeline": self.controlnet_img2img_pipeline,
+            "controlnet_adapter_paths": self.controlnet_adapter_paths,
+            "use_tiny_auto_encoder": self.use_tiny_auto_encoder,
+            "token_merging": self.token_merging,
+            "default_vae": self.default_vae,
+            "shape_pool": self.shape_pool,
+            "ov_pipelines": self.ov_pipelines,
+        }
+
+    def _release_pipelines(self) -> None:
+        """
+        Drops the references to the current pipelines, these are still kept
+        alive by the pipeline cache unless they have been evicted; the LoRA
+        weights are unloaded first, so a cached pipeline is always restored
+        without LoRAs and gets those of its next generation settings.
+        """
+        # Text encoders can be shared with other pipelines, so they
+        # must not keep the LoRA weights
+        lora_manager.unload(self.txt2img_pipeline)
+        for name in self._get_pipelines():
+            setattr(self, name, None)
+        self.ov_pipelines = {}
+        self.use_tiny_auto_encoder = False
+        self.token_merging = 0.0
+
+    def _restore_pipelines(
+        self,
+        pipelines: dict,
+        lcm_diffusion_setting: LCMDiffusionSetting,
+    ) -> None:
+        for name, pipeline in pipelines.items():
+            setattr(self, name, pipeline)
+        self.is_openvino_init = False
+        if self.txt2img_pipeline and self.controlnet_adapter_paths != (
+            get_controlnet_adapter_paths(lcm_diffusion_setting)
+        ):
+            self._rebuild_controlnet_pipelines(lcm_diffusion_setting)
+
+    def _build_controlnet_pipelines(
+        self,
+        lcm_diffusion_setting: LCMDiffusionSetting,
+    ) -> None:
+        # The image to image ControlNet pipeline is built on first use
+        self.controlnet_pipeline = get_controlnet_pipeline(
+            self.txt2img_pipeline,
+            lcm_diffusion_setting,
+            DiffusionTask.text_to_image,
+        )
+        self.controlnet_img2img_pipeline = None
+        self.controlnet_adapter_paths = get_controlnet_adapter_paths(
+            lcm_diffusion_setting
+        )
+
+    def _build_controlnet_img2img_pipeline(
+        self,
+        lcm_diffusion_setting: LCMDiffusionSetting,
+    ) -> None:
+        # Uses the adapters already loaded for the text to image pipeline
+        self.controlnet_img2img_pipeline = get_controlnet_pipeline(
+            self.txt2img_pipeline,
+            lcm_diffusion_setting,
+            DiffusionTask.image_to_image,
+        )
+        if self._pipeline_key:
+            self.pipeline_cache.update(self._pipeline_key, self._get_pipelines())
+
+    def _rebuild_controlnet_pipelines(
+        self,
+        lcm_diffusion_setting: LCMDiffusionSetting,
+    ) -> None:
+        if self.controlnet_pipeline:
+            del self.controlnet_pipeline
+            self.controlnet_pipeline = None
+        if self.controlnet_img2img_pipeline:
+            del self.controlnet_img2img_pipeline
+            self.controlnet_img2img_pipeline = None
+        gc.collect()
+        self._build_controlnet_pipelines(lcm_diffusion_setting)
+        if self._pipeline_key:
+            self.pipeline_cache.update(self._pipeline_key, self._get_pipelines())
+
+    def _build_pipelines(
+        self,
+        lcm_diffusion_setting: LCMDiffusionSetting,
+    ) -> None:
+        model_id = lcm_diffusion_setting.lcm_model_id
+        use_local_model = lcm_diffusion_setting.use_offline_model
+        use_lora = lcm_diffusion_setting.use_lcm_lora
+        lcm_lora: LCMLora = lcm_diffusion_setting.lcm_lora
+
+        if self.use_openvino and is_openvino_device():
+            self.is_openvino_init = True
+            self.shape_pool = CompiledShapePool()
+            if self._is_ov_shared_task_model():
+                print(
+                    f"***** Init Text to image and Image to image (OpenVINO)"
+                    f" - {self.ov_model_id} *****"
+                )
+                txt2img_pipeline = get_ov_text_to_image_pipeline(
+                    self.ov_model_id,
+                    use_local_model,
+                )
+                self.ov_pipelines = {
+                    DiffusionTask.text_to_image.value: txt2img_pipeline,
+                    DiffusionTask.image_to_image.value: get_ov_image_to_image_pipeline_from_pipe(
+                        txt2img_pipeline,
+                        self.ov_model_id,
+                        use_local_model,
+                    ),
+                }
+            elif (
+                lcm_diffusion_setting.diffusion_task
+                == DiffusionTask.text_to_image.value
+                or lcm_diffusion_setting.diffusion_task
+                == DiffusionTask.edit_image.value
+            ):
+                print(f"***** Init Text to image (OpenVINO) - {self.ov_model_id} *****")
+                if "flux" in self.ov_model_id.lower() or self._is_sana_model():
+                    if self._is_flux_klein_model():
+                        print("Loading OpenVINO Flux Klein pipeline")
+                        self.pipeline = get_flux_klein_pipeline(
+                            self.ov_model_id,
+                            use_local_model,
+                        )
+                    else:
+                        if self._is_sana_model():
+                            print("Loading OpenVINO SANA Sprint pipeline")
+                        else:
+                            print("Loading OpenVINO Flux pipeline")
+                        self.pipeline = get_ov_diffusion_pipeline(self.ov_model_id)
+                elif self._is_hetero_pipeline():
+                    self._load_ov_hetero_pipeline()
+            elif (
+                lcm_diffusion_setting.diffusion_task
+                == DiffusionTask.image_to_image.value
+            ):
+                if not self.pipeline and self._is_hetero_pipeline():
+                    self._load_ov_hetero_pipeline()
+                else:
+                    print(f"***** Image to image (OpenVINO) - {self.ov_model_id} *****")
+                    self.pipeline = get_ov_image_to_image_pipeline(
+                        self.ov_model_id,
+                        use_local_model,
+                    )
+        elif lcm_diffusion_setting.use_gguf_model:
+            model = lcm_diffusion_setting.gguf_model.diffusion_path
+            print(f"***** Init Text to image (GGUF) - {model} *****")
+            # if self.pipeline:
+            #     self.pipeline.terminate()
+            #     del self.pipeline
+            #     self.pipeline = None
+            self._init_gguf_diffusion(lcm_diffusion_setting)
+        else:
+            # Code for pipeline rebuild in LCM or LCM-LoRA modes
+            if use_lora:
+                print(f"***** Init LCM-LoRA pipeline - {lcm_lora.base_model_id} *****")
+                self.pipeline = get_lcm_lora_pipeline(
+                    lcm_lora.base_model_id,
+                    lcm_lora.lcm_lora_id,
+                    use_local_model,
+                    torch_data_type=self.torch_data_type,
+                )
+
+            else:
+                print(f"***** Init LCM Model pipeline - {model_id} *****")
+                extra_args = {}
+                self.pipeline = get_lcm_model_pipeline(
+                    model_id,
+                    use_local_model,
+                    extra_args,
+                )
+
+            # Prepare alternative generation pipelines using the newly
+            # created pipeline from which all extra pipelines are derived
+            self.txt2img_pipeline = self.pipeline
+            self.img2img_pipeline = get_image_to_image_pipeline(self.pipeline)
+            self._build_controlnet_pipelines(lcm_diffusion_setting)
+            self.img_to_img_pipeline = self.img2img_pipeline
+
+        if not self.use_openvino and not is_openvino_device():
+            self._pipeline_to_device()
+
+        if self.ov_pipelines:
+            img2img_pipeline = self.ov_pipelines[DiffusionTask.image_to_image.value]
+            img2img_pipeline.scheduler = LCMScheduler.from_config(
+                img2img_pipeline.scheduler.config,
+            )
+            self.pipeline = self.ov_pipelines[DiffusionTask.text_to_image.value]
+            self._update_lcm_scheduler_params()
+            self._select_ov_pipeline(lcm_diffusion_setting.diffusion_task)
+        elif not self._is_hetero_pipeline():
+            if (
+                lcm_diffusion_setting.diffusion_task
+                == DiffusionTask.image_to_image.value
+                and lcm_diffusion_setting.use_openvino
+            ):
+                self.pipeline.scheduler = LCMScheduler.from_config(
+                    self.pipeline.scheduler.config,
+                )
+            else:
+                if (
+                    not lcm_diffusion_setting.use_gguf_model
+                    and lcm_diffusion_setting.diffusion_task
+                    != DiffusionTask.edit_image.value
+                ):
+                    self._update_lcm_scheduler_params()
+
+        if use_lora:
+            self._add_freeu()
+
+        if self.shape_pool and self.shape_pool.is_enabled:
+            if not self._is_hetero_pipeline():
+                self.shape_pool.warm_up(self.pipeline)
+                self.is_openvino_init = False
+
+    def _select_ov_pipeline(self, diffusion_task: str) -> None:
+        """Switches to the OpenVINO pipeline of _diffusion_task_, no reload needed."""
+        if diffusion_task == DiffusionTask.edit_image.value:
+            diffusion_task = DiffusionTask.text_to_image.value
+        if diffusion_task in self.ov_pipelines:
+            self.pipeline = self.ov_pipelines[diffusion_task]
+
+    def _get_prompt_args(
+        self,
+        pipeline: Any,
+        lcm_diffusion_setting: LCMDiffusionSetting,
+        guidance_scale: float,
+    ) -> dict:
+        clip_skip = None
+        if lcm_diffusion_setting.clip_skip > 1 and not self.use_openvino:
+            clip_skip = lcm_diffusion_setting.clip_skip - 1
+        return get_prompt_embeds_args(
+            pipeline,
+            lcm_diffusion_setting.prompt,
+            lcm_diffusion_setting.negative_prompt,
+            guidance_scale,
+            clip_skip,
+            tuple(get_active_lora_weights()),
+        )
+
     def _get_timesteps(self):
         time_steps = self.pipeline.scheduler.config.get("timesteps")
         time_steps_value = [int(time_steps)] if time_steps else None
@@ -516,20 +790,174 @@ class LCMTextToImage:
     def _compile_ov_pipeline(
         self,
         lcm_diffusion_setting,
+        number_of_images: Optional[int] = None,
     ):
-        self.pipeline.reshape(
-            batch_size=-1,
-            height=lcm_diffusion_setting.image_height,
+        self.shape_pool.activate(
+            self.pipeline,
             width=lcm_diffusion_setting.image_width,
-            num_images_per_prompt=lcm_diffusion_setting.number_of_images,
+            height=lcm_diffusion_setting.image_height,
+            number_of_images=number_of_images or lcm_diffusion_setting.number_of_images,
         )
-        self.pipeline.compile()
+
+    def _get_seeds(
+        self,
+        lcm_diffusion_setting: LCMDiffusionSetting,
+    ) -> List[int]:
+        if lcm_diffusion_setting.use_seed:
+            cur_seed = lcm_diffusion_setting.seed
+            # for multiple images with a fixed seed, use sequential seeds
+            seeds = [
+                (cur_seed + i) for i in range(lcm_diffusion_setting.number_of_images)
+            ]
+        else:
+            seeds = [
+                random.randint(0, 999999999)
+                for i in range(lcm_diffusion_setting.number_of_images)
+            ]
+        return seeds
+
+    def _can_generate_batch(
+        self,
+        lcm_diffusion_setting: LCMDiffusionSetting,
+    ) -> bool:
+        if (
+            lcm_diffusion_setting.diffusion_task != DiffusionTask.text_to_image.value
+            or lcm_diffusion_setting.use_gguf_model
+            or update_controlnet_arguments(lcm_diffusion_setting)
+        ):
+            return False
+        if self.use_openvino:
+            return is_openvino_device() and self._is_ov_shared_task_model()
+        return True
+
+    def _get_batch_prompt_args(
+        self,
+        lcm_diffusion_settings: List[LCMDiffusionSetting],
+        guidance_scale: float,
+    ) -> dict:
+        # Embeddings of each prompt come from the prompt embedding cache,
+        # repeated for each image of the request
+        items_prompt_args = [
+            self._get_prompt_args(self.pipeline, setting, guidance_scale)
+            for setting in lcm_diffusion_settings
+        ]
+        if all("prompt_embeds" in args for args in items_prompt_args):
+            prompt_args = {}
+            for name in items_prompt_args[0]:
+                prompt_args[name] = torch.cat(
+                    [
+                        args[name]
+                        for args, setting in zip(
+                            items_prompt_args,
+                            lcm_diffusion_settings,
+                        )
+                        for _ in range(setting.number_of_images)
+                    ]
+                )
+            return prompt_args
+
+        prompts = []
+        negative_prompts = []
+        for setting in lcm_diffusion_settings:
+            prompts += [setting.prompt] * setting.number_of_images
+            negative_prompts += [setting.negative_prompt] * setting.number_of_images
+        return {
+            "prompt": prompts,
+            "negative_prompt": negative_prompts,
+        }
+
+    def generate_batch(
+        self,
+        lcm_diffusion_settings: List[LCMDiffusionSetting],
+        progress: Optional[GenerationProgress] = None,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> List[Any]:
+        """
+        Generates the images of text to image settings that only differ by
+        their prompts, seeds and number of images in a single pipeline call,
+        returns the images of each setting. Settings that can't be batched
+        are generated one after another.
+        """
+        lcm_diffusion_setting = lcm_diffusion_settings[0]
+        if len(lcm_diffusion_settings) == 1 or not self._can_generate_batch(
+            lcm_diffusion_setting
+        ):
+            return [
+                self.generate(
+                    setting,
+                    progress=progress,
+                    cancel_token=cancel_token,
+                )
+                for setting in lcm_diffusion_settings
+            ]
+
+        if cancel_token:
+            cancel_token.raise_if_cancelled()
+        items_seeds = [
+            self._get_seeds(setting) for setting in lcm_diffusion_settings
+        ]
+        seeds = [seed for item_seeds in items_seeds for seed in item_seeds]
+        print(f"Generating a batch of {len(seeds)} images")
+
+        guidance_scale = lcm_diffusion_setting.guidance_scale
+        pipeline_extra_args = {}
+        if self.use_openvino:
+            torch.manual_seed(seeds[0])
+            if self.shape_pool.is_enabled:
+                # The batch dimension covers the images of all the requests
+                self._compile_ov_pipeline(lcm_diffusion_setting, len(seeds))
+            self.is_openvino_init = False
+        else:
+            pipeline_extra_args["generator"] = [
+                torch.Generator(device=self.device).manual_seed(s) for s in seeds
+            ]
+            pipeline_extra_args["timesteps"] = self._get_timesteps()
+            if lcm_diffusion_setting.clip_skip > 1:
+                pipeline_extra_args["clip_skip"] = (
+                    lcm_diffusion_setting.clip_skip - 1
+                )
+            if not lcm_diffusion_setting.use_lcm_lora and guidance_scale != 1.0:
+                print("Not using LCM-LoRA so setting guidance_scale 1.0")
+                guidance_scale = 1.0
+        self.pipeline.safety_checker = None
+
+        result_images = self.pipeline(
+            **self._get_batch_prompt_args(
+                lcm_diffusion_settings,
+                guidance_scale,
+            ),
+            num_inference_steps=lcm_diffusion_setting.inference_steps,
+            guidance_scale=guidance_scale,
+            width=lcm_diffusion_setting.image_width,
+            height=lcm_diffusion_setting.image_height,
+            num_images_per_prompt=1,
+            **pipeline_extra_args,
+            **get_step_callback_args(
+                self.pipeline,
+                lcm_diffusion_setting.inference_steps,
+                progress,
+                cancel_token,
+            ),
+        ).images
+
+        batch_images = []
+        for item_seeds in items_seeds:
+            images = result_images[: len(item_seeds)]
+            result_images = result_images[len(item_seeds) :]
+            for image, seed in zip(images, item_seeds):
+                image.info["image_seed"] = seed
+            batch_images.append(images)
+        return batch_images
 
     def generate(
         self,
         lcm_diffusion_setting: LCMDiffusionSetting,
         reshape: bool = False,
+        progress: Optional[GenerationProgress] = None,
+        cancel_token: Optional[CancellationToken] = None,
     ) -> Any:
+        if cancel_token:
+            cancel_token.raise_if_cancelled()
         guidance_scale = lcm_diffusion_setting.guidance_scale
         img_to_img_inference_steps = lcm_diffusion_setting.inference_steps
         check_step_value = int(
@@ -553,27 +981,20 @@ class LCMTextToImage:
         if self.txt2img_pipeline:  # In LCM or LCM-LoRA modes
             self.pipeline = self.txt2img_pipeline
             self.img_to_img_pipeline = self.img2img_pipeline
-            if (
-                lcm_diffusion_setting.controlnet
-                and lcm_diffusion_setting.controlnet.enabled
-            ):
+            if lcm_diffusion_setting.get_enabled_controlnets():
                 if self.controlnet_pipeline != None:
                     self.pipeline = self.controlnet_pipeline
+                if (
+                    self.controlnet_pipeline != None
+                    and self.controlnet_img2img_pipeline is None
+                    and lcm_diffusion_setting.diffusion_task
+                    == DiffusionTask.image_to_image.value
+                ):
+                    self._build_controlnet_img2img_pipeline(lcm_diffusion_setting)
                 if self.controlnet_img2img_pipeline != None:
                     self.img_to_img_pipeline = self.controlnet_img2img_pipeline
         pipeline_extra_args = {}
-
-        if lcm_diffusion_setting.use_seed:
-            cur_seed = lcm_diffusion_setting.seed
-            # for multiple images with a fixed seed, use sequential seeds
-            seeds = [
-                (cur_seed + i) for i in range(lcm_diffusion_setting.number_of_images)
-            ]
-        else:
-            seeds = [
-                random.randint(0, 999999999)
-                for i in range(lcm_diffusion_setting.number_of_images)
-            ]
+        seeds = self._get_seeds(lcm_diffusion_setting)
 
         if self.use_openvino:
             # no support for generators; try at least to ensure reproducible results for single images
@@ -589,20 +1010,30 @@ class LCMTextToImage:
         is_openvino_pipe = lcm_diffusion_setting.use_openvino and is_openvino_device()
         if is_openvino_pipe and not self._is_hetero_pipeline():
             print("Using OpenVINO")
-            if self.is_openvino_init and self._is_sana_model():
+            if self.shape_pool.is_enabled:
+                # Static shape buckets, each request uses the compiled models
+                # matching its shape
                 self._compile_ov_pipeline(lcm_diffusion_setting)
-
-            if reshape and not self.is_openvino_init:
-                print("Reshape and compile")
+            elif self.is_openvino_init and self._is_sana_model():
+                self._compile_ov_pipeline(lcm_diffusion_setting)
+            elif reshape and not self.is_openvino_init:
                 self._compile_ov_pipeline(lcm_diffusion_setting)
 
             if self.is_openvino_init:
                 self.is_openvino_init = False
 
         if is_openvino_pipe and self._is_hetero_pipeline():
-            return self._generate_images_hetero_compute(lcm_diffusion_setting)
+            return self._generate_images_hetero_compute(
+                lcm_diffusion_setting,
+                progress,
+                cancel_token,
+            )
         elif lcm_diffusion_setting.use_gguf_model:
-            return self._generate_images_gguf(lcm_diffusion_setting)
+            return self._generate_images_gguf(
+                lcm_diffusion_setting,
+                progress,
+                cancel_token,
+            )
 
         if lcm_diffusion_setting.clip_skip > 1:
             # We follow the convention that "CLIP Skip == 2" means "skip
@@ -639,6 +1070,12 @@ class LCMTextToImage:
                         width=lcm_diffusion_setting.image_width,
                         height=lcm_diffusion_setting.image_height,
                         num_images_per_prompt=lcm_diffusion_setting.number_of_images,
+                        **get_step_callback_args(
+                            self.pipeline,
+                            lcm_diffusion_setting.inference_steps,
+                            progress,
+                            cancel_token,
+                        ),
                     ).images
                 elif self._is_flux_klein_model():
                     result_images = self.pipeline(
@@ -647,16 +1084,31 @@ class LCMTextToImage:
                         guidance_scale=guidance_scale,
                         width=lcm_diffusion_setting.image_width,
                         height=lcm_diffusion_setting.image_height,
+                        **get_step_callback_args(
+                            self.pipeline,
+                            lcm_diffusion_setting.inference_steps,
+                            progress,
+                            cancel_token,
+                        ),
                     ).images
                 else:
                     result_images = self.pipeline(
-                        prompt=lcm_diffusion_setting.prompt,
-                        negative_prompt=lcm_diffusion_setting.negative_prompt,
+                        **self._get_prompt_args(
+                            self.pipeline,
+                            lcm_diffusion_setting,
+                            guidance_scale,
+                        ),
                         num_inference_steps=lcm_diffusion_setting.inference_steps,
                         guidance_scale=guidance_scale,
                         width=lcm_diffusion_setting.image_width,
                         height=lcm_diffusion_setting.image_height,
                         num_images_per_prompt=lcm_diffusion_setting.number_of_images,
+                        **get_step_callback_args(
+                            self.pipeline,
+                            lcm_diffusion_setting.inference_steps,
+                            progress,
+                            cancel_token,
+                        ),
                     ).images
             elif (
                 lcm_diffusion_setting.diffusion_task
@@ -665,11 +1117,20 @@ class LCMTextToImage:
                 result_images = self.pipeline(
                     image=lcm_diffusion_setting.init_image,
                     strength=lcm_diffusion_setting.strength,
-                    prompt=lcm_diffusion_setting.prompt,
-                    negative_prompt=lcm_diffusion_setting.negative_prompt,
+                    **self._get_prompt_args(
+                        self.pipeline,
+                        lcm_diffusion_setting,
+                        guidance_scale,
+                    ),
                     num_inference_steps=img_to_img_inference_steps * 3,
                     guidance_scale=guidance_scale,
                     num_images_per_prompt=lcm_diffusion_setting.number_of_images,
+                    **get_step_callback_args(
+                        self.pipeline,
+                        img_to_img_inference_steps * 3,
+                        progress,
+                        cancel_token,
+                    ),
                 ).images
             if lcm_diffusion_setting.diffusion_task == DiffusionTask.edit_image.value:
                 result_images = self.pipeline(
@@ -678,6 +1139,12 @@ class LCMTextToImage:
                     num_inference_steps=lcm_diffusion_setting.inference_steps,
                     guidance_scale=guidance_scale,
                     num_images_per_prompt=lcm_diffusion_setting.number_of_images,
+                    **get_step_callback_args(
+                        self.pipeline,
+                        lcm_diffusion_setting.inference_steps,
+                        progress,
+                        cancel_token,
+                    ),
                 ).images
 
         else:
@@ -687,8 +1154,11 @@ class LCMTextToImage:
             ):
                 print(f"Using {self.pipeline.__class__.__name__}")
                 result_images = self.pipeline(
-                    prompt=lcm_diffusion_setting.prompt,
-                    negative_prompt=lcm_diffusion_setting.negative_prompt,
+                    **self._get_prompt_args(
+                        self.pipeline,
+                        lcm_diffusion_setting,
+                        guidance_scale,
+                    ),
                     num_inference_steps=lcm_diffusion_setting.inference_steps,
                     guidance_scale=guidance_scale,
                     width=lcm_diffusion_setting.image_width,
@@ -697,6 +1167,12 @@ class LCMTextToImage:
                     timesteps=self._get_timesteps(),
                     **pipeline_extra_args,
                     **controlnet_args,
+                    **get_step_callback_args(
+                        self.pipeline,
+                        lcm_diffusion_setting.inference_steps,
+                        progress,
+                        cancel_token,
+                    ),
                 ).images
 
             elif (
@@ -707,8 +1183,11 @@ class LCMTextToImage:
                 result_images = self.img_to_img_pipeline(
                     image=lcm_diffusion_setting.init_image,
                     strength=lcm_diffusion_setting.strength,
-                    prompt=lcm_diffusion_setting.prompt,
-                    negative_prompt=lcm_diffusion_setting.negative_prompt,
+                    **self._get_prompt_args(
+                        self.img_to_img_pipeline,
+                        lcm_diffusion_setting,
+                        guidance_scale,
+                    ),
                     num_inference_steps=img_to_img_inference_steps,
                     guidance_scale=guidance_scale,
                     width=lcm_diffusion_setting.image_width,
@@ -716,6 +1195,12 @@ class LCMTextToImage:
                     num_images_per_prompt=lcm_diffusion_setting.number_of_images,
                     **pipeline_extra_args,
                     **controlnet_args,
+                    **get_step_callback_args(
+                        self.img_to_img_pipeline,
+                        img_to_img_inference_steps,
+                        progress,
+                        cancel_token,
+                    ),
                 ).images
 
         if self.txt2img_pipeline:  # In LCM or LCM-LoRA modes
@@ -742,7 +1227,8 @@ class LCMTextToImage:
         print(f"GGUF Threads : {GGUF_THREADS} ")
         print("GGUF - Model config")
         pprint(lcm_diffusion_setting.gguf_model.model_dump())
-        self.pipeline = GGUFDiffusion(
+        # sd.cpp runs in a worker process that can be killed on cancellation
+        self.pipeline = GGUFWorker(
             get_app_path(),  # Place DLL in fastsdcpu folder
             config,
             True,
@@ -751,6 +1237,8 @@ class LCMTextToImage:
     def _generate_images_gguf(
         self,
         lcm_diffusion_setting: LCMDiffusionSetting,
+        progress: Optional[GenerationProgress] = None,
+        cancel_token: Optional[CancellationToken] = None,
     ):
         if lcm_diffusion_setting.diffusion_task == DiffusionTask.text_to_image.value:
             t2iconfig = Txt2ImgConfig()
@@ -766,4 +1254,15 @@ class LCMTextToImage:
             else:
                 t2iconfig.seed = -1
 
-            return self.pipeline.generate_text2mg(t2iconfig)
+            progress_callback = None
+            if progress:
+                progress.start(t2iconfig.sample_steps * t2iconfig.batch_count)
+
+                def progress_callback(step, steps):
+                    progress.update(step, steps)
+
+            return self.pipeline.generate_text2mg(
+                t2iconfig,
+                progress_callback,
+                cancel_token,
+            )
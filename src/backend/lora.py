@@ -1,7 +1,15 @@
 import glob
+from collections import OrderedDict
 from os import path
-from paths import get_file_name, FastStableDiffusionPaths
-from pathlib import Path
+from threading import Lock, RLock
+from typing import Any, List, Optional
+
+from safetensors.torch import load_file
+
+from backend.pipelines.component_store import unshare_pipeline_components
+
+from constants import LORA_CACHE_SIZE_MB, LORA_FUSE_AFTER, LORA_MAX_ADAPTERS
+from paths import get_file_name
 
 
 class _lora_info:
@@ -27,8 +35,314 @@ class _lora_info:
         self.adapter_name = None
 
 
-_loaded_loras = []
-_current_pipeline = None
+def _get_denoising_model(pipeline: Any) -> Any:
+    model = getattr(pipeline, "unet", None)
+    if model is None:
+        model = getattr(pipeline, "transformer", pipeline)
+    return model
+
+
+class LoraStateDictCache:
+    """
+    LRU cache of the LoRA files parsed in memory, limited to _max_size_mb_
+    (0 disables the cache), so loading a LoRA again doesn't read its file.
+    """
+
+    def __init__(self, max_size_mb: int = LORA_CACHE_SIZE_MB):
+        self.max_size = max(max_size_mb, 0) * 1024 * 1024
+        self._entries: OrderedDict[str, tuple] = OrderedDict()
+        self._size = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, lora_path: str) -> dict:
+        """Returns the state dict of the LoRA file _lora_path_."""
+        # A replaced file is loaded again
+        version = (path.getsize(lora_path), path.getmtime(lora_path))
+        with self._lock:
+            entry = self._entries.get(lora_path)
+            if entry and entry[0] == version:
+                self._entries.move_to_end(lora_path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        state_dict = load_file(lora_path)
+        size = sum(
+            tensor.numel() * tensor.element_size() for tensor in state_dict.values()
+        )
+        with self._lock:
+            entry = self._entries.pop(lora_path, None)
+            if entry:
+                self._size -= entry[2]
+            if size <= self.max_size:
+                self._entries[lora_path] = (version, state_dict, size)
+                self._size += size
+                while self._size > self.max_size:
+                    _, (_, _, old_size) = self._entries.popitem(last=False)
+                    self._size -= old_size
+        return state_dict
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size_mb": round(self._size / (1024 * 1024), 2),
+                "max_size_mb": self.max_size // (1024 * 1024),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+class LoraManager:
+    """
+    Keeps LoRA adapters loaded in the current pipeline and switches between
+    them with _set_adapters()_, so changing the active LoRAs or their weights
+    doesn't rebuild the pipeline nor read the LoRA files again.
+
+    Up to _max_adapters_ inactive adapters stay loaded for later use. The
+    active adapters are fused into the model weights once they have been used
+    unchanged for _fuse_after_ generations (0 never fuses), and unfused
+    before the next change, so frequently changing LoRAs stay cheap to
+    switch while stable ones run at full speed.
+    """
+
+    def __init__(
+        self,
+        state_dict_cache: LoraStateDictCache,
+        max_adapters: int = LORA_MAX_ADAPTERS,
+        fuse_after: int = LORA_FUSE_AFTER,
+    ):
+        self.state_dict_cache = state_dict_cache
+        self.max_adapters = max(max_adapters, 0)
+        self.fuse_after = max(fuse_after, 0)
+        self.pipeline = None
+        self._model = None
+        self.active_loras: List[_lora_info] = []
+        # Adapters loaded in the pipeline, least recently used first
+        self._loaded_adapters: OrderedDict[str, str] = OrderedDict()
+        self._use_lcm_lora = False
+        self._fused = False
+        self._unchanged_generations = 0
+        # LoRA settings applied last, see _apply()_
+        self._settings_key = None
+        self._lock = RLock()
+
+    def _set_pipeline(self, pipeline: Any) -> None:
+        # Adapters are loaded in the pipeline models, which are shared by the
+        # pipelines derived from the same base pipeline (ControlNet, img2img)
+        model = _get_denoising_model(pipeline)
+        if model is not self._model:
+            self.reset()
+            self._model = model
+        self.pipeline = pipeline
+
+    def reset(self) -> None:
+        """Forgets the current pipeline and its adapters, doesn't unload them."""
+        with self._lock:
+            self.pipeline = None
+            self._model = None
+            self.active_loras = []
+            self._loaded_adapters.clear()
+            self._fused = False
+            self._unchanged_generations = 0
+            self._settings_key = None
+
+    def unload(self, pipeline: Any) -> None:
+        """
+        Removes the LoRA weights from _pipeline_, the LCM-LoRA of the
+        pipeline is kept so that the pipeline can be reused.
+        """
+        with self._lock:
+            if self.is_loaded(pipeline):
+                self._unfuse()
+                if self._use_lcm_lora:
+                    pipeline.delete_adapters(list(self._loaded_adapters))
+                    pipeline.set_adapters(["lcm"], adapter_weights=[1.0])
+                else:
+                    pipeline.unload_lora_weights()
+            self.reset()
+
+    def is_loaded(self, pipeline: Any) -> bool:
+        return (
+            pipeline is not None
+            and _get_denoising_model(pipeline) is self._model
+            and len(self._loaded_adapters) > 0
+        )
+
+    def _get_settings_key(self, lcm_diffusion_setting) -> Optional[tuple]:
+        lora = lcm_diffusion_setting.lora
+        if not lora or not lora.enabled or not lora.path:
+            return None
+        return (str(lora.path), lora.weight)
+
+    def load(
+        self,
+        pipeline: Any,
+        lcm_diffusion_setting,
+    ) -> None:
+        """Adds the LoRA of _lcm_diffusion_setting_ to the active LoRAs."""
+        with self._lock:
+            self._set_pipeline(pipeline)
+            lora = lcm_diffusion_setting.lora
+            current_lora = _lora_info(str(lora.path), lora.weight)
+            self.active_loras = [
+                active_lora
+                for active_lora in self.active_loras
+                if active_lora.adapter_name != current_lora.adapter_name
+            ]
+            self.active_loras.append(current_lora)
+            self._settings_key = self._get_settings_key(lcm_diffusion_setting)
+            if lora.enabled:
+                self._load_adapter(current_lora)
+            self._update_adapters(lcm_diffusion_setting.use_lcm_lora)
+
+    def apply(
+        self,
+        pipeline: Any,
+        lcm_diffusion_setting,
+    ) -> None:
+        """
+        Called before each generation; makes the LoRA of the settings the only
+        active LoRA when the LoRA settings have changed since they were last
+        applied, so LoRAs added with _load()_ stay active until then, and
+        fuses the active adapters once they are stable.
+        """
+        with self._lock:
+            self._set_pipeline(pipeline)
+            settings_key = self._get_settings_key(lcm_diffusion_setting)
+            if (
+                settings_key != self._settings_key
+                or self._use_lcm_lora != lcm_diffusion_setting.use_lcm_lora
+            ):
+                self._settings_key = settings_key
+                self.active_loras = []
+                if settings_key:
+                    current_lora = _lora_info(*settings_key)
+                    self._load_adapter(current_lora)
+                    self.active_loras.append(current_lora)
+                self._update_adapters(lcm_diffusion_setting.use_lcm_lora)
+                return
+            self._unchanged_generations += 1
+            if (
+                self.active_loras
+                and not self._fused
+                and self.fuse_after
+                and self._unchanged_generations >= self.fuse_after
+                and lcm_diffusion_setting.lora.fuse
+            ):
+                print("Fusing LoRA weights")
+                self.pipeline.fuse_lora(adapter_names=self._get_adapters()[0])
+                self._fused = True
+
+    def set_weights(
+        self,
+        pipeline: Any,
+        lora_weights: list,
+        use_lcm_lora: bool,
+    ) -> None:
+        """Updates the weights of the active LoRAs, _(adapter_name, weight)_."""
+        with self._lock:
+            if pipeline is None or _get_denoising_model(pipeline) is not self._model:
+                print("Wrong pipeline when trying to update LoRA weights")
+                return
+            self.pipeline = pipeline
+            for idx, lora in enumerate(lora_weights):
+                if self.active_loras[idx].adapter_name != lora[0]:
+                    print("Wrong adapter name in LoRA enumeration!")
+                    continue
+                self.active_loras[idx].weight = lora[1]
+            self._update_adapters(use_lcm_lora)
+
+    def get_active_lora_weights(self) -> list:
+        return [
+            (lora_info.adapter_name, lora_info.weight)
+            for lora_info in self.active_loras
+        ]
+
+    def _load_adapter(self, lora: _lora_info) -> None:
+        if lora.adapter_name in self._loaded_adapters:
+            self._loaded_adapters.move_to_end(lora.adapter_name)
+            return
+        if not path.exists(lora.path):
+            raise Exception("Lora model path is invalid")
+        self._unfuse()
+        # Text encoders can be shared with other pipelines, which must not
+        # get the LoRA weights
+        unshare_pipeline_components(self.pipeline)
+        print(f"LoRA adapter name : {lora.adapter_name}")
+        # diffusers converts the state dict in place, the cached one is kept
+        self.pipeline.load_lora_weights(
+            dict(self.state_dict_cache.get(lora.path)),
+            adapter_name=lora.adapter_name,
+        )
+        self._loaded_adapters[lora.adapter_name] = lora.path
+
+    def _get_adapters(self) -> tuple:
+        adapter_names = []
+        adapter_weights = []
+        if self._use_lcm_lora:
+            adapter_names.append("lcm")
+            adapter_weights.append(1.0)
+        for lora in self.active_loras:
+            if lora.adapter_name in self._loaded_adapters:
+                adapter_names.append(lora.adapter_name)
+                adapter_weights.append(lora.weight)
+        return adapter_names, adapter_weights
+
+    def _update_adapters(self, use_lcm_lora: bool) -> None:
+        self._use_lcm_lora = use_lcm_lora
+        self._unchanged_generations = 0
+        if not self._loaded_adapters:
+            return
+        self._unfuse()
+        self._unload_inactive_adapters()
+        adapter_names, adapter_weights = self._get_adapters()
+        if adapter_names:
+            self.pipeline.enable_lora()
+            self.pipeline.set_adapters(
+                adapter_names,
+                adapter_weights=adapter_weights,
+            )
+        else:
+            self.pipeline.disable_lora()
+        print(f"Adapters: {list(zip(adapter_names, adapter_weights))}")
+
+    def _unload_inactive_adapters(self) -> None:
+        active_names = {lora.adapter_name for lora in self.active_loras}
+        inactive_names = [
+            adapter_name
+            for adapter_name in self._loaded_adapters
+            if adapter_name not in active_names
+        ]
+        # Least recently used first
+        for adapter_name in inactive_names[: -self.max_adapters or None]:
+            self.pipeline.delete_adapters(adapter_name)
+            del self._loaded_adapters[adapter_name]
+
+    def _unfuse(self) -> None:
+        if self._fused:
+            self.pipeline.unfuse_lora()
+            self._fused = False
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "loaded_adapters": list(self._loaded_adapters),
+                "active_loras": self.get_active_lora_weights(),
+                "fused": self._fused,
+                "state_dict_cache": self.state_dict_cache.get_stats(),
+            }
+
+
+lora_manager = LoraManager(LoraStateDictCache())
 
 
 def load_lora_weight(
@@ -40,9 +354,9 @@ def load_lora_weight(
 
     This function loads a LoRA from the LoRA path stored in the settings so
     it's possible to load multiple LoRAs by calling this function more than
-    once with a different LoRA path setting; note that if you plan to load
-    multiple LoRAs and dynamically change their weights, you might want to
-    set the LoRA fuse option to _False_.
+    once with a different LoRA path setting; the LoRA file is parsed once and
+    kept in memory, and the LoRA weights are fused automatically once they
+    stop changing.
     """
     if not lcm_diffusion_setting.lora.path:
         raise Exception("Empty lora model path")
@@ -50,35 +364,7 @@ def load_lora_weight(
     if not path.exists(lcm_diffusion_setting.lora.path):
         raise Exception("Lora model path is invalid")
 
-    # If the pipeline has been rebuilt since the last call, remove all
-    # references to previously loaded LoRAs and store the new pipeline
-    global _loaded_loras
-    global _current_pipeline
-    if pipeline != _current_pipeline:
-        reset_active_lora_weights()
-        _current_pipeline = pipeline
-
-    current_lora = _lora_info(
-        lcm_diffusion_setting.lora.path,
-        lcm_diffusion_setting.lora.weight,
-    )
-    _loaded_loras.append(current_lora)
-
-    if lcm_diffusion_setting.lora.enabled:
-        print(f"LoRA adapter name : {current_lora.adapter_name}")
-        pipeline.load_lora_weights(
-            FastStableDiffusionPaths.get_lora_models_path(),
-            weight_name=Path(lcm_diffusion_setting.lora.path).name,
-            local_files_only=True,
-            adapter_name=current_lora.adapter_name,
-        )
-        update_lora_weights(
-            pipeline,
-            lcm_diffusion_setting,
-        )
-
-        if lcm_diffusion_setting.lora.fuse:
-            pipeline.fuse_lora()
+    lora_manager.load(pipeline, lcm_diffusion_setting)
 
 
 def get_lora_models(root_dir: str):
@@ -95,37 +381,27 @@ def get_active_lora_weights():
     """
     Returns a list of _(adapter_name, weight)_ tuples for the currently loaded LoRAs.
     """
-    active_loras = []
-    for lora_info in _loaded_loras:
-        active_loras.append(
-            (
-                lora_info.adapter_name,
-                lora_info.weight,
-            )
-        )
-    return active_loras
+    return lora_manager.get_active_lora_weights()
+
+
+def is_lora_loaded(pipeline) -> bool:
+    """
+    Returns _True_ if LoRA weights have been loaded into _pipeline_.
+    """
+    return lora_manager.is_loaded(pipeline)
 
 
 def reset_active_lora_weights():
     """
-    Clears the global list of active LoRA weights.
+    Clears the list of active LoRA weights.
 
     This method clears the list of active LoRA weights but it doesn't actually
     remove the active LoRA weights from the current generation pipeline.
     This method is only meant to be called when rebuilding the generation pipeline
-    as it will also clear the _current_pipeline_ variable; setting the
-    _current_pipeline_ variable to _None_ is safe here since the active LoRA weights
-    list is being reset, but it also helps to remove the pipeline reference that
-    might prevent the garbage collector from releasing the current pipeline memory.
+    as it will also drop the reference to the current pipeline, which might
+    otherwise prevent the garbage collector from releasing its memory.
     """
-    global _loaded_loras
-    for lora in _loaded_loras:
-        del lora
-    del _loaded_loras
-    _loaded_loras = []
-
-    global _current_pipeline
-    _current_pipeline = None
+    lora_manager.reset()
 
 
 def update_lora_weights(
@@ -142,29 +418,8 @@ def update_lora_weights(
             pipeline is running in LCM-LoRA mode.
         lora_weights: An optional list of updated _(adapter_name, weight)_ tuples.
     """
-    global _loaded_loras
-    global _current_pipeline
-    if pipeline != _current_pipeline:
-        print("Wrong pipeline when trying to update LoRA weights")
-        return
-    if lora_weights:
-        for idx, lora in enumerate(lora_weights):
-            if _loaded_loras[idx].adapter_name != lora[0]:
-                print("Wrong adapter name in LoRA enumeration!")
-                continue
-            _loaded_loras[idx].weight = lora[1]
-
-    adapter_names = []
-    adapter_weights = []
-    if lcm_diffusion_setting.use_lcm_lora:
-        adapter_names.append("lcm")
-        adapter_weights.append(1.0)
-    for lora in _loaded_loras:
-        adapter_names.append(lora.adapter_name)
-        adapter_weights.append(lora.weight)
-    pipeline.set_adapters(
-        adapter_names,
-        adapter_weights=adapter_weights,
+    lora_manager.set_weights(
+        pipeline,
+        lora_weights or [],
+        lcm_diffusion_setting.use_lcm_lora,
     )
-    adapter_weights = zip(adapter_names, adapter_weights)
-    print(f"Adapters: {list(adapter_weights)}")
@@ -8,6 +8,7 @@ class ImageFormat(str, Enum):
 
     JPEG = "jpeg"
     PNG = "png"
+    WEBP = "webp"
 
 
 class GeneratedImages(BaseModel):
@@ -15,3 +16,5 @@ class GeneratedImages(BaseModel):
     format: str = ImageFormat.PNG.value.upper()
     save_image: bool = True
     save_image_quality: int = 90
+    png_compress_level: int = 6
+    webp_lossless: bool = False
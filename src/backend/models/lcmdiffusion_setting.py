@@ -24,7 +24,7 @@ class Lora(BaseModel):
     models_dir: str = FastStableDiffusionPaths.get_lora_models_path()
     path: Optional[Any] = None
     weight: Optional[float] = 0.5
-    fuse: bool = True
+    fuse: bool = True  # Fuse the LoRA weights once they stop changing
     enabled: bool = False
 
 
@@ -76,3 +76,30 @@ class LCMDiffusionSetting(BaseModel):
     rebuild_controlnet_pipeline: bool = False
     use_gguf_model: bool = False
     gguf_model: Optional[GGUFModel] = GGUFModel()
+
+    def copy_settings(self, **updates: Any) -> "LCMDiffusionSetting":
+        """
+        Returns a copy of the settings with _updates_, nested settings are
+        copied too so that changing the copy never changes these settings;
+        images are shared since they are never modified in place.
+        """
+        settings = self.model_copy(update=updates)
+        for name in ("lcm_lora", "lora", "gguf_model"):
+            nested_setting = getattr(settings, name)
+            if nested_setting is not None:
+                setattr(settings, name, nested_setting.model_copy())
+        controlnet = settings.controlnet
+        if isinstance(controlnet, list):
+            settings.controlnet = [setting.model_copy() for setting in controlnet]
+        elif controlnet is not None:
+            settings.controlnet = controlnet.model_copy()
+        settings.dirs = dict(settings.dirs)
+        return settings
+
+    def get_enabled_controlnets(self) -> list[ControlNetSetting]:
+        """Returns the enabled ControlNets, _controlnet_ can be a single one."""
+        controlnet = self.controlnet
+        if not controlnet:
+            return []
+        controlnets = controlnet if isinstance(controlnet, list) else [controlnet]
+        return [controlnet for controlnet in controlnets if controlnet.enabled]
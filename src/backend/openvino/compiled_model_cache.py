@@ -0,0 +1,157 @@
+"""
+Persistent cache of OpenVINO compiled models.
+
+OpenVINO stores a compiled blob in CACHE_DIR for every compiled model, the
+blob name is a hash of the model graph (including its static input shapes),
+the device and the compile properties. Blobs are grouped in a directory per
+model id/revision, device and precision hint so they can be listed and pruned;
+the least recently used blobs are removed when the cache exceeds its size cap.
+"""
+
+import re
+from os import listdir, makedirs, path, remove, rmdir, utime, walk
+from time import time
+
+from backend.utils import get_model_revision
+from constants import DEVICE, OPENVINO_CACHE_SIZE_MB, OPENVINO_NUM_THREADS
+from paths import FastStableDiffusionPaths
+
+# The cache is pruned on the first model load of the process only, other
+# processes may be loading models from it at the same time
+_is_pruned = False
+
+
+def _sanitize(name: str) -> str:
+    return re.sub(r"[^\w.-]+", "--", name.strip("/\\")) or "default"
+
+
+def get_cache_dir(
+    model_id: str,
+    device: str = DEVICE,
+    precision_hint: str = "",
+) -> str:
+    return path.join(
+        FastStableDiffusionPaths.get_openvino_cache_path(),
+        _sanitize(model_id),
+        get_model_revision(model_id),
+        f"{device.upper()}-{_sanitize(precision_hint)}",
+    )
+
+
+def get_ov_config(
+    model_id: str,
+    device: str = DEVICE,
+    ov_config: dict = None,
+) -> dict:
+    """
+    Returns the OpenVINO config to load _model_id_ with the compiled models
+    cache enabled; the cache is disabled if its size cap is 0.
+    """
+    ov_config = dict(ov_config or {})
+    if OPENVINO_NUM_THREADS > 0:
+        ov_config.setdefault("INFERENCE_NUM_THREADS", OPENVINO_NUM_THREADS)
+    if OPENVINO_CACHE_SIZE_MB <= 0:
+        ov_config["CACHE_DIR"] = ""
+        return ov_config
+
+    cache_dir = get_cache_dir(
+        model_id,
+        device,
+        ov_config.get("INFERENCE_PRECISION_HINT", ""),
+    )
+    global _is_pruned
+    if not _is_pruned:
+        _is_pruned = True
+        prune()
+    makedirs(cache_dir, exist_ok=True)
+    mark_used(cache_dir)
+    print(f"OpenVINO compiled models cache : {cache_dir}")
+    ov_config["CACHE_DIR"] = cache_dir
+    return ov_config
+
+
+def mark_used(cache_dir: str) -> None:
+    """Updates the last used time of the compiled blobs in _cache_dir_."""
+    now = time()
+    try:
+        file_names = listdir(cache_dir)
+    except OSError:
+        return
+    for file_name in file_names:
+        try:
+            utime(path.join(cache_dir, file_name), (now, now))
+        except OSError:
+            pass
+
+
+def _get_blobs() -> list:
+    blobs = []
+    cache_path = FastStableDiffusionPaths.get_openvino_cache_path()
+    for root, _, files in walk(cache_path):
+        for file_name in files:
+            file_path = path.join(root, file_name)
+            try:
+                blobs.append(
+                    (
+                        path.getmtime(file_path),
+                        path.getsize(file_path),
+                        file_path,
+                    )
+                )
+            except OSError:
+                pass
+    return blobs
+
+
+def list_cache() -> list[dict]:
+    """Returns the cache directories with their size, blob count and last used time."""
+    cache_path = FastStableDiffusionPaths.get_openvino_cache_path()
+    entries = {}
+    for last_used, size, file_path in _get_blobs():
+        cache_dir = path.relpath(path.dirname(file_path), cache_path)
+        entry = entries.setdefault(
+            cache_dir,
+            {"cache_dir": cache_dir, "blobs": 0, "size_mb": 0.0, "last_used": 0.0},
+        )
+        entry["blobs"] += 1
+        entry["size_mb"] += size / (1024 * 1024)
+        entry["last_used"] = max(entry["last_used"], last_used)
+    return sorted(entries.values(), key=lambda entry: entry["last_used"], reverse=True)
+
+
+def prune(max_size_mb: int = OPENVINO_CACHE_SIZE_MB) -> list[str]:
+    """Removes the least recently used blobs until the cache fits in _max_size_mb_."""
+    removed_blobs = []
+    blobs = sorted(_get_blobs())
+    cache_size = sum(size for _, size, _ in blobs)
+    max_size = max(max_size_mb, 0) * 1024 * 1024
+    for _, size, file_path in blobs:
+        if cache_size <= max_size:
+            break
+        try:
+            remove(file_path)
+        except OSError:
+            # Removed by another process or still in use
+            continue
+        cache_size -= size
+        removed_blobs.append(file_path)
+    if removed_blobs:
+        print(f"Removed {len(removed_blobs)} blobs from OpenVINO compiled models cache")
+    _remove_empty_dirs()
+    return removed_blobs
+
+
+def clear() -> list[str]:
+    return prune(0)
+
+
+def _remove_empty_dirs() -> None:
+    cache_path = FastStableDiffusionPaths.get_openvino_cache_path()
+    for root, _, _ in sorted(walk(cache_path), reverse=True):
+        if root == cache_path:
+            continue
+        try:
+            if not listdir(root):
+                rmdir(root)
+        except OSError:
+            pass
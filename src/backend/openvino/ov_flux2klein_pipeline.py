@@ -8,6 +8,8 @@ from diffusers import Flux2KleinPipeline
 from huggingface_hub import hf_hub_download
 from optimum.intel.openvino.modeling_diffusion import OVDiffusionPipeline
 
+from backend.prompt_embedding_cache import get_model_key, prompt_embedding_cache
+
 
 def _reshape_ov_part(part, input_shapes: dict) -> None:
     """Reshape an OVPipelinePart model to new input shapes and invalidate its compiled request.
@@ -58,7 +60,37 @@ class OVFlux2KleinPipeline(OVDiffusionPipeline, Flux2KleinPipeline):
             )
 
         prompt = [prompt] if isinstance(prompt, str) else prompt
+        # Prompts are padded to max_sequence_length, caching them skips the
+        # Qwen3 encoder for repeated prompts
+        return prompt_embedding_cache.get_or_encode(
+            (
+                cls.__name__,
+                get_model_key(text_encoder),
+                max_sequence_length,
+                str(dtype),
+                str(device),
+                tuple(prompt),
+            ),
+            lambda: cls._encode_qwen3_prompts(
+                text_encoder,
+                tokenizer,
+                prompt,
+                dtype,
+                device,
+                max_sequence_length,
+            ),
+        )
 
+    @classmethod
+    def _encode_qwen3_prompts(
+        cls,
+        text_encoder,
+        tokenizer,
+        prompt,
+        dtype,
+        device,
+        max_sequence_length,
+    ):
         all_input_ids = []
         all_attention_masks = []
 
@@ -80,6 +80,9 @@ class OvHcLatentConsistency:
         init_image: Image = None,
          num_inference_steps=4,
         strength: float = 0.5,
+        callback=None,
+        progress=None,
+        cancel_token=None,
     ):
         image = self.ov_sd_pipleline(
             prompt=prompt,
@@ -88,6 +91,9 @@ class OvHcLatentConsistency:
             num_inference_steps=num_inference_steps,
             scheduler=self.scheduler,
             seed=None,
+            callback=callback,
+            progress=progress,
+            cancel_token=cancel_token,
         )
         
         return image
@@ -9,6 +9,7 @@ from optimum.intel.openvino.modeling_diffusion import (
 )
 
 from backend.device import is_openvino_device
+from backend.openvino.compiled_model_cache import get_ov_config
 from backend.tiny_autoencoder import get_tiny_autoencoder_repo_id
 from constants import DEVICE, LCM_DEFAULT_MODEL_OPENVINO
 from paths import get_base_folder_name
@@ -25,6 +26,15 @@ if is_openvino_device():
     )
 
 
+_OV_SHARED_PARTS = (
+    "unet",
+    "text_encoder",
+    "text_encoder_2",
+    "vae_decoder",
+    "vae_encoder",
+)
+
+
 def ov_load_tiny_autoencoder(
     pipeline: Any,
     use_local_model: bool = False,
@@ -58,14 +68,14 @@ def get_ov_text_to_image_pipeline(
         pipeline = OVStableDiffusionXLPipeline.from_pretrained(
             model_id,
             local_files_only=use_local_model,
-            ov_config={"CACHE_DIR": ""},
+            ov_config=get_ov_config(model_id),
             device=DEVICE.upper(),
         )
     else:
         pipeline = OVStableDiffusionPipeline.from_pretrained(
             model_id,
             local_files_only=use_local_model,
-            ov_config={"CACHE_DIR": ""},
+            ov_config=get_ov_config(model_id),
             device=DEVICE.upper(),
         )
 
@@ -80,19 +90,67 @@ def get_ov_image_to_image_pipeline(
         pipeline = OVStableDiffusionXLImg2ImgPipeline.from_pretrained(
             model_id,
             local_files_only=use_local_model,
-            ov_config={"CACHE_DIR": ""},
+            ov_config=get_ov_config(model_id),
             device=DEVICE.upper(),
         )
     else:
         pipeline = OVStableDiffusionImg2ImgPipeline.from_pretrained(
             model_id,
             local_files_only=use_local_model,
-            ov_config={"CACHE_DIR": ""},
+            ov_config=get_ov_config(model_id),
             device=DEVICE.upper(),
         )
     return pipeline
 
 
+def get_ov_image_to_image_pipeline_from_pipe(
+    pipeline: Any,
+    model_id: str = LCM_DEFAULT_MODEL_OPENVINO,
+    use_local_model: bool = False,
+) -> Any:
+    """
+    Returns an image to image pipeline sharing the submodels of the text to
+    image _pipeline_, so the models are loaded and compiled only once; falls
+    back to loading a separate pipeline if the models can't be shared.
+    """
+    try:
+        if pipeline.vae_encoder is None:
+            raise ValueError("the model has no VAE encoder")
+        if isinstance(pipeline, OVStableDiffusionXLPipeline):
+            pipeline_class = OVStableDiffusionXLImg2ImgPipeline
+        else:
+            pipeline_class = OVStableDiffusionImg2ImgPipeline
+        models = {}
+        for name in _OV_SHARED_PARTS:
+            part = getattr(pipeline, name, None)
+            if part is not None:
+                models[name] = part.model
+        img2img_pipeline = pipeline_class(
+            scheduler=pipeline.scheduler.__class__.from_config(
+                pipeline.scheduler.config
+            ),
+            tokenizer=pipeline.tokenizer,
+            tokenizer_2=getattr(pipeline, "tokenizer_2", None),
+            feature_extractor=getattr(pipeline, "feature_extractor", None),
+            device=DEVICE.upper(),
+            ov_config=pipeline.ov_config,
+            compile=False,
+            **models,
+        )
+        # Use the same model parts, reshaping or compiling one pipeline
+        # applies to both
+        for name in models:
+            setattr(img2img_pipeline, name, getattr(pipeline, name))
+        img2img_pipeline.vae = pipeline.vae
+        return img2img_pipeline
+    except Exception as ex:
+        print(f"Failed to share the OpenVINO models ({ex}), loading them again")
+        return get_ov_image_to_image_pipeline(
+            model_id,
+            use_local_model,
+        )
+
+
 def get_ov_diffusion_pipeline(
     model_id: str,
     use_local_model: bool = False,
@@ -100,7 +158,7 @@ def get_ov_diffusion_pipeline(
     pipeline = OVDiffusionPipeline.from_pretrained(
         model_id,
         local_files_only=use_local_model,
-        ov_config={"CACHE_DIR": ""},
+        ov_config=get_ov_config(model_id),
         device=DEVICE.upper(),
     )
     return pipeline
@@ -113,7 +171,7 @@ def get_flux_klein_pipeline(
     pipeline = OVFlux2KleinPipeline.from_pretrained(
         model_id,
         local_files_only=use_local_model,
-        ov_config={"CACHE_DIR": ""},
+        ov_config=get_ov_config(model_id),
         device=DEVICE.upper(),
     )
     return pipeline
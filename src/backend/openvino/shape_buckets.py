@@ -0,0 +1,137 @@
+"""
+Pool of OpenVINO compiled models for static shape buckets.
+
+Reshaping an OpenVINO pipeline replaces its compiled models, so switching
+between two resolutions recompiles every submodel each time. The pool keeps
+the reshaped models and their compiled requests for the most recently used
+(width, height, number of images) buckets, switching to a resident bucket
+only swaps the compiled models of the pipeline.
+"""
+
+from collections import OrderedDict
+from typing import Any
+
+from constants import OPENVINO_MAX_SHAPE_BUCKETS, OPENVINO_SHAPE_BUCKETS
+
+_SUBMODEL_NAMES = (
+    "unet",
+    "transformer",
+    "text_encoder",
+    "text_encoder_2",
+    "text_encoder_3",
+    "vae_decoder",
+    "vae_encoder",
+)
+
+
+def parse_shape_buckets(shape_buckets: str) -> list[tuple[int, int, int]]:
+    """
+    Parses a comma separated list of buckets in the _WIDTHxHEIGHT_ or
+    _WIDTHxHEIGHTxNUMBER_OF_IMAGES_ format, e.g. "512x512,768x768x2".
+    """
+    buckets = []
+    for bucket in shape_buckets.split(","):
+        if not bucket.strip():
+            continue
+        values = [int(value) for value in bucket.lower().split("x")]
+        if len(values) == 2:
+            values.append(1)
+        if len(values) != 3:
+            raise ValueError(f"Invalid OpenVINO shape bucket : {bucket}")
+        buckets.append(tuple(values))
+    return buckets
+
+
+def _get_submodels(pipeline: Any) -> dict:
+    submodels = {}
+    for name in _SUBMODEL_NAMES:
+        part = getattr(pipeline, name, None)
+        if part is not None and hasattr(part, "model") and hasattr(part, "request"):
+            submodels[name] = part
+    return submodels
+
+
+class CompiledShapePool:
+    """LRU pool of compiled OpenVINO models, one variant per shape bucket."""
+
+    def __init__(
+        self,
+        shape_buckets: list = None,
+        max_buckets: int = OPENVINO_MAX_SHAPE_BUCKETS,
+    ):
+        if shape_buckets is None:
+            shape_buckets = parse_shape_buckets(OPENVINO_SHAPE_BUCKETS)
+        self.shape_buckets = shape_buckets
+        self.max_buckets = max(max_buckets, len(shape_buckets), 1)
+        self._variants: OrderedDict[tuple, dict] = OrderedDict()
+        self.active_bucket = None
+        self.hits = 0
+        self.compilations = 0
+
+    @property
+    def is_enabled(self) -> bool:
+        """Requests are always routed through the pool when buckets are configured."""
+        return len(self.shape_buckets) > 0
+
+    def warm_up(self, pipeline: Any) -> None:
+        """Compiles the configured shape buckets ahead of the first request."""
+        for width, height, number_of_images in self.shape_buckets:
+            self.activate(pipeline, width, height, number_of_images)
+
+    def activate(
+        self,
+        pipeline: Any,
+        width: int,
+        height: int,
+        number_of_images: int,
+    ) -> bool:
+        """
+        Makes _pipeline_ use the compiled models for the given shape, returns
+        _True_ if the models had to be compiled.
+        """
+        bucket = (width, height, number_of_images)
+        if bucket == self.active_bucket:
+            return False
+
+        variant = self._variants.get(bucket)
+        if variant is not None:
+            self.hits += 1
+            self._variants.move_to_end(bucket)
+            for name, (model, request) in variant.items():
+                part = getattr(pipeline, name)
+                part.model = model
+                part.request = request
+            self.active_bucket = bucket
+            print(f"Using compiled OpenVINO models for {width}x{height}x{number_of_images}")
+            return False
+
+        print(f"Reshape and compile {width}x{height}x{number_of_images}")
+        submodels = _get_submodels(pipeline)
+        # Reshaping is done in place, so the models of the resident variants
+        # are cloned first to keep them unchanged
+        for part in submodels.values():
+            part.model = part.model.clone()
+        pipeline.reshape(
+            batch_size=-1,
+            height=height,
+            width=width,
+            num_images_per_prompt=number_of_images,
+        )
+        pipeline.compile()
+        self.compilations += 1
+        self._variants[bucket] = {
+            name: (part.model, part.request) for name, part in submodels.items()
+        }
+        self.active_bucket = bucket
+        while len(self._variants) > self.max_buckets:
+            evicted_bucket, _ = self._variants.popitem(last=False)
+            print(f"Released compiled OpenVINO models for {evicted_bucket}")
+        return True
+
+    def get_stats(self) -> dict:
+        return {
+            "buckets": list(self._variants.keys()),
+            "active_bucket": self.active_bucket,
+            "hits": self.hits,
+            "compilations": self.compilations,
+        }
@@ -44,6 +44,10 @@ import glob
 import json
 import time
 
+from backend.cancellation import CancellationToken
+from backend.generation_progress import GenerationProgress
+from backend.prompt_embedding_cache import get_model_key, prompt_embedding_cache
+
 
 def scale_fit_to_window(
     dst_width: int, dst_height: int, image_width: int, image_height: int
@@ -147,6 +151,69 @@ def result(var):
     return next(iter(var.values()))
 
 
+def _encode_lcm_prompt(engine: Any, prompt: Union[str, List[str]]) -> torch.Tensor:
+    text_inputs = engine.tokenizer(
+        prompt,
+        padding="max_length",
+        max_length=engine.tokenizer.model_max_length,
+        truncation=True,
+        return_tensors="pt",
+    )
+    text_input_ids = text_inputs.input_ids
+    untruncated_ids = engine.tokenizer(
+        prompt, padding="longest", return_tensors="pt"
+    ).input_ids
+
+    if untruncated_ids.shape[-1] >= text_input_ids.shape[
+        -1
+    ] and not torch.equal(text_input_ids, untruncated_ids):
+        removed_text = engine.tokenizer.batch_decode(
+            untruncated_ids[:, engine.tokenizer.model_max_length - 1 : -1]
+        )
+        print(
+            "The following part of your input was truncated because CLIP can only handle sequences up to"
+            f" {engine.tokenizer.model_max_length} tokens: {removed_text}"
+        )
+
+    prompt_embeds = engine.text_encoder(
+        text_input_ids, share_inputs=True, share_outputs=True
+    )
+    # The output tensor is shared with the next inference, copy it
+    return torch.from_numpy(prompt_embeds[0]).clone()
+
+
+def get_lcm_prompt_embeds(engine: Any, prompt: Union[str, List[str]]) -> torch.Tensor:
+    """
+    Returns the prompt embeddings of the LCM engine _engine_, from the prompt
+    embedding cache when the prompt has already been encoded.
+    """
+    return prompt_embedding_cache.get_or_encode(
+        (
+            engine.__class__.__name__,
+            get_model_key(engine),
+            prompt if isinstance(prompt, str) else tuple(prompt),
+        ),
+        lambda: _encode_lcm_prompt(engine, prompt),
+    )
+
+
+def _report_step(
+    step: int,
+    total_steps: int,
+    progress: Optional[GenerationProgress] = None,
+    cancel_token: Optional[CancellationToken] = None,
+) -> None:
+    """
+    Called before each step of the sampling loops and after the last one,
+    stops the generation when _cancel_token_ is cancelled and reports the
+    _step_ completed steps to _progress_.
+    """
+    if cancel_token:
+        cancel_token.raise_if_cancelled()
+    if progress:
+        progress.update(step, total_steps)
+
+
 class StableDiffusionEngineAdvanced(DiffusionPipeline):
     def __init__(
         self,
@@ -244,6 +311,8 @@ class StableDiffusionEngineAdvanced(DiffusionPipeline):
         model=None,
         callback=None,
         callback_userdata=None,
+        progress: Optional[GenerationProgress] = None,
+        cancel_token: Optional[CancellationToken] = None,
     ):
         # extract condition
         text_input = self.tokenizer(
@@ -309,6 +378,7 @@ class StableDiffusionEngineAdvanced(DiffusionPipeline):
             frames = []
 
         for i, t in enumerate(self.progress_bar(timesteps)):
+            _report_step(i, len(timesteps), progress, cancel_token)
             if callback:
                 callback(i, callback_userdata)
 
@@ -394,6 +464,7 @@ class StableDiffusionEngineAdvanced(DiffusionPipeline):
             if create_gif:
                 frames.append(latents)
 
+        _report_step(len(timesteps), len(timesteps), progress, cancel_token)
         if callback:
             callback(num_inference_steps, callback_userdata)
 
@@ -664,6 +735,8 @@ class StableDiffusionEngine(DiffusionPipeline):
         model=None,
         callback=None,
         callback_userdata=None,
+        progress: Optional[GenerationProgress] = None,
+        cancel_token: Optional[CancellationToken] = None,
     ):
         # extract condition
         text_input = self.tokenizer(
@@ -731,6 +804,7 @@ class StableDiffusionEngine(DiffusionPipeline):
             frames = []
 
         for i, t in enumerate(self.progress_bar(timesteps)):
+            _report_step(i, len(timesteps), progress, cancel_token)
             if callback:
                 callback(i, callback_userdata)
 
@@ -834,6 +908,7 @@ class StableDiffusionEngine(DiffusionPipeline):
             if create_gif:
                 frames.append(latents)
 
+        _report_step(len(timesteps), len(timesteps), progress, cancel_token)
         if callback:
             callback(num_inference_steps, callback_userdata)
 
@@ -1032,33 +1107,7 @@ class LatentConsistencyEngine(DiffusionPipeline):
         """
 
         if prompt_embeds is None:
-            text_inputs = self.tokenizer(
-                prompt,
-                padding="max_length",
-                max_length=self.tokenizer.model_max_length,
-                truncation=True,
-                return_tensors="pt",
-            )
-            text_input_ids = text_inputs.input_ids
-            untruncated_ids = self.tokenizer(
-                prompt, padding="longest", return_tensors="pt"
-            ).input_ids
-
-            if untruncated_ids.shape[-1] >= text_input_ids.shape[
-                -1
-            ] and not torch.equal(text_input_ids, untruncated_ids):
-                removed_text = self.tokenizer.batch_decode(
-                    untruncated_ids[:, self.tokenizer.model_max_length - 1 : -1]
-                )
-                logger.warning(
-                    "The following part of your input was truncated because CLIP can only handle sequences up to"
-                    f" {self.tokenizer.model_max_length} tokens: {removed_text}"
-                )
-
-            prompt_embeds = self.text_encoder(
-                text_input_ids, share_inputs=True, share_outputs=True
-            )
-            prompt_embeds = torch.from_numpy(prompt_embeds[0])
+            prompt_embeds = get_lcm_prompt_embeds(self, prompt)
 
         bs_embed, seq_len, _ = prompt_embeds.shape
         # duplicate text embeddings for each generation per prompt
@@ -1145,6 +1194,8 @@ class LatentConsistencyEngine(DiffusionPipeline):
         cross_attention_kwargs: Optional[Dict[str, Any]] = None,
         callback=None,
         callback_userdata=None,
+        progress: Optional[GenerationProgress] = None,
+        cancel_token: Optional[CancellationToken] = None,
     ):
         # 1. Define call parameters
         if prompt is not None and isinstance(prompt, str):
@@ -1199,6 +1250,7 @@ class LatentConsistencyEngine(DiffusionPipeline):
         # 6. LCM MultiStep Sampling Loop:
         with self.progress_bar(total=num_inference_steps) as progress_bar:
             for i, t in enumerate(timesteps):
+                _report_step(i, len(timesteps), progress, cancel_token)
                 if callback:
                     callback(i + 1, callback_userdata)
 
@@ -1216,6 +1268,7 @@ class LatentConsistencyEngine(DiffusionPipeline):
                     torch.from_numpy(model_pred), t, latents, return_dict=False
                 )
                 progress_bar.update()
+        _report_step(len(timesteps), len(timesteps), progress, cancel_token)
 
         # print("After Step 6: ")
 
@@ -1343,33 +1396,7 @@ class LatentConsistencyEngineAdvanced(DiffusionPipeline):
         """
 
         if prompt_embeds is None:
-            text_inputs = self.tokenizer(
-                prompt,
-                padding="max_length",
-                max_length=self.tokenizer.model_max_length,
-                truncation=True,
-                return_tensors="pt",
-            )
-            text_input_ids = text_inputs.input_ids
-            untruncated_ids = self.tokenizer(
-                prompt, padding="longest", return_tensors="pt"
-            ).input_ids
-
-            if untruncated_ids.shape[-1] >= text_input_ids.shape[
-                -1
-            ] and not torch.equal(text_input_ids, untruncated_ids):
-                removed_text = self.tokenizer.batch_decode(
-                    untruncated_ids[:, self.tokenizer.model_max_length - 1 : -1]
-                )
-                logger.warning(
-                    "The following part of your input was truncated because CLIP can only handle sequences up to"
-                    f" {self.tokenizer.model_max_length} tokens: {removed_text}"
-                )
-
-            prompt_embeds = self.text_encoder(
-                text_input_ids, share_inputs=True, share_outputs=True
-            )
-            prompt_embeds = torch.from_numpy(prompt_embeds[0])
+            prompt_embeds = get_lcm_prompt_embeds(self, prompt)
 
         bs_embed, seq_len, _ = prompt_embeds.shape
         # duplicate text embeddings for each generation per prompt
@@ -1481,6 +1508,8 @@ class LatentConsistencyEngineAdvanced(DiffusionPipeline):
         cross_attention_kwargs: Optional[Dict[str, Any]] = None,
         callback=None,
         callback_userdata=None,
+        progress: Optional[GenerationProgress] = None,
+        cancel_token: Optional[CancellationToken] = None,
     ):
         # 1. Define call parameters
         if prompt is not None and isinstance(prompt, str):
@@ -1553,6 +1582,7 @@ class LatentConsistencyEngineAdvanced(DiffusionPipeline):
         # 6. LCM MultiStep Sampling Loop:
         with self.progress_bar(total=num_inference_steps) as progress_bar:
             for i, t in enumerate(timesteps):
+                _report_step(i, len(timesteps), progress, cancel_token)
                 if callback:
                     callback(i + 1, callback_userdata)
 
@@ -1570,6 +1600,7 @@ class LatentConsistencyEngineAdvanced(DiffusionPipeline):
                     torch.from_numpy(model_pred), t, latents, return_dict=False
                 )
                 progress_bar.update()
+        _report_step(len(timesteps), len(timesteps), progress, cancel_token)
 
         # print("After Step 6: ")
 
@@ -1682,6 +1713,8 @@ class StableDiffusionEngineReferenceOnly(DiffusionPipeline):
         model=None,
         callback=None,
         callback_userdata=None,
+        progress: Optional[GenerationProgress] = None,
+        cancel_token: Optional[CancellationToken] = None,
     ):
         # extract condition
         text_input = self.tokenizer(
@@ -1754,6 +1787,7 @@ class StableDiffusionEngineReferenceOnly(DiffusionPipeline):
             frames = []
 
         for i, t in enumerate(self.progress_bar(timesteps)):
+            _report_step(i, len(timesteps), progress, cancel_token)
             if callback:
                 callback(i, callback_userdata)
 
@@ -1874,6 +1908,7 @@ class StableDiffusionEngineReferenceOnly(DiffusionPipeline):
             if create_gif:
                 frames.append(latents)
 
+        _report_step(len(timesteps), len(timesteps), progress, cancel_token)
         if callback:
             callback(num_inference_steps, callback_userdata)
 
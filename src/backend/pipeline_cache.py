@@ -0,0 +1,164 @@
+import gc
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from constants import PIPELINE_CACHE_SIZE_MB
+
+try:
+    # psutil is installed along with accelerate; keeping it optional anyway
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def get_resident_memory() -> int:
+    """Returns the resident set size of the current process in bytes."""
+    if psutil:
+        return psutil.Process().memory_info().rss
+    try:
+        from os import sysconf
+
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, ImportError):
+        return 0
+
+
+def get_pipeline_memory_size(pipeline: Any) -> int:
+    """
+    Returns the memory used by the weights of the PyTorch components of
+    _pipeline_ in bytes, or 0 if the pipeline has no PyTorch components
+    (OpenVINO and GGUF pipelines). Components shared with other pipelines
+    are counted for each pipeline, so the estimate errs on the high side.
+    """
+    import torch
+
+    size = 0
+    components = getattr(pipeline, "components", None)
+    if not isinstance(components, dict):
+        return size
+    for component in components.values():
+        if isinstance(component, torch.nn.Module):
+            for tensor in list(component.parameters()) + list(component.buffers()):
+                size += tensor.numel() * tensor.element_size()
+    return size
+
+
+class PipelineCacheEntry:
+    def __init__(
+        self,
+        pipelines: dict,
+        size: int,
+        load_time: float,
+    ):
+        self.pipelines = pipelines
+        self.size = size
+        self.load_time = load_time
+
+
+class PipelineCache:
+    """
+    LRU cache of built pipelines, keyed by the effective build configuration.
+
+    Pipelines are kept resident as long as their total estimated memory stays
+    within _max_memory_mb_; the least recently used pipelines are evicted
+    first. The most recently added pipeline is never evicted, so a budget of
+    0 keeps a single pipeline resident, which is the default behaviour.
+    """
+
+    def __init__(self, max_memory_mb: int = PIPELINE_CACHE_SIZE_MB):
+        self.max_memory = max(max_memory_mb, 0) * 1024 * 1024
+        self._entries: OrderedDict[Hashable, PipelineCacheEntry] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_load_time = 0.0
+        self.last_load_time = 0.0
+
+    @property
+    def memory_used(self) -> int:
+        return sum(entry.size for entry in self._entries.values())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        print(f"Pipeline cache hit : {key}")
+        return entry.pipelines
+
+    def put(
+        self,
+        key: Hashable,
+        pipelines: dict,
+        size: int,
+        load_time: float,
+    ) -> None:
+        self._entries[key] = PipelineCacheEntry(pipelines, size, load_time)
+        self._entries.move_to_end(key)
+        self.total_load_time += load_time
+        self.last_load_time = load_time
+        print(
+            f"Pipeline cached : {key}, size {size / (1024 * 1024):.0f} MB,"
+            f" load time {load_time:.2f} seconds"
+        )
+        self._evict()
+
+    def update(
+        self,
+        key: Hashable,
+        pipelines: dict,
+    ) -> None:
+        """Replaces the pipelines of an existing entry, e.g. after a ControlNet rebuild."""
+        if key in self._entries:
+            self._entries[key].pipelines = pipelines
+
+    def remove(self, key: Hashable) -> None:
+        if key in self._entries:
+            del self._entries[key]
+            gc.collect()
+
+    def reserve(self) -> None:
+        """
+        Makes room for a new pipeline; when there's no budget for more than
+        one pipeline, all the cached pipelines are released before loading.
+        """
+        if self.max_memory == 0 and self._entries:
+            self.clear()
+
+    def clear(self) -> None:
+        self.evictions += len(self._entries)
+        self._entries.clear()
+        gc.collect()
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "memory_used_mb": round(self.memory_used / (1024 * 1024), 2),
+            "max_memory_mb": round(self.max_memory / (1024 * 1024), 2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "last_load_time": round(self.last_load_time, 2),
+            "total_load_time": round(self.total_load_time, 2),
+        }
+
+    def _evict(self) -> None:
+        evicted = False
+        while len(self._entries) > 1 and self.memory_used > self.max_memory:
+            key, _ = self._entries.popitem(last=False)
+            self.evictions += 1
+            evicted = True
+            print(f"Pipeline evicted from cache : {key}")
+        if evicted:
+            gc.collect()
@@ -0,0 +1,188 @@
+import hashlib
+from copy import deepcopy
+from os import path, stat, walk
+from typing import Any, Optional
+from weakref import WeakValueDictionary
+
+import torch
+
+# Pipeline components that don't depend on the UNet and can be shared
+# between pipelines built from different models
+SHAREABLE_COMPONENTS = (
+    "text_encoder",
+    "text_encoder_2",
+    "tokenizer",
+    "tokenizer_2",
+    "vae",
+)
+# Components that receive the weights of LoRAs
+LORA_COMPONENTS = (
+    "text_encoder",
+    "text_encoder_2",
+)
+
+_components = WeakValueDictionary()
+_file_hashes = {}
+
+
+def _get_file_hash(file_path: str) -> str:
+    """
+    Returns a content hash for _file_path_; files stored in the Hugging Face
+    cache are already named after their content hash, other files are hashed
+    once and the result is kept for as long as the file is unchanged.
+    """
+    real_path = path.realpath(file_path)
+    if path.basename(path.dirname(real_path)) == "blobs":
+        return path.basename(real_path)
+
+    file_stat = stat(real_path)
+    file_key = (real_path, file_stat.st_size, file_stat.st_mtime)
+    if file_key not in _file_hashes:
+        sha256 = hashlib.sha256()
+        with open(real_path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        _file_hashes[file_key] = sha256.hexdigest()
+    return _file_hashes[file_key]
+
+
+def _get_model_dir(model_id: str) -> Optional[str]:
+    if path.isdir(model_id):
+        return model_id
+    try:
+        from huggingface_hub import snapshot_download
+
+        # Only look into the local cache, the model is downloaded by diffusers
+        return snapshot_download(
+            repo_id=model_id,
+            local_files_only=True,
+        )
+    except Exception:
+        return None
+
+
+def get_folder_hash(
+    model_id: str,
+    subfolder: str,
+) -> Optional[str]:
+    """
+    Returns a content hash of the _subfolder_ of a diffusers model, or _None_
+    if the model files are not available locally.
+    """
+    model_dir = _get_model_dir(model_id)
+    if not model_dir:
+        return None
+    folder = path.join(model_dir, subfolder)
+    if not path.isdir(folder):
+        return None
+
+    sha256 = hashlib.sha256()
+    for root, _, files in sorted(walk(folder)):
+        for file_name in sorted(files):
+            file_path = path.join(root, file_name)
+            sha256.update(path.relpath(file_path, folder).encode("utf-8"))
+            sha256.update(_get_file_hash(file_path).encode("utf-8"))
+    return sha256.hexdigest()
+
+
+def get_component_hash(component: Any) -> Optional[str]:
+    """Returns a content hash of the weights (or vocabulary) of _component_."""
+    sha256 = hashlib.sha256()
+    sha256.update(component.__class__.__name__.encode("utf-8"))
+    if isinstance(component, torch.nn.Module):
+        for name, tensor in component.state_dict().items():
+            sha256.update(name.encode("utf-8"))
+            sha256.update(str(tensor.dtype).encode("utf-8"))
+            tensor = tensor.detach().cpu().contiguous().reshape(-1)
+            sha256.update(tensor.view(torch.uint8).numpy())
+    elif hasattr(component, "get_vocab"):
+        vocab = sorted(component.get_vocab().items())
+        sha256.update(str(vocab).encode("utf-8"))
+    else:
+        return None
+    return sha256.hexdigest()
+
+
+def get_stored_components(
+    model_id: str,
+    components: tuple = SHAREABLE_COMPONENTS,
+) -> dict:
+    """
+    Returns the already loaded components whose files are identical to the
+    ones of _model_id_, to be passed to _from_pretrained()_ so they are not
+    loaded again.
+    """
+    stored_components = {}
+    for name in components:
+        folder_hash = get_folder_hash(model_id, name)
+        if folder_hash is None:
+            continue
+        component = _components.get(folder_hash)
+        if component is not None:
+            print(f"Reusing loaded {name} ({folder_hash[:12]})")
+            stored_components[name] = component
+    return stored_components
+
+
+def share_pipeline_components(
+    pipeline: Any,
+    model_id: str = "",
+) -> None:
+    """
+    Registers the shareable components of _pipeline_ in the component store,
+    replacing each component by an identical one if it is already loaded.
+
+    Components are identified by the content hash of their model files when
+    _model_id_ is a diffusers model, or by a hash of their weights otherwise
+    (single file models). Components with LoRA adapters are not shared.
+    """
+    for name in SHAREABLE_COMPONENTS:
+        component = getattr(pipeline, name, None)
+        if component is None or getattr(component, "peft_config", None):
+            continue
+        component_hash = None
+        if model_id and not model_id.endswith(".safetensors"):
+            component_hash = get_folder_hash(model_id, name)
+        if component_hash is None:
+            component_hash = get_component_hash(component)
+        if component_hash is None:
+            continue
+
+        stored_component = _components.get(component_hash)
+        if stored_component is None:
+            _components[component_hash] = component
+        elif stored_component is not component:
+            print(f"Sharing loaded {name} ({component_hash[:12]})")
+            setattr(pipeline, name, stored_component)
+
+
+def unshare_pipeline_components(
+    pipeline: Any,
+    components: tuple = LORA_COMPONENTS,
+) -> None:
+    """
+    Replaces the _components_ of _pipeline_ registered in the component store
+    by a private copy, so that they can be modified (LoRA weights) without
+    changing the other pipelines sharing them.
+    """
+    stored_components = list(_components.values())
+    for name in components:
+        component = getattr(pipeline, name, None)
+        if component is None or not any(
+            stored_component is component for stored_component in stored_components
+        ):
+            continue
+        print(f"Copying shared {name}")
+        setattr(pipeline, name, deepcopy(component))
+
+
+def get_shared_component(key: str) -> Any:
+    return _components.get(key)
+
+
+def store_component(
+    key: str,
+    component: Any,
+) -> Any:
+    _components[key] = component
+    return component
@@ -8,6 +8,12 @@ from diffusers import (
 )
 import torch
 from backend.tiny_autoencoder import get_tiny_autoencoder_repo_id
+from backend.pipelines.component_store import (
+    get_shared_component,
+    get_stored_components,
+    share_pipeline_components,
+    store_component,
+)
 from typing import Any
 from diffusers import (
     LCMScheduler,
@@ -39,8 +45,10 @@ def _get_lcm_pipeline_from_base_model(
         torch_dtype=torch.float32,
         local_files_only=use_local_model,
         resume_download=True,
+        **get_stored_components(base_model_id),
     )
     pipeline.scheduler = LCMScheduler.from_config(pipeline.scheduler.config)
+    share_pipeline_components(pipeline, base_model_id)
     return pipeline
 
 
@@ -50,11 +58,19 @@ def load_taesd(
     torch_data_type: torch.dtype = torch.float32,
 ):
     tiny_vae = get_tiny_autoencoder_repo_id(pipeline.__class__.__name__)
-    pipeline.vae = AutoencoderTiny.from_pretrained(
-        tiny_vae,
-        torch_dtype=torch_data_type,
-        local_files_only=use_local_model,
-    )
+    # The tiny autoencoder is shared by all the pipelines using it
+    component_key = f"{tiny_vae}:{torch_data_type}"
+    vae = get_shared_component(component_key)
+    if vae is None:
+        vae = store_component(
+            component_key,
+            AutoencoderTiny.from_pretrained(
+                tiny_vae,
+                torch_dtype=torch_data_type,
+                local_files_only=use_local_model,
+            ),
+        )
+    pipeline.vae = vae
 
 
 def get_lcm_model_pipeline(
@@ -98,13 +114,16 @@ def get_lcm_model_pipeline(
             **pipeline_args,
         )
         del dummy_pipeline
+        share_pipeline_components(pipeline)
     else:
         # pipeline = DiffusionPipeline.from_pretrained(
         pipeline = AutoPipelineForText2Image.from_pretrained(
             model_id,
             local_files_only=use_local_model,
+            **get_stored_components(model_id),
             **pipeline_args,
         )
+        share_pipeline_components(pipeline, model_id)
 
     return pipeline
 
@@ -9,6 +9,19 @@ from diffusers import (
     StableDiffusionXLPipeline,
 )
 
+from backend.pipelines.component_store import (
+    get_stored_components,
+    share_pipeline_components,
+)
+
+# The LCM-LoRA may patch the text encoders, so only the components that
+# LoRAs never touch are reused before loading the base model
+_LCM_LORA_STORED_COMPONENTS = (
+    "tokenizer",
+    "tokenizer_2",
+    "vae",
+)
+
 
 def load_lcm_weights(
     pipeline,
@@ -83,6 +96,10 @@ def get_lcm_lora_pipeline(
             base_model_id,
             torch_dtype=torch_data_type,
             local_files_only=use_local_model,
+            **get_stored_components(
+                base_model_id,
+                _LCM_LORA_STORED_COMPONENTS,
+            ),
             **pipeline_args,
         )
 
@@ -94,6 +111,9 @@ def get_lcm_lora_pipeline(
     # Always fuse LCM-LoRA
     # pipeline.fuse_lora()
 
+    # Text encoders patched by the LCM-LoRA are not shared
+    share_pipeline_components(pipeline, base_model_id)
+
     lcmlora = lcm_lora_id.lower()
     if "lcm" in lcmlora or "hypersd" in lcmlora or "dmd2" in lcmlora:
         print("LCM LoRA model detected so using recommended LCMScheduler")
@@ -0,0 +1,31 @@
+"""
+Connection of the worker processes (API workers, GGUF worker) to their parent.
+"""
+
+from multiprocessing.connection import Connection, Listener, wait
+from typing import Any
+
+_POLL_INTERVAL = 0.1
+
+
+def accept_connection(
+    listener: Listener,
+    process: Any,
+    name: str,
+) -> Connection:
+    """
+    Accepts the connection of the worker _process_ (anything with _poll()_
+    and _returncode_, like _Popen_), raises a _RuntimeError_ if the worker
+    exits before connecting instead of waiting for it forever.
+    """
+    # The listening socket isn't exposed by multiprocessing
+    listener_socket = listener._listener._socket
+    while not wait([listener_socket], _POLL_INTERVAL):
+        if process.poll() is not None:
+            raise RuntimeError(
+                f"{name} exited with code {process.returncode} before connecting"
+            )
+    try:
+        return listener.accept()
+    except (EOFError, OSError) as exception:
+        raise RuntimeError(f"{name} exited before connecting") from exception
@@ -0,0 +1,36 @@
+from typing import Optional
+
+# Fields of /proc/<pid>/smaps_rollup, in kB
+_SHARED_FIELDS = ("Shared_Clean", "Shared_Dirty")
+_PRIVATE_FIELDS = ("Private_Clean", "Private_Dirty")
+
+
+def get_process_memory(pid: int) -> Optional[dict]:
+    """
+    Returns the memory usage of process _pid_ in MB : resident memory, memory
+    shared with other processes (e.g. model weights inherited from a parent
+    process), memory unique to the process and the proportional set size
+    (shared memory divided between the processes using it). Returns _None_ if
+    not available (Linux only).
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as file:
+            lines = file.readlines()
+    except OSError:
+        return None
+
+    fields = {}
+    for line in lines:
+        parts = line.split()
+        if len(parts) == 3 and parts[2] == "kB":
+            fields[parts[0].rstrip(":")] = int(parts[1])
+
+    def to_mb(kilobytes: int) -> float:
+        return round(kilobytes / 1024, 1)
+
+    return {
+        "rss_mb": to_mb(fields.get("Rss", 0)),
+        "shared_mb": to_mb(sum(fields.get(name, 0) for name in _SHARED_FIELDS)),
+        "unique_mb": to_mb(sum(fields.get(name, 0) for name in _PRIVATE_FIELDS)),
+        "pss_mb": to_mb(fields.get("Pss", 0)),
+    }
@@ -0,0 +1,159 @@
+import inspect
+from collections import OrderedDict
+from itertools import count
+from threading import Lock
+from typing import Any, Callable, Hashable
+from weakref import WeakKeyDictionary
+
+from constants import PROMPT_EMBEDDING_CACHE_SIZE
+
+_model_keys = WeakKeyDictionary()
+_model_key_counter = count()
+
+
+def get_model_key(*models: Any) -> tuple:
+    """
+    Returns a key identifying the loaded _models_ (text encoders or pipelines)
+    for as long as they are alive; unlike _id()_, the key of a released model
+    is never reused by a model loaded later.
+    """
+    keys = []
+    for model in models:
+        if model is None:
+            keys.append(None)
+            continue
+        try:
+            if model not in _model_keys:
+                _model_keys[model] = next(_model_key_counter)
+            keys.append(_model_keys[model])
+        except TypeError:
+            # Not weak referenceable, e.g. OpenVINO compiled models
+            keys.append(id(model))
+    return tuple(keys)
+
+
+class PromptEmbeddingCache:
+    """
+    LRU cache of prompt embeddings, keyed by the text encoder, the encoding
+    options and the prompt, so repeated prompts skip the text encoder.
+    """
+
+    def __init__(self, max_entries: int = PROMPT_EMBEDDING_CACHE_SIZE):
+        self.max_entries = max(max_entries, 0)
+        self._entries: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_or_encode(
+        self,
+        key: Hashable,
+        encode: Callable[[], Any],
+    ) -> Any:
+        """Returns the cached embeddings for _key_, calls _encode_ on a miss."""
+        if self.max_entries == 0:
+            return encode()
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+
+        embeddings = encode()
+        with self._lock:
+            self._entries[key] = embeddings
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return embeddings
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+prompt_embedding_cache = PromptEmbeddingCache()
+
+
+def get_prompt_embeds_args(
+    pipeline: Any,
+    prompt: str,
+    negative_prompt: str,
+    guidance_scale: float,
+    clip_skip: int = None,
+    lora_weights: tuple = (),
+) -> dict:
+    """
+    Returns the prompt arguments of a diffusers _pipeline_ call, using the
+    cached prompt embeddings when the pipeline accepts them. Embeddings are
+    encoded for a single image, the pipeline repeats them per image.
+    """
+    call_parameters = inspect.signature(pipeline.__call__).parameters
+    encode_parameters = {}
+    if hasattr(pipeline, "encode_prompt"):
+        encode_parameters = inspect.signature(pipeline.encode_prompt).parameters
+    if (
+        not isinstance(prompt, str)
+        or "prompt_embeds" not in call_parameters
+        or "do_classifier_free_guidance" not in encode_parameters
+        or "negative_prompt" not in encode_parameters
+    ):
+        return {
+            "prompt": prompt,
+            "negative_prompt": negative_prompt,
+        }
+
+    do_classifier_free_guidance = guidance_scale > 1.0
+    device = getattr(pipeline, "_execution_device", "cpu")
+    key = (
+        pipeline.__class__.__name__,
+        get_model_key(
+            getattr(pipeline, "text_encoder", None),
+            getattr(pipeline, "text_encoder_2", None),
+        ),
+        clip_skip,
+        tuple(lora_weights),
+        do_classifier_free_guidance,
+        str(device),
+        prompt,
+        negative_prompt,
+    )
+    embeddings = prompt_embedding_cache.get_or_encode(
+        key,
+        lambda: pipeline.encode_prompt(
+            prompt=prompt,
+            device=device,
+            num_images_per_prompt=1,
+            do_classifier_free_guidance=do_classifier_free_guidance,
+            negative_prompt=negative_prompt,
+            clip_skip=clip_skip,
+        ),
+    )
+
+    # Stable Diffusion pipelines return the prompt and negative prompt
+    # embeddings, SDXL pipelines also return the pooled embeddings
+    names = [
+        "prompt_embeds",
+        "negative_prompt_embeds",
+        "pooled_prompt_embeds",
+        "negative_pooled_prompt_embeds",
+    ]
+    prompt_args = {}
+    for name, embeds in zip(names, embeddings):
+        if embeds is not None and name in call_parameters:
+            prompt_args[name] = embeds
+    return prompt_args
@@ -0,0 +1,264 @@
+"""
+Disk cache of generation results.
+
+A generation with a fixed seed always gives the same images for the same
+settings, input images and model files, so its result is stored under a hash
+of all of them and identical requests are served from the cache. The least
+recently used results are removed when the cache exceeds its size cap.
+"""
+
+import hashlib
+import json
+from collections import OrderedDict
+from contextlib import contextmanager
+from os import listdir, makedirs, path, remove, replace, utime
+from threading import Lock
+from typing import Any, Iterator, List, Optional
+
+from PIL import Image
+
+from backend.models.lcmdiffusion_setting import LCMDiffusionSetting
+from backend.utils import get_model_revision
+from constants import APP_VERSION, DEVICE, RESULT_CACHE_SIZE_MB
+from paths import FastStableDiffusionPaths
+
+
+def hash_image(image: Any) -> Optional[str]:
+    """Returns the hash of the pixels of a PIL image, or of a base64 image."""
+    if image is None:
+        return None
+    if isinstance(image, Image.Image):
+        digest = hashlib.sha256(f"{image.mode}{image.size}".encode())
+        digest.update(image.tobytes())
+        return digest.hexdigest()
+    return hashlib.sha256(str(image).encode()).hexdigest()
+
+
+def _get_model_version(model_path: str) -> str:
+    # Local model files can be replaced without changing their path
+    if path.isfile(model_path):
+        return f"{path.getsize(model_path)}-{int(path.getmtime(model_path))}"
+    return get_model_revision(model_path)
+
+
+def _get_models(lcm_diffusion_setting: LCMDiffusionSetting) -> List[str]:
+    if lcm_diffusion_setting.use_gguf_model:
+        gguf_model = lcm_diffusion_setting.gguf_model
+        models = [
+            gguf_model.diffusion_path,
+            gguf_model.clip_path,
+            gguf_model.t5xxl_path,
+            gguf_model.vae_path,
+        ]
+    elif lcm_diffusion_setting.use_openvino:
+        models = [lcm_diffusion_setting.openvino_lcm_model_id]
+    elif lcm_diffusion_setting.use_lcm_lora:
+        models = [
+            lcm_diffusion_setting.lcm_lora.base_model_id,
+            lcm_diffusion_setting.lcm_lora.lcm_lora_id,
+        ]
+    else:
+        models = [lcm_diffusion_setting.lcm_model_id]
+    lora = lcm_diffusion_setting.lora
+    if lora and lora.enabled and lora.path:
+        models.append(str(lora.path))
+    for controlnet in lcm_diffusion_setting.get_enabled_controlnets():
+        models.append(controlnet.adapter_path)
+    return [model for model in models if model]
+
+
+def get_result_cache_key(
+    lcm_diffusion_setting: LCMDiffusionSetting,
+) -> Optional[str]:
+    """
+    Returns the hash identifying the result of a generation, _None_ if the
+    generation uses a random seed or the result cache is disabled.
+    """
+    if not lcm_diffusion_setting.use_seed or not result_cache.is_enabled:
+        return None
+    settings = lcm_diffusion_setting.model_dump(
+        mode="json",
+        exclude={
+            "init_image",
+            "dirs",
+            "rebuild_pipeline",
+            "rebuild_controlnet_pipeline",
+        },
+    )
+    key_data = {
+        "settings": settings,
+        "init_image": hash_image(lcm_diffusion_setting.init_image),
+        "control_images": [
+            hash_image(controlnet._control_image)
+            for controlnet in lcm_diffusion_setting.get_enabled_controlnets()
+        ],
+        "models": [
+            [model, _get_model_version(model)]
+            for model in _get_models(lcm_diffusion_setting)
+        ],
+        "device": DEVICE,
+        "version": APP_VERSION,
+    }
+    canonical_json = json.dumps(
+        key_data,
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(canonical_json.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    LRU disk cache of generation results (serialized responses), or of other
+    computed data stored as _file_extension_ files, limited to _max_size_mb_
+    (0 disables the cache). Callers hold _lock(key)_ while
+    generating a result, so concurrent identical requests wait for the first
+    one and get its result from the cache.
+    """
+
+    def __init__(
+        self,
+        cache_path: str = "",
+        max_size_mb: int = RESULT_CACHE_SIZE_MB,
+        file_extension: str = ".json",
+    ):
+        if not cache_path:
+            cache_path = FastStableDiffusionPaths.get_result_cache_path()
+        self.cache_path = cache_path
+        self.max_size = max(max_size_mb, 0) * 1024 * 1024
+        self.file_extension = file_extension
+        self._entries: Optional[OrderedDict[str, int]] = None
+        self._size = 0
+        self._lock = Lock()
+        self._key_locks = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def is_enabled(self) -> bool:
+        return self.max_size > 0
+
+    def _get_file_path(self, key: str) -> str:
+        return path.join(self.cache_path, key + self.file_extension)
+
+    def _load(self) -> OrderedDict:
+        # Index of the cached results, least recently used first
+        if self._entries is not None:
+            return self._entries
+        files = []
+        if path.isdir(self.cache_path):
+            for file_name in listdir(self.cache_path):
+                if not file_name.endswith(self.file_extension):
+                    continue
+                file_path = path.join(self.cache_path, file_name)
+                try:
+                    files.append(
+                        (
+                            path.getmtime(file_path),
+                            path.getsize(file_path),
+                            file_name[: -len(self.file_extension)],
+                        )
+                    )
+                except OSError:
+                    pass
+        self._entries = OrderedDict()
+        for _, size, key in sorted(files):
+            self._entries[key] = size
+        self._size = sum(self._entries.values())
+        return self._entries
+
+    def get(self, key: Optional[str]) -> Optional[bytes]:
+        if not key or not self.is_enabled:
+            return None
+        file_path = self._get_file_path(key)
+        with self._lock:
+            entries = self._load()
+            if key in entries:
+                try:
+                    with open(file_path, "rb") as file:
+                        data = file.read()
+                    # Keeps the LRU order across restarts
+                    utime(file_path)
+                    entries.move_to_end(key)
+                    self.hits += 1
+                    return data
+                except OSError:
+                    self._size -= entries.pop(key)
+            self.misses += 1
+            return None
+
+    def put(
+        self,
+        key: Optional[str],
+        data: bytes,
+    ) -> None:
+        if not key or not self.is_enabled or len(data) > self.max_size:
+            return
+        file_path = self._get_file_path(key)
+        temp_file_path = f"{file_path}.tmp"
+        with self._lock:
+            entries = self._load()
+            try:
+                makedirs(self.cache_path, exist_ok=True)
+                with open(temp_file_path, "wb") as file:
+                    file.write(data)
+                replace(temp_file_path, file_path)
+            except OSError as exception:
+                print(f"Failed to cache the generation result : {exception}")
+                return
+            self._size += len(data) - entries.pop(key, 0)
+            entries[key] = len(data)
+            while self._size > self.max_size:
+                old_key, size = entries.popitem(last=False)
+                self._size -= size
+                try:
+                    remove(self._get_file_path(old_key))
+                except OSError:
+                    pass
+
+    @contextmanager
+    def lock(self, key: Optional[str]) -> Iterator[None]:
+        """Serializes the generations of the result _key_."""
+        if not key or not self.is_enabled:
+            yield
+            return
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, [Lock(), 0])
+            key_lock[1] += 1
+        try:
+            with key_lock[0]:
+                yield
+        finally:
+            with self._lock:
+                key_lock[1] -= 1
+                if key_lock[1] == 0:
+                    del self._key_locks[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in self._load():
+                try:
+                    remove(self._get_file_path(key))
+                except OSError:
+                    pass
+            self._entries.clear()
+            self._size = 0
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        with self._lock:
+            entries = self._load() if self.is_enabled else {}
+            return {
+                "enabled": self.is_enabled,
+                "entries": len(entries),
+                "size_mb": round(self._size / (1024 * 1024), 2),
+                "max_size_mb": self.max_size // (1024 * 1024),
+                "in_flight": len(self._key_locks),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+result_cache = ResultCache()
@@ -0,0 +1,87 @@
+import atexit
+from os import replace
+from threading import Condition, Lock, Thread
+from time import monotonic
+from typing import Callable, Optional
+
+import yaml
+
+from constants import SETTINGS_SAVE_DELAY
+
+
+class SettingsPersister:
+    """
+    Writes the settings file in the background _delay_ seconds after the
+    last save request, so consecutive changes are written once. The file is
+    written to a temporary file then renamed, readers never see a partially
+    written file. Pending changes are written when the application exits.
+    """
+
+    def __init__(
+        self,
+        config_path: str,
+        get_configurations: Callable[[], dict],
+        delay: float = SETTINGS_SAVE_DELAY,
+    ):
+        self.config_path = config_path
+        self.get_configurations = get_configurations
+        self.delay = max(delay, 0.0)
+        self.enabled = True
+        self._condition = Condition()
+        self._write_lock = Lock()
+        self._due: Optional[float] = None
+        self._thread: Optional[Thread] = None
+        self.save_requests = 0
+        self.writes = 0
+        atexit.register(self.flush)
+
+    def schedule(self) -> None:
+        """Requests a write of the settings, coalesced with the pending one."""
+        if not self.enabled:
+            return
+        with self._condition:
+            self.save_requests += 1
+            self._due = monotonic() + self.delay
+            if self._thread is None:
+                self._thread = Thread(
+                    target=self._run,
+                    name="settings-persister",
+                    daemon=True,
+                )
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while self._due is None:
+                    self._condition.wait()
+                remaining = self._due - monotonic()
+                if remaining > 0:
+                    # Postponed by every new save request
+                    self._condition.wait(remaining)
+                    continue
+                self._due = None
+            self._write()
+
+    def flush(self) -> None:
+        """Writes the pending changes now."""
+        with self._condition:
+            pending = self._due is not None
+            self._due = None
+        if pending:
+            self._write()
+
+    def _write(self) -> None:
+        with self._write_lock:
+            temp_config_path = f"{self.config_path}.tmp"
+            try:
+                configurations = self.get_configurations()
+                if not configurations:
+                    return
+                with open(temp_config_path, "w") as file:
+                    yaml.dump(configurations, file)
+                replace(temp_config_path, self.config_path)
+                self.writes += 1
+            except Exception as ex:
+                print(f"Error in saving settings : {ex}")
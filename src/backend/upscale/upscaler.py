@@ -5,7 +5,7 @@ from backend.upscale.aura_sr_upscale import upscale_aura_sr
 from backend.upscale.tiled_upscale import generate_upscaled_image
 from context import Context
 from PIL import Image
-from state import get_settings
+from state import get_request_settings, get_settings
 
 
 config = get_settings()
@@ -28,22 +28,19 @@ def upscale_image(
         upscaled_img.save(dst_image_path)
         print(f"Upscaled image saved {dst_image_path}")
     else:
-        config.settings.lcm_diffusion_setting.strength = (
-            0.3 if config.settings.lcm_diffusion_setting.use_openvino else strength
-        )
-        config.settings.lcm_diffusion_setting.diffusion_task = (
-            DiffusionTask.image_to_image.value
+        use_openvino = config.settings.lcm_diffusion_setting.use_openvino
+        settings = get_request_settings(
+            strength=0.3 if use_openvino else strength,
+            diffusion_task=DiffusionTask.image_to_image.value,
         )
 
         generate_upscaled_image(
-            config.settings,
+            settings,
             src_image_path,
-            config.settings.lcm_diffusion_setting.strength,
+            settings.lcm_diffusion_setting.strength,
             upscale_settings=None,
             context=context,
-            tile_overlap=(
-                32 if config.settings.lcm_diffusion_setting.use_openvino else 16
-            ),
+            tile_overlap=32 if use_openvino else 16,
             output_path=dst_image_path,
             image_format=config.settings.generated_images.format,
         )
@@ -1,3 +1,5 @@
+from os import path
+
 from PIL import Image
 
 
@@ -49,3 +51,19 @@ def get_image_edit_dimensions(img, max_size=1024) -> tuple[int, int]:
     )
 
     return new_width, new_height
+
+
+def get_model_revision(model_id: str) -> str:
+    """Returns the revision of a Hugging Face model in the local cache."""
+    if path.isdir(model_id):
+        return "local"
+    try:
+        from huggingface_hub import snapshot_download
+
+        snapshot_dir = snapshot_download(
+            repo_id=model_id,
+            local_files_only=True,
+        )
+        return path.basename(snapshot_dir)[:12]
+    except Exception:
+        return "latest"
@@ -24,3 +24,36 @@ MODELS_DIRECTORY = "models"
 GGUF_THREADS = int(environ.get("GGUF_THREADS", cpus))
 TAEF1_MODEL_OPENVINO = "rupeshs/taef1-openvino"
 SAFETY_CHECKER_MODEL = "Falconsai/nsfw_image_detection"
+PIPELINE_CACHE_SIZE_MB = int(environ.get("PIPELINE_CACHE_SIZE_MB", 0))
+OPENVINO_CACHE_DIR = environ.get("OPENVINO_CACHE_DIR", "")
+OPENVINO_CACHE_SIZE_MB = int(environ.get("OPENVINO_CACHE_SIZE_MB", 8192))
+OPENVINO_SHAPE_BUCKETS = environ.get("OPENVINO_SHAPE_BUCKETS", "")
+OPENVINO_MAX_SHAPE_BUCKETS = int(environ.get("OPENVINO_MAX_SHAPE_BUCKETS", 4))
+PROMPT_EMBEDDING_CACHE_SIZE = int(environ.get("PROMPT_EMBEDDING_CACHE_SIZE", 32))
+API_QUEUE_SIZE = int(environ.get("API_QUEUE_SIZE", 8))
+API_MAX_JOBS = int(environ.get("API_MAX_JOBS", 100))
+API_JOB_TTL = int(environ.get("API_JOB_TTL", 600))
+API_MAX_BATCH_SIZE = int(environ.get("API_MAX_BATCH_SIZE", 4))
+API_BATCH_WINDOW = float(environ.get("API_BATCH_WINDOW", 0.05))
+API_WORKERS = int(environ.get("API_WORKERS", 0))
+API_WORKER_THREADS = int(environ.get("API_WORKER_THREADS", 0))
+API_ENCODER_THREADS = int(environ.get("API_ENCODER_THREADS", 4))
+SETTINGS_SAVE_DELAY = float(environ.get("SETTINGS_SAVE_DELAY", 1.0))
+IMAGE_SAVE_THREADS = int(environ.get("IMAGE_SAVE_THREADS", 2))
+IMAGE_SAVE_QUEUE_SIZE = int(environ.get("IMAGE_SAVE_QUEUE_SIZE", 16))
+IMAGE_INDEX_ENABLED = environ.get("IMAGE_INDEX", "1") != "0"
+IMAGE_INDEX_PATH = environ.get("IMAGE_INDEX_PATH", "")
+ANNOTATOR_CACHE_SIZE_MB = int(environ.get("ANNOTATOR_CACHE_SIZE_MB", 2048))
+ANNOTATOR_IDLE_TIMEOUT = int(environ.get("ANNOTATOR_IDLE_TIMEOUT", 600))
+CONTROL_IMAGE_CACHE_SIZE = int(environ.get("CONTROL_IMAGE_CACHE_SIZE", 16))
+CONTROL_IMAGE_CACHE_DIR = environ.get("CONTROL_IMAGE_CACHE_DIR", "")
+CONTROL_IMAGE_CACHE_DISK_SIZE_MB = int(
+    environ.get("CONTROL_IMAGE_CACHE_DISK_SIZE_MB", 512)
+)
+OPENVINO_NUM_THREADS = int(environ.get("OPENVINO_NUM_THREADS", 0))
+RESULT_CACHE_DIR = environ.get("RESULT_CACHE_DIR", "")
+RESULT_CACHE_SIZE_MB = int(environ.get("RESULT_CACHE_SIZE_MB", 0))
+CONTROLNET_ADAPTER_POOL_SIZE = int(environ.get("CONTROLNET_ADAPTER_POOL_SIZE", 3))
+LORA_CACHE_SIZE_MB = int(environ.get("LORA_CACHE_SIZE_MB", 1024))
+LORA_MAX_ADAPTERS = int(environ.get("LORA_MAX_ADAPTERS", 4))
+LORA_FUSE_AFTER = int(environ.get("LORA_FUSE_AFTER", 3))
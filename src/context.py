@@ -1,12 +1,19 @@
 from pprint import pprint
+from threading import Lock
 from time import perf_counter
 from traceback import print_exc
-from typing import Any
+from typing import Any, List, Optional
 
 from app_settings import Settings
+from backend.cancellation import CancellationToken, GenerationCancelled
+from backend.generation_progress import (
+    GenerationProgress,
+    GenerationProgressGroup,
+)
+from backend.generation_result import GenerationResult
 from backend.image_saver import ImageSaver
 from backend.lcm_text_to_image import LCMTextToImage
-from backend.models.lcmdiffusion_setting import DiffusionTask
+from backend.models.lcmdiffusion_setting import DiffusionTask, LCMDiffusionSetting
 from backend.utils import get_blank_image
 from models.interface_types import InterfaceType
 
@@ -19,16 +26,28 @@ class Context:
     ):
         self.interface_type = interface_type.value
         self.lcm_text_to_image = LCMTextToImage(device)
-        self._latency = 0
-        self._error = ""
+        # Cancellation tokens of the running and queued generations
+        self._cancel_tokens = set()
+        self._lock = Lock()
 
-    @property
-    def latency(self):
-        return self._latency
+    def cancel(self) -> None:
+        """Stops the generations in progress after their current denoising step."""
+        with self._lock:
+            for cancel_token in self._cancel_tokens:
+                cancel_token.cancel()
 
-    @property
-    def error(self):
-        return self._error
+    def _add_cancel_token(
+        self,
+        cancel_token: Optional[CancellationToken],
+    ) -> CancellationToken:
+        cancel_token = cancel_token or CancellationToken()
+        with self._lock:
+            self._cancel_tokens.add(cancel_token)
+        return cancel_token
+
+    def _remove_cancel_token(self, cancel_token: CancellationToken) -> None:
+        with self._lock:
+            self._cancel_tokens.discard(cancel_token)
 
     def generate_text_to_image(
         self,
@@ -36,68 +55,173 @@ class Context:
         reshape: bool = False,
         device: str = "cpu",
         save_config=True,
+        progress: Optional[GenerationProgress] = None,
+        cancel_token: Optional[CancellationToken] = None,
     ) -> Any:
-        try:
-            self._error = ""
+        """Returns the generated images, _None_ on error."""
+        result = self.generate(
+            settings,
+            reshape,
+            device,
+            save_config,
+            progress,
+            cancel_token,
+        )
+        return result.images or None
 
+    def generate(
+        self,
+        settings: Settings,
+        reshape: bool = False,
+        device: str = "cpu",
+        save_config=True,
+        progress: Optional[GenerationProgress] = None,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> GenerationResult:
+        """Generates the images of _settings_, returns them with the latency."""
+        cancel_token = self._add_cancel_token(cancel_token)
+        try:
             tick = perf_counter()
             from state import get_settings
 
-            if (
-                settings.lcm_diffusion_setting.diffusion_task
-                == DiffusionTask.text_to_image.value
-            ):
-                settings.lcm_diffusion_setting.init_image = None
+            # The generation uses its own copy of the settings, the settings
+            # of the caller are left unchanged
+            lcm_diffusion_setting = settings.lcm_diffusion_setting.copy_settings()
+            if lcm_diffusion_setting.diffusion_task == DiffusionTask.text_to_image.value:
+                lcm_diffusion_setting.init_image = None
 
-            pprint(settings.lcm_diffusion_setting.model_dump())
-            if not settings.lcm_diffusion_setting.lcm_lora:
-                return None
+            pprint(lcm_diffusion_setting.model_dump())
+            if not lcm_diffusion_setting.lcm_lora:
+                return GenerationResult([])
             self.lcm_text_to_image.init(
                 device,
-                settings.lcm_diffusion_setting,
+                lcm_diffusion_setting,
             )
+            # Pipelines have been rebuilt if requested; only the flags of
+            # the settings used are cleared, the application settings can
+            # have been changed by a concurrent request in the meantime
+            if not lcm_diffusion_setting.rebuild_pipeline:
+                settings.lcm_diffusion_setting.rebuild_pipeline = False
+            if not lcm_diffusion_setting.rebuild_controlnet_pipeline:
+                settings.lcm_diffusion_setting.rebuild_controlnet_pipeline = False
 
             if save_config:
                 get_settings().save()
 
             images = self.lcm_text_to_image.generate(
-                settings.lcm_diffusion_setting,
+                lcm_diffusion_setting,
                 reshape,
+                progress,
+                cancel_token,
+            )
+
+            elapsed = perf_counter() - tick
+            print(f"Latency : {elapsed:.2f} seconds")
+            for controlnet in lcm_diffusion_setting.get_enabled_controlnets():
+                images.append(controlnet._control_image)
+
+            self._check_images_safety(
+                lcm_diffusion_setting,
+                images,
+            )
+        except GenerationCancelled as exception:
+            print("Generation cancelled")
+            return GenerationResult([], error=str(exception))
+        except Exception as exception:
+            print(f"Error in generating images: {exception}")
+            print_exc()
+            return GenerationResult([], error=str(exception))
+        finally:
+            self._remove_cancel_token(cancel_token)
+            if progress:
+                progress.finish()
+        return GenerationResult(list(images) if images else [], elapsed)
+
+    def generate_batch(
+        self,
+        lcm_diffusion_settings: List[LCMDiffusionSetting],
+        device: str = "cpu",
+        progress: Optional[GenerationProgressGroup] = None,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> List[GenerationResult]:
+        """
+        Generates the images of text to image settings using the same model
+        and generation parameters in one batch, returns the result of each
+        setting.
+        """
+        cancel_token = self._add_cancel_token(cancel_token)
+        try:
+            tick = perf_counter()
+            lcm_diffusion_settings = [
+                lcm_diffusion_setting.copy_settings(init_image=None)
+                for lcm_diffusion_setting in lcm_diffusion_settings
+            ]
+            self.lcm_text_to_image.init(
+                device,
+                lcm_diffusion_settings[0],
+            )
+            batch_images = self.lcm_text_to_image.generate_batch(
+                lcm_diffusion_settings,
+                progress,
+                cancel_token,
             )
 
             elapsed = perf_counter() - tick
-            self._latency = elapsed
             print(f"Latency : {elapsed:.2f} seconds")
-            if settings.lcm_diffusion_setting.controlnet:
-                if settings.lcm_diffusion_setting.controlnet.enabled:
-                    images.append(
-                        settings.lcm_diffusion_setting.controlnet._control_image
-                    )
-
-            if settings.lcm_diffusion_setting.use_safety_checker:
-                print("Safety Checker is enabled")
-                from state import get_safety_checker
-
-                safety_checker = get_safety_checker()
-                blank_image = get_blank_image(
-                    settings.lcm_diffusion_setting.image_width,
-                    settings.lcm_diffusion_setting.image_height,
-                )
-                for idx, image in enumerate(images):
-                    if not safety_checker.is_safe(image):
-                        images[idx] = blank_image
+            for lcm_diffusion_setting, images in zip(
+                lcm_diffusion_settings,
+                batch_images,
+            ):
+                self._check_images_safety(lcm_diffusion_setting, images)
+        except GenerationCancelled as exception:
+            print("Generation cancelled")
+            error = str(exception)
+            return [GenerationResult([], error=error) for _ in lcm_diffusion_settings]
         except Exception as exception:
             print(f"Error in generating images: {exception}")
-            self._error = str(exception)
             print_exc()
-            return None
-        return images
+            error = str(exception)
+            return [GenerationResult([], error=error) for _ in lcm_diffusion_settings]
+        finally:
+            self._remove_cancel_token(cancel_token)
+            if progress:
+                progress.finish()
+        return [
+            GenerationResult(list(images) if images else [], elapsed)
+            for images in batch_images
+        ]
+
+    def _check_images_safety(
+        self,
+        lcm_diffusion_setting: LCMDiffusionSetting,
+        images: Any,
+    ) -> None:
+        if not lcm_diffusion_setting.use_safety_checker:
+            return
+        print("Safety Checker is enabled")
+        from state import get_safety_checker
+
+        safety_checker = get_safety_checker()
+        blank_image = get_blank_image(
+            lcm_diffusion_setting.image_width,
+            lcm_diffusion_setting.image_height,
+        )
+        for idx, image in enumerate(images):
+            if not safety_checker.is_safe(image):
+                images[idx] = blank_image
 
     def save_images(
         self,
         images: Any,
         settings: Settings,
+        wait_saved: bool = False,
+        latency: Optional[float] = None,
     ) -> list[str]:
+        """
+        Saves _images_ in the background, returns their file names; with
+        _wait_saved_ the files are written when it returns. The generation
+        _latency_ is recorded in the image index.
+        """
         saved_images = []
         if images and settings.generated_images.save_image:
             saved_images = ImageSaver.save_images(
@@ -106,5 +230,9 @@ class Context:
                 lcm_diffusion_setting=settings.lcm_diffusion_setting,
                 format=settings.generated_images.format,
                 jpeg_quality=settings.generated_images.save_image_quality,
+                png_compress_level=settings.generated_images.png_compress_level,
+                webp_lossless=settings.generated_images.webp_lossless,
+                wait_saved=wait_saved,
+                latency=latency,
             )
         return saved_images
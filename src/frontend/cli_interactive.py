@@ -12,7 +12,6 @@ from backend.lora import (
     update_lora_weights,
     load_lora_weight,
 )
-from backend.controlnet import get_controlnet_pipeline
 from backend.models.lcmdiffusion_setting import (
     DiffusionTask,
     ControlNetSetting,
@@ -136,14 +135,9 @@ def interactive_controlnet(
         interactive CLI menu; _True_ if called from the main menu, _False_ otherwise
     """
     settings = config.lcm_diffusion_setting
-    if not settings.controlnet:
+    if not settings.controlnet or isinstance(settings.controlnet, list):
         settings.controlnet = ControlNetSetting()
 
-    current_enabled = settings.controlnet.enabled
-    current_adapter_path = settings.controlnet.adapter_path
-    current_conditioning_scale = settings.controlnet.conditioning_scale
-    current_control_image = settings.controlnet._control_image
-
     option = input("Enable ControlNet? (y/N): ")
     settings.controlnet.enabled = True if option.upper() == "Y" else False
     if settings.controlnet.enabled:
@@ -174,28 +168,8 @@ def interactive_controlnet(
             print("Invalid ControlNet settings! Disabling ControlNet")
             settings.controlnet.enabled = False
 
-    if (
-        settings.controlnet.enabled != current_enabled
-        or settings.controlnet.adapter_path != current_adapter_path
-    ):
-        # Rebuild ControlNet pipelines from the base pipeline
-        # settings.rebuild_pipeline = True
-        if context.lcm_text_to_image.controlnet_pipeline:
-            del context.lcm_text_to_image.controlnet_pipeline
-            context.lcm_text_to_image.controlnet_pipeline = None
-        if context.lcm_text_to_image.controlnet_img2img_pipeline:
-            del context.lcm_text_to_image.controlnet_img2img_pipeline
-            context.lcm_text_to_image.controlnet_img2img_pipeline = None
-        context.lcm_text_to_image.controlnet_pipeline = get_controlnet_pipeline(
-            context.lcm_text_to_image.pipeline,
-            settings,
-            DiffusionTask.text_to_image,
-        )
-        context.lcm_text_to_image.controlnet_img2img_pipeline = get_controlnet_pipeline(
-            context.lcm_text_to_image.pipeline,
-            settings,
-            DiffusionTask.image_to_image,
-        )
+    # The ControlNet pipelines are rebuilt on the next generation if the
+    # enabled ControlNet adapters have changed
 
 
 def interactive_lora(
@@ -246,7 +220,6 @@ def interactive_lora(
     elif option == 2:
         # Load a new LoRA
         settings = config.lcm_diffusion_setting
-        settings.lora.fuse = False
         settings.lora.enabled = False
         settings.lora.path = input("Enter LoRA model path: ")
         settings.lora.weight = user_value(
@@ -370,13 +343,14 @@ def interactive_txt2img(
             user_input = config.lcm_diffusion_setting.prompt
         config.lcm_diffusion_setting.prompt = user_input
         for _ in range(0, _batch_count):
-            images = context.generate_text_to_image(
+            result = context.generate(
                 settings=config,
                 device=DEVICE,
             )
             context.save_images(
-                images,
+                result.images,
                 config,
+                latency=result.latency,
             )
         if _edit_lora_settings:
             interactive_lora(
@@ -412,13 +386,14 @@ def interactive_img2img(
         settings.init_image = Image.open(source_path)
         settings.prompt = user_input
         for _ in range(0, _batch_count):
-            images = context.generate_text_to_image(
+            result = context.generate(
                 settings=config,
                 device=DEVICE,
             )
             context.save_images(
-                images,
+                result.images,
                 config,
+                latency=result.latency,
             )
         new_path = input(f"Image path ({source_path}): ")
         if new_path != "":
@@ -63,8 +63,9 @@ class MainWindow(QMainWindow):
         # default; in GUI mode, the user must explicitly enable those
         if self.config.settings.lcm_diffusion_setting.lora:
             self.config.settings.lcm_diffusion_setting.lora.enabled = False
-        if self.config.settings.lcm_diffusion_setting.controlnet:
-            self.config.settings.lcm_diffusion_setting.controlnet.enabled = False
+        lcm_diffusion_setting = self.config.settings.lcm_diffusion_setting
+        for controlnet in lcm_diffusion_setting.get_enabled_controlnets():
+            controlnet.enabled = False
         self.setWindowTitle(APP_NAME)
         self.setFixedSize(QSize(600, 670))
         self.init_ui()
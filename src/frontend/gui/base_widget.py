@@ -92,14 +92,16 @@ class BaseWidget(QWidget):
         self.config.settings.lcm_diffusion_setting.negative_prompt = (
             self.neg_prompt.toPlainText()
         )
-        images = self.parent.context.generate_text_to_image(
+        result = self.parent.context.generate(
             self.config.settings,
             self.config.reshape_required,
             DEVICE,
         )
+        images = result.images or None
         self.parent.context.save_images(
             images,
             self.config.settings,
+            latency=result.latency,
         )
         self.prepare_images(images)
         self.after_generation()
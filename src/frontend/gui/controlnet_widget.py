@@ -27,7 +27,7 @@ from app_settings import AppSettings
 from PyQt5.QtGui import QPixmap, QDesktopServices, QDragEnterEvent, QDropEvent
 from paths import FastStableDiffusionPaths
 from backend.models.lcmdiffusion_setting import DiffusionTask, ControlNetSetting
-from backend.annotators.image_control_factory import ImageControlFactory
+from backend.annotators.control_image_cache import control_image_cache
 from frontend.gui.common_widgets import LabeledSlider, ImageLabel
 
 if __name__ != "__main__":
@@ -138,10 +138,9 @@ class ControlNetWidget(QWidget):
         _current_controlnet_image = Image.open(self.image_label.path)
         selected_preprocessor = self.radio_buttons_group.checkedButton().text()
         if selected_preprocessor != "None":
-            image_control_factory = ImageControlFactory()
-            control = image_control_factory.create_control(selected_preprocessor)
-            _current_controlnet_image = control.get_control_image(
-                _current_controlnet_image
+            _current_controlnet_image = control_image_cache.get_control_image(
+                _current_controlnet_image,
+                selected_preprocessor,
             )
         self.update_controlnet_settings()
 
@@ -174,7 +173,8 @@ class ControlNetWidget(QWidget):
         global _current_controlnet_image
         global _controlnet_models_map
         settings = app_settings.settings.lcm_diffusion_setting
-        if settings.controlnet is None:
+        # The GUI edits a single ControlNet
+        if settings.controlnet is None or isinstance(settings.controlnet, list):
             settings.controlnet = ControlNetSetting()
         if not _current_controlnet_enabled:
             settings.controlnet.enabled = False
@@ -185,8 +185,8 @@ class ControlNetWidget(QWidget):
             ]
             settings.controlnet.conditioning_scale = _current_controlnet_weight
             settings.controlnet._control_image = _current_controlnet_image
-        # Rebuild ControlNet pipelines from the base pipeline
-        settings.rebuild_controlnet_pipeline = True
+        # The ControlNet pipelines are rebuilt on the next generation if the
+        # enabled ControlNet adapters have changed
 
     def controlnet_file_dialog(self):
         fileName = QFileDialog.getOpenFileName(
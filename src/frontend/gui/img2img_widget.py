@@ -100,12 +100,17 @@ class Img2ImgWidget(BaseWidget):
         )
         self.config.settings.lcm_diffusion_setting.strength = self.strength.value() / 10
 
-        images = self.parent.context.generate_text_to_image(
+        result = self.parent.context.generate(
             self.config.settings,
             self.config.reshape_required,
             DEVICE,
         )
-        self.parent.context.save_images(images, self.config.settings)
+        images = result.images or None
+        self.parent.context.save_images(
+            images,
+            self.config.settings,
+            latency=result.latency,
+        )
         self.prepare_images(images)
         self.after_generation()
 
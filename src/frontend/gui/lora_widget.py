@@ -137,7 +137,6 @@ class LoraModelsWidget(QWidget):
 
         # Load a new LoRA
         settings = self.config.settings.lcm_diffusion_setting
-        settings.lora.fuse = False
         settings.lora.enabled = False
         current_lora = self.models_combobox.currentText()
         current_weight = self.weight_slider.getValue()
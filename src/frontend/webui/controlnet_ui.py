@@ -3,11 +3,9 @@ from PIL import Image
 from backend.lora import get_lora_models
 from state import get_settings, get_context
 from backend.models.lcmdiffusion_setting import ControlNetSetting
-from backend.annotators.image_control_factory import ImageControlFactory
+from backend.annotators.control_image_cache import control_image_cache
 
 _controlnet_models_map = None
-_controlnet_enabled = False
-_adapter_path = None
 
 app_settings = get_settings()
 
@@ -24,7 +22,8 @@ def on_user_input(
         return gr.Checkbox(value=False)
 
     settings = app_settings.settings.lcm_diffusion_setting
-    if settings.controlnet is None:
+    # The WebUI edits a single ControlNet
+    if settings.controlnet is None or isinstance(settings.controlnet, list):
         settings.controlnet = ControlNetSetting()
 
     if enable and (adapter_name is None or adapter_name == ""):
@@ -40,9 +39,10 @@ def on_user_input(
     if preprocessor == "None":
         processed_control_image = control_image
     else:
-        image_control_factory = ImageControlFactory()
-        control = image_control_factory.create_control(preprocessor)
-        processed_control_image = control.get_control_image(control_image)
+        processed_control_image = control_image_cache.get_control_image(
+            control_image,
+            preprocessor,
+        )
 
     if not enable:
         settings.controlnet.enabled = False
@@ -52,19 +52,8 @@ def on_user_input(
         settings.controlnet.conditioning_scale = float(conditioning_scale)
         settings.controlnet._control_image = processed_control_image
 
-    # This code can be improved; currently, if the user clicks the
-    # "Enable ControlNet" checkbox or changes the currently selected
-    # ControlNet model, it will trigger a ControlNet pipeline rebuild
-    # even if, in the end, the user leaves the same ControlNet settings
-    global _controlnet_enabled
-    global _adapter_path
-    if settings.controlnet.enabled != _controlnet_enabled or (
-        settings.controlnet.enabled
-        and settings.controlnet.adapter_path != _adapter_path
-    ):
-        settings.rebuild_controlnet_pipeline = True
-        _controlnet_enabled = settings.controlnet.enabled
-        _adapter_path = settings.controlnet.adapter_path
+    # The ControlNet pipelines are rebuilt on the next generation if the
+    # enabled ControlNet adapters have changed
     return gr.Checkbox(value=enable)
 
 
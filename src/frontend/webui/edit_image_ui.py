@@ -8,7 +8,12 @@ from constants import DEVICE
 from frontend.utils import is_reshape_required
 from frontend.webui.errors import show_error
 from models.interface_types import InterfaceType
-from state import get_context, get_edit_image_prompts, get_settings
+from state import (
+    get_context,
+    get_edit_image_prompts,
+    get_request_settings,
+    get_settings,
+)
 
 app_settings = get_settings()
 image_edit_prompts = get_edit_image_prompts()
@@ -35,19 +40,18 @@ def edit_image(
         previous_num_of_images, \
         app_settings
 
-    app_settings.settings.lcm_diffusion_setting.prompt = prompt
-    app_settings.settings.lcm_diffusion_setting.negative_prompt = ""
-    app_settings.settings.lcm_diffusion_setting.init_image = init_image
-
-    app_settings.settings.lcm_diffusion_setting.diffusion_task = (
-        DiffusionTask.edit_image.value
+    settings = get_request_settings(
+        prompt=prompt,
+        negative_prompt="",
+        init_image=init_image,
+        diffusion_task=DiffusionTask.edit_image.value,
     )
-    model_id = app_settings.settings.lcm_diffusion_setting.openvino_lcm_model_id
+    model_id = settings.lcm_diffusion_setting.openvino_lcm_model_id
     reshape = False
-    image_width = app_settings.settings.lcm_diffusion_setting.image_width
-    image_height = app_settings.settings.lcm_diffusion_setting.image_height
-    num_images = app_settings.settings.lcm_diffusion_setting.number_of_images
-    if app_settings.settings.lcm_diffusion_setting.use_openvino:
+    image_width = settings.lcm_diffusion_setting.image_width
+    image_height = settings.lcm_diffusion_setting.image_height
+    num_images = settings.lcm_diffusion_setting.number_of_images
+    if settings.lcm_diffusion_setting.use_openvino:
         reshape = is_reshape_required(
             previous_width,
             image_width,
@@ -61,19 +65,21 @@ def edit_image(
 
     with ThreadPoolExecutor(max_workers=1) as executor:
         future = executor.submit(
-            context.generate_text_to_image,
-            app_settings.settings,
+            context.generate,
+            settings,
             reshape,
             DEVICE,
         )
-        images = future.result()
+        result = future.result()
+        images = result.images
         if images:
             context.save_images(
                 images,
-                app_settings.settings,
+                settings,
+                latency=result.latency,
             )
         else:
-            show_error(context.error)
+            show_error(result.error)
 
     previous_width = image_width
     previous_height = image_height
@@ -60,6 +60,8 @@ def on_offline_checkbox(offline_checkbox):
 def on_change_image_format(image_format):
     if image_format == "PNG":
         app_settings.settings.generated_images.format = ImageFormat.PNG.value.upper()
+    elif image_format == "WEBP":
+        app_settings.settings.generated_images.format = ImageFormat.WEBP.value.upper()
     else:
         app_settings.settings.generated_images.format = ImageFormat.JPEG.value.upper()
 
@@ -160,7 +162,7 @@ def get_generation_settings_ui() -> None:
                 )
                 img_format = gr.Radio(
                     label="Output image format",
-                    choices=["PNG", "JPEG"],
+                    choices=["PNG", "JPEG", "WEBP"],
                     value=app_settings.settings.generated_images.format,
                     interactive=True,
                 )
@@ -51,7 +51,6 @@ def on_click_load_lora(lora_name, lora_weight):
 
     # Load a new LoRA
     settings = app_settings.settings.lcm_diffusion_setting
-    settings.lora.fuse = False
     settings.lora.enabled = False
     print(f"Selected Lora Model :{lora_name}")
     print(f"Lora weight :{lora_weight}")
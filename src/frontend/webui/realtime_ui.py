@@ -4,6 +4,7 @@ from time import perf_counter
 
 import gradio as gr
 import numpy as np
+from backend.cancellation import CancellationToken, GenerationCancelled
 from backend.device import get_device_name, is_openvino_device
 from backend.lcm_text_to_image import LCMTextToImage
 from backend.models.lcmdiffusion_setting import LCMDiffusionSetting, LCMLora
@@ -15,6 +16,7 @@ lcm_lora = LCMLora(
     base_model_id="Lykon/dreamshaper-8",
     lcm_lora_id="latent-consistency/lcm-lora-sdv1-5",
 )
+cancel_token = CancellationToken()
 
 
 # https://github.com/gradio-app/gradio/issues/2635#issuecomment-1423531319
@@ -30,11 +32,19 @@ def encode_pil_to_base64_new(pil_image):
 gr.processing_utils.encode_pil_to_base64 = encode_pil_to_base64_new
 
 
+def cancel_generation():
+    # A new prompt makes the image being generated obsolete
+    cancel_token.cancel()
+
+
 def predict(
     prompt,
     steps,
     seed,
 ):
+    global cancel_token
+    cancel_token = CancellationToken()
+    token = cancel_token
     lcm_diffusion_setting = LCMDiffusionSetting()
     lcm_diffusion_setting.openvino_lcm_model_id = "rupeshs/sdxs-512-0.9-openvino"
     lcm_diffusion_setting.prompt = prompt
@@ -52,7 +62,14 @@ def predict(
     )
     start = perf_counter()
 
-    images = lcm_text_to_image.generate(lcm_diffusion_setting)
+    try:
+        images = lcm_text_to_image.generate(
+            lcm_diffusion_setting,
+            cancel_token=token,
+        )
+    except GenerationCancelled:
+        print("Generation cancelled")
+        return gr.skip()
     latency = perf_counter() - start
     print(f"Latency: {latency:.2f} seconds")
     return images[0]
@@ -134,7 +151,15 @@ with gr.Blocks(css=css) as demo:
         gr.HTML(_get_footer_message())
 
         inputs = [prompt, steps, seed]
-        prompt.input(fn=predict, inputs=inputs, outputs=image, show_progress=False)
+        prompt.input(
+            fn=cancel_generation,
+            queue=False,
+        ).then(
+            fn=predict,
+            inputs=inputs,
+            outputs=image,
+            show_progress=False,
+        )
         generate_btn.click(
             fn=predict, inputs=inputs, outputs=image, show_progress=False
         )
@@ -3,7 +3,7 @@ from typing import Any
 from backend.models.lcmdiffusion_setting import DiffusionTask
 from models.interface_types import InterfaceType
 from constants import DEVICE
-from state import get_settings, get_context
+from state import get_context, get_request_settings, get_settings
 from frontend.utils import is_reshape_required
 from concurrent.futures import ThreadPoolExecutor
 from frontend.webui.errors import show_error
@@ -27,17 +27,17 @@ def generate_text_to_image(
         previous_model_id, \
         previous_num_of_images, \
         app_settings
-    app_settings.settings.lcm_diffusion_setting.prompt = prompt
-    app_settings.settings.lcm_diffusion_setting.negative_prompt = neg_prompt
-    app_settings.settings.lcm_diffusion_setting.diffusion_task = (
-        DiffusionTask.text_to_image.value
+    settings = get_request_settings(
+        prompt=prompt,
+        negative_prompt=neg_prompt,
+        diffusion_task=DiffusionTask.text_to_image.value,
     )
-    model_id = app_settings.settings.lcm_diffusion_setting.openvino_lcm_model_id
+    model_id = settings.lcm_diffusion_setting.openvino_lcm_model_id
     reshape = False
-    image_width = app_settings.settings.lcm_diffusion_setting.image_width
-    image_height = app_settings.settings.lcm_diffusion_setting.image_height
-    num_images = app_settings.settings.lcm_diffusion_setting.number_of_images
-    if app_settings.settings.lcm_diffusion_setting.use_openvino:
+    image_width = settings.lcm_diffusion_setting.image_width
+    image_height = settings.lcm_diffusion_setting.image_height
+    num_images = settings.lcm_diffusion_setting.number_of_images
+    if settings.lcm_diffusion_setting.use_openvino:
         reshape = is_reshape_required(
             previous_width,
             image_width,
@@ -51,19 +51,21 @@ def generate_text_to_image(
 
     with ThreadPoolExecutor(max_workers=1) as executor:
         future = executor.submit(
-            context.generate_text_to_image,
-            app_settings.settings,
+            context.generate,
+            settings,
             reshape,
             DEVICE,
         )
-        images = future.result()
+        result = future.result()
+        images = result.images
         if images:
             context.save_images(
                 images,
-                app_settings.settings,
+                settings,
+                latency=result.latency,
             )
         else:
-            show_error(context.error)
+            show_error(result.error)
 
     previous_width = image_width
     previous_height = image_height
@@ -89,6 +91,10 @@ def get_text_to_image_ui() -> None:
                         elem_id="generate_button",
                         scale=0,
                     )
+                    stop_btn = gr.Button(
+                        "Stop",
+                        scale=0,
+                    )
                 negative_prompt = gr.Textbox(
                     label="Negative prompt (Works in LCM-LoRA mode, set guidance > 1.0) :",
                     lines=1,
@@ -110,3 +116,7 @@ def get_text_to_image_ui() -> None:
         inputs=input_params,
         outputs=output,
     )
+    stop_btn.click(
+        fn=lambda: get_context(InterfaceType.WEBUI).cancel(),
+        queue=False,
+    )
@@ -60,8 +60,9 @@ def get_web_ui() -> gr.Blocks:
     # default; in WebUI mode, the user must explicitly enable those
     if app_settings.settings.lcm_diffusion_setting.lora:
         app_settings.settings.lcm_diffusion_setting.lora.enabled = False
-    if app_settings.settings.lcm_diffusion_setting.controlnet:
-        app_settings.settings.lcm_diffusion_setting.controlnet.enabled = False
+    lcm_diffusion_setting = app_settings.settings.lcm_diffusion_setting
+    for controlnet in lcm_diffusion_setting.get_enabled_controlnets():
+        controlnet.enabled = False
     theme = gr.themes.Default(
         primary_hue="blue",
     )
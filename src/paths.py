@@ -99,6 +99,26 @@ class FastStableDiffusionPaths:
         guuf_models_path = join_paths(models_path, "gguf")
         return guuf_models_path
 
+    @staticmethod
+    def get_openvino_cache_path() -> str:
+        if constants.OPENVINO_CACHE_DIR:
+            return constants.OPENVINO_CACHE_DIR
+        models_path = join_paths(get_app_path(), constants.MODELS_DIRECTORY)
+        openvino_cache_path = join_paths(models_path, "openvino_cache")
+        return openvino_cache_path
+
+    @staticmethod
+    def get_image_index_path() -> str:
+        if constants.IMAGE_INDEX_PATH:
+            return constants.IMAGE_INDEX_PATH
+        return join_paths(get_configs_path(), "image_index.db")
+
+    @staticmethod
+    def get_result_cache_path() -> str:
+        if constants.RESULT_CACHE_DIR:
+            return constants.RESULT_CACHE_DIR
+        return join_paths(get_app_path(), "results_cache")
+
 
 def get_base_folder_name(path: str) -> str:
     return os.path.basename(path)
@@ -1,7 +1,9 @@
 from app_settings import AppSettings
-from typing import Optional
+from typing import Any, Optional
 
+from backend.models.lcmdiffusion_setting import LCMDiffusionSetting
 from context import Context
+from models.settings import Settings
 from models.interface_types import InterfaceType
 from backend.safety_checker import SafetyChecker
 
@@ -28,6 +30,26 @@ def get_settings(skip_file: bool = False) -> AppSettings:
     return state.settings
 
 
+def get_request_settings(
+    lcm_diffusion_setting: Optional[LCMDiffusionSetting] = None,
+    **updates: Any,
+) -> Settings:
+    """
+    Returns the settings of a single generation: the application settings
+    with _lcm_diffusion_setting_ or with the generation setting _updates_.
+    The application settings are only used as defaults, they are not modified.
+    """
+    settings = get_settings().settings
+    if lcm_diffusion_setting is None:
+        lcm_diffusion_setting = settings.lcm_diffusion_setting
+    return settings.model_copy(
+        update={
+            "lcm_diffusion_setting": lcm_diffusion_setting.copy_settings(**updates),
+            "generated_images": settings.generated_images.model_copy(),
+        }
+    )
+
+
 def get_context(interface_type: InterfaceType) -> Context:
     state = get_state()
     if state.context is None:
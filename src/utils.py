@@ -27,6 +27,8 @@ def get_image_file_extension(image_format: str) -> str:
         return ".jpg"
     elif image_format == "PNG":
         return ".png"
+    elif image_format == "WEBP":
+        return ".webp"
 
 
 def get_files_in_dir(root_dir: str) -> List: